@@ -1,15 +1,47 @@
 # mobility_pipeline/__init__.py
+from lazy_imports import lazy_import
 
-from pipeline import MobilityPipeline
-from cdr_processor import CDRProcessor
 #from .staypoint_detector import StaypointDetector
 #from .trip_segmenter import TripSegmenter
-from utils_geometry import GeometryUtils
+
+# Public name -> defining module; modules are imported on first attribute access,
+# so importing the package does not pull in trackintel / infostop / geopandas
+_EXPORTS = {
+    "MobilityPipeline": "pipeline",
+    "CDRProcessor": "cdr_processor",
+    "GeometryUtils": "utils_geometry",
+    "SectorCache": "sector_cache",
+    "TowerIndex": "towers",
+    "CDRSchema": "schema",
+    "EventCompressor": "event_compression",
+    "NativeStopEngine": "stop_engines",
+    "ZoneIndex": "od_matrix",
+    "ODMatrix": "od_matrix",
+    "ResultsWriter": "results_io",
+    "ResultsReader": "results_io",
+    "StageProfiler": "profiler",
+}
 
 __all__ = [
     "MobilityPipeline",
     "CDRProcessor",
     #"StaypointDetector",
    # "TripSegmenter",
-    "GeometryUtils"
+    "GeometryUtils",
+    "SectorCache",
+    "TowerIndex",
+    "CDRSchema",
+    "EventCompressor",
+    "NativeStopEngine",
+    "ZoneIndex",
+    "ODMatrix",
+    "ResultsWriter",
+    "ResultsReader",
+    "StageProfiler"
 ]
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(lazy_import(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
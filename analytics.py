@@ -3,25 +3,46 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 import trackintel as ti
+from kinematics import Kinematics
+from home_work import HomeWorkEngine
 
 class MobilityAnalytics:
-    def __init__(self, tz="Europe/Lisbon"):
+    HOME_WORK_ENGINES = ("osna", "vectorized")
+
+    def __init__(self, tz="Europe/Lisbon", home_work_engine="osna", home_work_split="midpoint"):
         self.tz = tz
+        # "osna": trackintel's osna_method; "vectorized": HomeWorkEngine (same labels with split="midpoint")
+        self.home_work_engine = home_work_engine
+        self.home_work_split = home_work_split
+        self.home_work = HomeWorkEngine()
 
     # ---------- HOME / WORK on staypoints ----------
-    def annotate_home_work(self, sps: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    def annotate_home_work(self, sps: gpd.GeoDataFrame, engine: str = None) -> gpd.GeoDataFrame:
         """
         Adds home/work labels to staypoints using Trackintel's OSNA method.
         Expects staypoints columns at least:
           ['user_id', 'started_at', 'finished_at', 'geometry']
         Returns sps with columns:
-          ['location_id', 'home','work'] (booleans or ints depending on TI version)
+          ['location_id', 'purpose'] ('home' / 'work' / missing)
+        engine overrides self.home_work_engine ("osna" or "vectorized").
         """
+        engine = engine or self.home_work_engine
+        if engine not in self.HOME_WORK_ENGINES:
+            raise ValueError(f"engine must be one of {self.HOME_WORK_ENGINES}, got {engine!r}")
+
         sps = sps.copy()
         # Your mapping: location_id = stop_id
         if "stop_id" in sps.columns:
             sps["location_id"] = sps["stop_id"]
 
+        if engine == "vectorized":
+            purpose = self.home_work.purpose(
+                sps["user_id"].to_numpy(), sps["location_id"].to_numpy(),
+                sps["started_at"], sps["finished_at"], split=self.home_work_split
+            )
+            sps["purpose"] = pd.Series(purpose, index=sps.index, dtype=object)
+            return sps
+
         # Run OSNA home/work detection
         # (TI may add 'home'/'work' columns or a 'purpose' column; keep both if present)
         sps = ti.analysis.osna_method(sps)
@@ -39,6 +60,10 @@ class MobilityAnalytics:
         If your TI version exposes a different entrypoint, swap the call here.
         """
         tpls = tpls.copy()
+        if tpls.empty:
+            # TI hands back a plain GeoDataFrame when no triplegs could be generated
+            tpls["mode"] = pd.Series(dtype=object)
+            return tpls
         # Your exact call
         if hasattr(tpls, "predict_transport_mode"):
             tpls = tpls.predict_transport_mode()
@@ -49,43 +74,20 @@ class MobilityAnalytics:
         return tpls
 
     # ---------- METRICS for TRIPLEGS ----------
-    def add_tripleg_metrics(self, tpls: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    def add_tripleg_metrics(self, tpls: gpd.GeoDataFrame, inplace: bool = False) -> gpd.GeoDataFrame:
         """
-        Adds 'length' (meters), 'duration_minutes', 'speed_kmh' to triplegs.
-        Uses Trackintel geogr utils where available.
+        Adds 'length' (meters), 'duration_minutes', 'speed_kmh' to triplegs,
+        plus 'speed_mps_geogr' (length / duration, m/s, as TI's tpls_speed).
         Requires columns: ['started_at','finished_at','geometry']
+        inplace=True writes the columns into tpls instead of a copy.
         """
-        tpls = tpls.copy()
-
-        # Length (meters) via Haversine
-        tpls["length"] = ti.geogr.calculate_haversine_length(tpls)
-
-        # Duration (minutes)
-        tpls["started_at"] = pd.to_datetime(tpls["started_at"])
-        tpls["finished_at"] = pd.to_datetime(tpls["finished_at"])
-        tpls["duration_minutes"] = (tpls["finished_at"] - tpls["started_at"]).dt.total_seconds() / 60.0
-
-        # Speed (km/h) — guard against division by zero
-        tpls["speed_kmh"] = (tpls["length"] / 1000.0) / (tpls["duration_minutes"] / 60.0)
-        tpls.loc[tpls["duration_minutes"] <= 0, "speed_kmh"] = np.nan
-
-        # If available: TI’s helper for tripleg speed (m/s); keep as reference
-        if hasattr(ti.geogr, "get_speed_triplegs"):
-            spd = ti.geogr.get_speed_triplegs(tpls)  # m/s
-            # Align index if needed
-            spd = pd.Series(spd, index=tpls.index)
-            tpls["speed_mps_geogr"] = spd
-        return tpls
+        return Kinematics.tripleg_metrics(tpls, inplace=inplace)
 
     # ---------- SPEED for POSITIONFIXES ----------
-    def add_pfs_speed(self, pfs: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    def add_pfs_speed(self, pfs: gpd.GeoDataFrame, by=("user_id",), inplace: bool = False) -> gpd.GeoDataFrame:
         """
-        Adds instantaneous speed on positionfixes via TI helper if available.
+        Adds per-fix 'speed_mps', 'speed_kmh' and 'accel_mps2', computed from the
+        previous fix of the same user (or of the same `by` group, e.g.
+        ("user_id", "tripleg_id")).
         """
-        pfs = pfs.copy()
-        if hasattr(ti.geogr, "get_speed_positionfixes"):
-            sp = ti.geogr.get_speed_positionfixes(pfs)  # m/s
-            sp = pd.Series(sp, index=pfs.index)
-            pfs["speed_mps"] = sp
-            pfs["speed_kmh"] = pfs["speed_mps"] * 3.6
-        return pfs
+        return Kinematics.pfs_kinematics(pfs, by=by, inplace=inplace)
@@ -0,0 +1,2 @@
+# mobility_pipeline/benchmarks/__init__.py
+from .synthetic import make_network, make_water, make_cdr, make_dataset
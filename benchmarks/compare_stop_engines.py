@@ -0,0 +1,119 @@
+# mobility_pipeline/benchmarks/compare_stop_engines.py
+"""
+Stop-detection engines side by side on synthetic CDRs: runtime and how far
+their stop_id labels agree with InfoStop (and with the generator's true
+stops). Run from the repository root:
+
+    python -m benchmarks.compare_stop_engines --users 1000 5000 --label my-branch
+
+Each size is enriched once (CDRProcessor) and prepared once; every engine
+then labels the same traces. Per engine and size the report has the
+fit_predict wall time, stop / location counts and, against the reference
+engine (infostop when installed): the share of rows with the same
+stop / non-stop call and the adjusted Rand index of the location labels on
+rows both call stops. --noise adds Gaussian jitter (degrees) to the
+positions, as GPS-like data would have. The report goes to
+benchmarks/results/stop-engines-<label>.json.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cdr_processor import CDRProcessor
+from infostop_detector import InfoStopDetector
+from benchmarks.synthetic import make_dataset
+from benchmarks.run_benchmarks import HAS_INFOSTOP, RESULTS_DIR, environment
+
+logger = logging.getLogger("MobilityPipeline.Benchmark")
+
+
+def agreement(labels, reference):
+    """Stop / non-stop agreement and ARI of location labels on rows both call stops."""
+    from sklearn.metrics import adjusted_rand_score
+    both = (labels >= 0) & (reference >= 0)
+    return {
+        "stop_agreement": round(float(np.mean((labels >= 0) == (reference >= 0))), 4),
+        "location_ari": round(float(adjusted_rand_score(reference[both], labels[both])), 4) if both.any() else None,
+    }
+
+
+def run_size(n_users, engines, events_per_user, n_towers, days, noise, seed):
+    df, _, water = make_dataset(n_users=n_users, events_per_user=events_per_user, n_towers=n_towers,
+                                days=days, seed=seed)
+    # InfoStop rejects NaN positions (events in water-masked sectors)
+    enriched = CDRProcessor().process(df, water).dropna(subset=["est_lat", "est_lon"])
+    detector = InfoStopDetector()
+    prepared, traces, _ = detector.prepare(enriched)
+    if noise:
+        rng = np.random.default_rng(seed)
+        traces = [tr + np.column_stack([rng.normal(0, noise, (len(tr), 2)), np.zeros(len(tr))]) for tr in traces]
+
+    labels, runs = {}, []
+    for engine in engines:
+        model = InfoStopDetector.make_engine(engine, detector.params)
+        start = time.perf_counter()
+        labels[engine] = np.concatenate(model.fit_predict(traces))
+        wall = time.perf_counter() - start
+        lab = labels[engine]
+        runs.append({"engine": engine, "users": n_users, "rows": len(lab), "wall_s": round(wall, 4),
+                     "stop_rows": int((lab >= 0).sum()), "locations": int(len(np.unique(lab[lab >= 0])))})
+        logger.info("%s, %d users: %.2fs", engine, n_users, wall)
+
+    reference = engines[0]
+    truth = prepared["true_stop_id"].to_numpy() if "true_stop_id" in prepared.columns else None
+    for run in runs:
+        if run["engine"] != reference:
+            run["vs_" + reference] = agreement(labels[run["engine"]], labels[reference])
+        if truth is not None and not noise:
+            run["vs_truth"] = agreement(labels[run["engine"]], truth)
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="mobility4py stop-engine comparison")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000])
+    parser.add_argument("--engines", nargs="+", choices=InfoStopDetector.ENGINES, default=None,
+                        help="first one is the reference (default: infostop, native)")
+    parser.add_argument("--events-per-user", type=int, default=100)
+    parser.add_argument("--towers", type=int, default=300)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--noise", type=float, default=0.0, help="position jitter, degrees (e.g. 1e-4 ~ 10 m)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default=None, help="report name (default: git revision)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    for name in ("MobilityPipeline.CDRProcessor", "MobilityPipeline.NativeStopEngine"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    engines = args.engines or (["infostop", "native"] if HAS_INFOSTOP else ["native"])
+
+    runs = []
+    for n_users in args.users:
+        runs.extend(run_size(n_users, engines, args.events_per_user, args.towers, args.days, args.noise, args.seed))
+
+    meta = environment()
+    meta["config"] = {"users": args.users, "events_per_user": args.events_per_user, "towers": args.towers,
+                      "days": args.days, "noise": args.noise, "seed": args.seed}
+    label = args.label or meta["git_rev"] or "latest"
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"stop-engines-{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "runs": runs}, f, indent=2)
+    logger.info("Stop-engine report → %s", path)
+
+    print()
+    for run in runs:
+        extra = "  ".join(f"{k}: {v}" for k, v in run.items() if k.startswith("vs_"))
+        print(f"{run['engine']:<9} {run['users']:>7} users  {run['wall_s']:>8.2f}s  {run['stop_rows']:>9} stop rows  "
+              f"{run['locations']:>7} locations  {extra}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# mobility_pipeline/benchmarks/memory_benchmark.py
+"""
+Peak memory of input preparation, CDR enrichment and InfoStop preparation
+with the default dtypes vs the compact schema (CDRSchema) and in-place stages.
+Run from the repository root:
+
+    python -m benchmarks.memory_benchmark --users 20000 --label my-branch
+
+The synthetic CDRs are first turned into what the production files look like
+(string user IDs and event times). Every mode runs under tracemalloc, which
+sees NumPy buffers and Python objects alike; the report (peak and retained MB
+per step, frame sizes) goes to benchmarks/results/memory-<label>.json.
+Wall times are left to run_benchmarks: tracemalloc slows down every Python
+allocation, string handling most of all.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cdr_processor import CDRProcessor
+from data_sources import CDR_COLUMNS, prepare_inputs
+from infostop_detector import InfoStopDetector
+from schema import CDRSchema
+from benchmarks.synthetic import make_cdr, make_network, make_water
+from benchmarks.run_benchmarks import RESULTS_DIR, environment
+
+logger = logging.getLogger("MobilityPipeline.Benchmark")
+
+# mode -> (join the network onto the rows, compact schema + in-place stages)
+MODES = {
+    "default": (True, False),
+    "compact": (True, True),
+    "compact_join_free": (False, True),
+}
+
+
+def raw_inputs(n_users, events_per_user, n_towers, days, seed):
+    """CDR + network frames typed like the production files (string IDs and times)."""
+    network = make_network(n_towers=n_towers, seed=seed)
+    cdr = make_cdr(network, n_users=n_users, events_per_user=events_per_user, days=days, seed=seed)[CDR_COLUMNS]
+    cdr["unique_id"] = "u" + cdr["unique_id"].astype(str).str.zfill(9)
+    cdr["time_id"] = cdr["time_id"].dt.strftime("%Y-%m-%d %H:%M:%S").astype(object)
+    cdr["event_date"] = cdr["event_date"].dt.strftime("%Y-%m-%d").astype(object)
+    return cdr, network, make_water(seed=seed)
+
+
+def frame_mb(df):
+    return round(df.memory_usage(deep=True).sum() / 1e6, 1)
+
+
+def run_mode(mode, cdr, network, water):
+    join, compact = MODES[mode]
+    steps = []
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+
+    def step(name, fn):
+        tracemalloc.reset_peak()
+        out = fn()
+        current, peak = tracemalloc.get_traced_memory()
+        steps.append({"step": name, "peak_mb": round((peak - base) / 1e6, 1),
+                      "retained_mb": round((current - base) / 1e6, 1)})
+        return out
+
+    if join:
+        df, net = step("prepare_inputs", lambda: prepare_inputs(cdr, network)), None
+    else:
+        df, net = step("prepare_inputs", lambda: prepare_inputs(cdr, network, join=False))
+    if compact:
+        df = step("compact", lambda: CDRSchema.compact(df, inplace=True))
+    input_mb = frame_mb(df)
+    enriched = step("cdr_processing", lambda: CDRProcessor().process(df, water, network=net))
+    del df
+    prepared, traces, _ = step("infostop_prepare", lambda: InfoStopDetector(inplace=compact).prepare(enriched))
+    result = {"mode": mode, "input_mb": input_mb, "enriched_mb": frame_mb(prepared), "steps": steps,
+              "peak_mb": max(s["peak_mb"] for s in steps)}
+    del enriched, prepared, traces
+    tracemalloc.stop()
+    gc.collect()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="mobility4py memory benchmark: default vs compact schema")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--events-per-user", type=int, default=100)
+    parser.add_argument("--towers", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=list(MODES))
+    parser.add_argument("--label", default=None, help="report name (default: git revision)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    for name in ("MobilityPipeline.CDRProcessor", "MobilityPipeline.InfoStopDetector", "MobilityPipeline.Schema"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    cdr, network, water = raw_inputs(args.users, args.events_per_user, args.towers, args.days, args.seed)
+    logger.info("Memory benchmark: %d rows, raw CDR frame %.1f MB", len(cdr), frame_mb(cdr))
+    runs = [run_mode(mode, cdr, network, water) for mode in args.modes]
+
+    meta = environment()
+    meta["config"] = {"users": args.users, "events_per_user": args.events_per_user, "towers": args.towers,
+                      "days": args.days, "seed": args.seed, "rows": len(cdr), "raw_cdr_mb": frame_mb(cdr)}
+    label = args.label or meta["git_rev"] or "latest"
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"memory-{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "runs": runs}, f, indent=2)
+    logger.info("Memory report → %s", path)
+
+    print(f"\n{len(cdr)} rows, raw CDR frame {frame_mb(cdr)} MB")
+    for run in runs:
+        print(f"\n{run['mode']}: input {run['input_mb']} MB, enriched {run['enriched_mb']} MB, "
+              f"peak {run['peak_mb']} MB")
+        for s in run["steps"]:
+            print(f"  {s['step']:<20} peak {s['peak_mb']:>8.1f} MB  retained {s['retained_mb']:>8.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# mobility_pipeline/benchmarks/run_benchmarks.py
+"""
+Scaling benchmark on synthetic data. Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --users 100 300 1000 --label my-branch
+    python -m benchmarks.run_benchmarks --label my-branch --compare benchmarks/results/main.json
+
+Every stage is timed per data size with StageProfiler; the report (stage
+records, log-log scaling slopes and environment metadata) is written to
+benchmarks/results/<label>.json. --compare flags stages that got slower than
+in a previous report for the same sizes.
+"""
+import argparse
+import datetime
+import importlib.metadata
+import importlib.util
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiler import StageProfiler
+from cdr_processor import CDRProcessor
+from trackintel_render import TrackintelBridge
+from analytics import MobilityAnalytics
+from utils_geometry import GeometryUtils
+from benchmarks.synthetic import make_dataset
+
+HAS_INFOSTOP = importlib.util.find_spec("infostop") is not None
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+PACKAGES = ("numpy", "pandas", "geopandas", "shapely", "pyproj", "pyarrow", "trackintel", "infostop")
+
+logger = logging.getLogger("MobilityPipeline.Benchmark")
+
+
+def ground_truth_stops(df):
+    """InfoStop stand-in: same output layout, stop_id taken from the generator's true_stop_id."""
+    out = GeometryUtils.convert_to_unix_timestamp(df, "time_id", output_col="unix_timestamp")
+    out = out.sort_values(by=["unique_id", "unix_timestamp"]).reset_index(drop=True)
+    out["stop_id"] = out["true_stop_id"].to_numpy()
+    return out
+
+
+def run_size(n_users, events_per_user, n_towers, days, seed):
+    """Run every stage once on one synthetic dataset; returns the stage records."""
+    df, _, water = make_dataset(n_users=n_users, events_per_user=events_per_user, n_towers=n_towers,
+                                days=days, seed=seed)
+    profiler = StageProfiler()
+    cdr = CDRProcessor()
+    cdr.profiler = profiler
+    bridge = TrackintelBridge()
+    analytics = MobilityAnalytics()
+    if HAS_INFOSTOP:
+        from infostop_detector import InfoStopDetector
+        stops = InfoStopDetector()
+        stops.profiler = profiler
+        detect = stops.run
+    else:
+        detect = ground_truth_stops
+
+    def staypoints(pfs):
+        _, sps = bridge.build_staypoints_from_pfs(pfs)
+        return sps
+
+    # (stage, function, input names); each output is stored under the stage name
+    stages = [
+        ("cdr_processing", lambda d: cdr.process(d["input"], water), ["input"]),
+        ("infostop", lambda d: detect(d["cdr_processing"]), ["cdr_processing"]),
+        ("to_positionfixes", lambda d: bridge.to_positionfixes(d["infostop"]), ["infostop"]),
+        ("build_staypoints", lambda d: staypoints(d["to_positionfixes"]), ["to_positionfixes"]),
+        ("assign_staypoint_ids", lambda d: bridge.assign_staypoint_ids_to_pfs(d["to_positionfixes"],
+                                                                              d["build_staypoints"]),
+         ["to_positionfixes", "build_staypoints"]),
+        ("annotate_home_work", lambda d: analytics.annotate_home_work(d["build_staypoints"]), ["build_staypoints"]),
+        ("pfs_triplegs", lambda d: bridge.pfs_triplegs(d["assign_staypoint_ids"], d["annotate_home_work"]),
+         ["assign_staypoint_ids", "annotate_home_work"]),
+        ("predict_transport_modes", lambda d: analytics.predict_transport_modes(d["pfs_triplegs"][1]),
+         ["pfs_triplegs"]),
+        ("add_pfs_speed", lambda d: analytics.add_pfs_speed(d["pfs_triplegs"][0]), ["pfs_triplegs"]),
+        ("add_tripleg_metrics", lambda d: analytics.add_tripleg_metrics(d["predict_transport_modes"]),
+         ["predict_transport_modes"]),
+        ("pfs_trips", lambda d: bridge.pfs_trips(d["add_tripleg_metrics"], d["annotate_home_work"]),
+         ["add_tripleg_metrics", "annotate_home_work"]),
+    ]
+
+    data = {"input": df}
+    skipped = []
+    for name, fn, inputs in stages:
+        missing = [i for i in inputs if i not in data]
+        if missing:
+            skipped.append({"stage": name, "status": f"skipped (no {', '.join(missing)})"})
+            continue
+        first = data[inputs[0]]
+        rows_in = len(first[-1] if isinstance(first, tuple) else first)
+        with profiler.stage(name, rows_in=rows_in) as rec:
+            try:
+                out = fn(data)
+            except Exception as e:
+                rec.status = f"error: {type(e).__name__}: {e}"
+                logger.warning("Stage %s failed at %d users: %s", name, n_users, rec.status)
+                continue
+            rec.rows_out = len(out[-1] if isinstance(out, tuple) else out)
+            data[name] = out
+
+    return {"n_users": n_users, "rows": len(df), "stages": profiler.report() + skipped}
+
+
+def scaling_slopes(runs):
+    """
+    Log-log slope of wall time vs input rows per stage (1.0 = linear,
+    2.0 = quadratic); needs the stage to have run at two or more sizes.
+    """
+    series = {}
+    for run in runs:
+        for rec in run["stages"]:
+            if rec["status"] == "run" and rec.get("rows_in") and rec["wall_s"] > 0:
+                series.setdefault(rec["stage"], []).append((rec["rows_in"], rec["wall_s"]))
+    slopes = {}
+    for stage, points in series.items():
+        rows, wall = np.log(np.array(points, dtype=float)).T
+        if np.unique(rows).size >= 2:
+            slopes[stage] = round(float(np.polyfit(rows, wall, 1)[0]), 3)
+    return slopes
+
+
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(RESULTS_DIR), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    versions = {}
+    for pkg in PACKAGES:
+        try:
+            versions[pkg] = importlib.metadata.version(pkg)
+        except importlib.metadata.PackageNotFoundError:
+            versions[pkg] = None
+    return {
+        "git_rev": rev,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+        "stop_detection": "infostop" if HAS_INFOSTOP else "ground_truth (infostop not installed)",
+    }
+
+
+def compare(report, baseline, threshold=0.25, min_wall_s=0.05):
+    """
+    Stages whose wall time grew by more than threshold (relative) against the
+    baseline at the same n_users. Stages faster than min_wall_s in the baseline
+    are ignored, they are mostly noise.
+    """
+    base = {(run["n_users"], rec["stage"]): rec for run in baseline["runs"] for rec in run["stages"]}
+    regressions = []
+    for run in report["runs"]:
+        for rec in run["stages"]:
+            old = base.get((run["n_users"], rec["stage"]))
+            if old is None or old["status"] != "run" or rec["status"] != "run":
+                continue
+            if old["wall_s"] < min_wall_s:
+                continue
+            ratio = rec["wall_s"] / old["wall_s"]
+            if ratio > 1 + threshold:
+                regressions.append({"n_users": run["n_users"], "stage": rec["stage"],
+                                    "baseline_s": old["wall_s"], "wall_s": rec["wall_s"], "ratio": round(ratio, 2)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="mobility4py scaling benchmark on synthetic CDRs")
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 300, 1000], help="user counts to run")
+    parser.add_argument("--events-per-user", type=int, default=100)
+    parser.add_argument("--towers", type=int, default=300)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default=None, help="report name (default: git revision)")
+    parser.add_argument("--compare", default=None, help="baseline report JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative slowdown flagged as regression")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logging.getLogger("MobilityPipeline.Profiler").setLevel(logging.WARNING)
+
+    meta = environment()
+    meta["config"] = {"events_per_user": args.events_per_user, "towers": args.towers, "days": args.days,
+                      "seed": args.seed}
+    runs = []
+    for n_users in sorted(args.users):
+        logger.info("Benchmark: %d users", n_users)
+        runs.append(run_size(n_users, args.events_per_user, args.towers, args.days, args.seed))
+
+    report = {"meta": meta, "runs": runs, "scaling": scaling_slopes(runs)}
+
+    label = args.label or meta["git_rev"] or "latest"
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info("Benchmark report → %s", path)
+
+    for run in runs:
+        print(f"\n{run['n_users']} users, {run['rows']} rows")
+        for rec in run["stages"]:
+            if rec["status"] == "run":
+                print(f"  {rec['stage']:<40} {rec['wall_s']:>9.3f}s  {rec['rows_per_s'] or 0:>12.0f} rows/s")
+            else:
+                print(f"  {rec['stage']:<40} {rec['status']}")
+    print("\nScaling (log-log slope of wall time vs rows):")
+    for stage, slope in report["scaling"].items():
+        print(f"  {stage:<40} {slope:>6.2f}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, threshold=args.threshold)
+        if regressions:
+            print(f"\nRegressions against {args.compare}:")
+            for r in regressions:
+                print(f"  {r['stage']} @ {r['n_users']} users: {r['baseline_s']:.3f}s → {r['wall_s']:.3f}s "
+                      f"(x{r['ratio']})")
+            return 1
+        print(f"\nNo regressions against {args.compare}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
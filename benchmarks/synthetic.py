@@ -0,0 +1,147 @@
+# mobility_pipeline/benchmarks/synthetic.py
+"""
+Synthetic stand-ins for the confidential inputs: a network table with
+three-sector (and some omni) sites, Tagus-like water polygons, and CDR
+streams from users with simple mobility patterns. Everything is seeded,
+so a given configuration always produces the same data.
+"""
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import LineString
+
+# Lisbon-ish bounding box (lon_min, lat_min, lon_max, lat_max)
+LISBON_BBOX = (-9.25, 38.69, -9.09, 38.80)
+CONCELHOS = np.array(["Lisboa", "Oeiras", "Amadora", "Odivelas", "Loures"])
+
+
+def make_network(n_towers: int = 300, sectors_per_site: int = 3, omni_share: float = 0.1,
+                 bbox=LISBON_BBOX, seed: int = 0) -> pd.DataFrame:
+    """
+    Network table with the columns main.py uses: cgi_key, cell_id,
+    longitude_cell, latitude_cell, r, azi_min1, azi_max1, concelho, new_radius.
+    Sites carry sectors_per_site sectors (evenly rotated, 60-120° wide) or one
+    omni cell (azimuths 0/0).
+    """
+    rng = np.random.default_rng(seed)
+    n_sites = max(1, int(np.ceil(n_towers / sectors_per_site)))
+    site_lon = rng.uniform(bbox[0], bbox[2], n_sites)
+    site_lat = rng.uniform(bbox[1], bbox[3], n_sites)
+    site_omni = rng.random(n_sites) < omni_share
+    site_rot = rng.uniform(0, 360, n_sites)
+    site_radius = rng.uniform(300, 2500, n_sites)
+
+    site = np.repeat(np.arange(n_sites), sectors_per_site)[:n_towers]
+    k = np.tile(np.arange(sectors_per_site), n_sites)[:n_towers]
+    width = rng.uniform(60, 120, n_towers)
+    centre = (site_rot[site] + k * 360.0 / sectors_per_site) % 360
+    azi_min = np.round((centre - width / 2) % 360, 1)
+    azi_max = np.round((centre + width / 2) % 360, 1)
+    omni = site_omni[site]
+    azi_min[omni] = 0
+    azi_max[omni] = 0
+
+    cgi = 268_060_000_000 + np.arange(n_towers)
+    return pd.DataFrame({
+        "cgi_key": cgi,
+        "cell_id": cgi,
+        "longitude_cell": site_lon[site],
+        "latitude_cell": site_lat[site],
+        "r": site_radius[site],
+        "azi_min1": azi_min,
+        "azi_max1": azi_max,
+        "concelho": CONCELHOS[rng.integers(0, len(CONCELHOS), n_towers)],
+        "new_radius": site_radius[site] * rng.uniform(0.8, 1.2, n_towers),
+    })
+
+
+def make_water(bbox=LISBON_BBOX, n_polygons: int = 1, width_deg: float = 0.01, seed: int = 0) -> gpd.GeoDataFrame:
+    """Meandering river bands across the bbox, tagged like the HOT OSM Tagus rows."""
+    rng = np.random.default_rng(seed)
+    geoms = []
+    for i in range(n_polygons):
+        xs = np.linspace(bbox[0], bbox[2], 12)
+        base = bbox[1] + (bbox[3] - bbox[1]) * (i + 1) / (n_polygons + 2)
+        ys = base + rng.normal(0, (bbox[3] - bbox[1]) * 0.03, xs.size)
+        geoms.append(LineString(np.column_stack([xs, ys])).buffer(width_deg / 2))
+    return gpd.GeoDataFrame(
+        {"name:en": ["Tagus River"] * n_polygons, "osm_type": ["ways_poly"] * n_polygons},
+        geometry=geoms, crs="EPSG:4326"
+    )
+
+
+def make_cdr(network: pd.DataFrame, n_users: int = 1000, events_per_user: int = 100, days: int = 7,
+             start: str = "2024-02-01", patterns=(("commuter", 0.6), ("random", 0.3), ("stationary", 0.1)),
+             seed: int = 0) -> pd.DataFrame:
+    """
+    CDR events (unique_id, time_id, event_date, a_bts_cgi), timestamp (the column
+    TrackintelBridge.to_positionfixes reads, equal to time_id) and true_stop_id,
+    the generator's ground truth: the user's location index while dwelling,
+    -1 while moving. Patterns:
+      - commuter: home at night, work on weekday office hours, trips in between
+      - random: dwells at a few personal places in random order
+      - stationary: stays near home all the time
+    Events per user are Poisson-spread over `days`, events_per_user on average.
+    """
+    rng = np.random.default_rng(seed)
+    cells = network["cgi_key"].to_numpy()
+    names = np.array([p for p, _ in patterns])
+    shares = np.array([s for _, s in patterns], dtype=float)
+    user_pattern = names[rng.choice(len(names), n_users, p=shares / shares.sum())]
+
+    counts = np.maximum(rng.poisson(events_per_user, n_users), 2)
+    user = np.repeat(np.arange(n_users), counts)
+    n = user.size
+    horizon = days * 86400
+    # Sorted times within each user (offset per user, sort once, remove offset)
+    t = np.sort(rng.integers(0, horizon, n) + user.astype(np.int64) * horizon) - user.astype(np.int64) * horizon
+
+    # Personal places: 0 = home, 1 = work, 2.. = other
+    n_places = 4
+    places = rng.integers(0, cells.size, (n_users, n_places))
+
+    hour = (t % 86400) / 3600.0
+    weekday = ((pd.Timestamp(start).dayofweek + t // 86400) % 7) < 5
+    pattern = user_pattern[user]
+
+    place = np.zeros(n, dtype=np.int64)
+    at_work = (pattern == "commuter") & weekday & (hour >= 9) & (hour < 17.5)
+    place[at_work] = 1
+    rand = pattern == "random"
+    # Random users hop between places in 2h blocks
+    block = (t // 7200).astype(np.int64)
+    place[rand] = (block[rand] * 2654435761 + user[rand]) % n_places
+
+    # Transit windows: commuters around 8h and 18h, random users at block edges
+    moving = (pattern == "commuter") & weekday & (((hour >= 8) & (hour < 9)) | ((hour >= 17.5) & (hour < 18.5)))
+    moving |= rand & ((t % 7200) < 900)
+
+    cell = cells[places[user, place]]
+    cell[moving] = cells[rng.integers(0, cells.size, int(moving.sum()))]
+    true_stop = np.where(moving, -1, user * n_places + place)
+
+    time_id = pd.Timestamp(start) + pd.to_timedelta(t, unit="s")
+    return pd.DataFrame({
+        "unique_id": user,
+        "time_id": time_id,
+        "event_date": time_id.normalize(),
+        "a_bts_cgi": cell,
+        "timestamp": time_id,
+        "true_stop_id": true_stop,
+    })
+
+
+def merge_network(cdr: pd.DataFrame, network: pd.DataFrame) -> pd.DataFrame:
+    """Same inner join main.py does between CDRs and the network file."""
+    cols = ["longitude_cell", "latitude_cell", "cgi_key", "cell_id", "r", "azi_min1", "azi_max1",
+            "concelho", "new_radius"]
+    return pd.merge(cdr, network[cols], left_on="a_bts_cgi", right_on="cgi_key", how="inner")
+
+
+def make_dataset(n_users: int = 1000, events_per_user: int = 100, n_towers: int = 300, days: int = 7,
+                 seed: int = 0):
+    """(merged CDR frame, network, water) for one benchmark size."""
+    network = make_network(n_towers=n_towers, seed=seed)
+    water = make_water(seed=seed)
+    cdr = make_cdr(network, n_users=n_users, events_per_user=events_per_user, days=days, seed=seed)
+    return merge_network(cdr, network), network, water
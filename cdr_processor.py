@@ -1,76 +1,197 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
 import geopandas as gpd
+import shapely
+from pyproj import Transformer
 from  utils_geometry import GeometryUtils
+from sector_cache import SectorCache
+from towers import TowerIndex
+from profiler import profiled
 import logging
 
 class CDRProcessor:
-    def __init__(self, radius_km=1.0, crs_proj="EPSG:3763"):
+    def __init__(self, radius_km=1.0, crs_proj="EPSG:3763", arc_num_points=60, arc_tolerance=None,
+                 sector_cache=None):
         self.radius_km = radius_km
         self.crs_proj = crs_proj
+        # Arc resolution of sector polygons: fixed vertex count, or max chord error in metres
+        self.arc_num_points = arc_num_points
+        self.arc_tolerance = arc_tolerance
+        self.sector_cache = sector_cache
+        self.water_report = None
+        self.profiler = None  # optional StageProfiler, set by MobilityPipeline
         self.logger = logging.getLogger("MobilityPipeline.CDRProcessor")
 
-    def process(self, df, rivers_gdf):
+    def process(self, df, rivers_gdf, network=None):
+        """
+        Sector table + enrichment. df is either the CDR frame joined with the
+        network table, or (join-free) CDRs with just a cell_id column plus the
+        network table as `network`.
+        """
         try:
             self.logger.info("Starting CDR processing...")
 
-            rivers_proj = rivers_gdf.to_crs(self.crs_proj)
-            water_union = rivers_proj.union_all()
+            with profiled(self.profiler, "sectors", rows_in=len(df)) as rec:
+                sectors_gdf = self.build_sector_table(df if network is None else network, rivers_gdf)
+                rec.rows_out = len(sectors_gdf)
+            df = self.enrich(df, sectors_gdf)
 
-            towers_df = df[["cell_id", "longitude_cell", "latitude_cell"]].drop_duplicates()
-            towers_gdf = gpd.GeoDataFrame(
-                towers_df,
-                geometry=gpd.points_from_xy(towers_df["longitude_cell"], towers_df["latitude_cell"]),
-                crs="EPSG:4326"
-            )
+            self.logger.info("CDR processing completed successfully.")
+            return df
+
+        except Exception as e:
+            self.logger.error(f"Error during CDR processing: {e}", exc_info=True)
+            raise
+
+    def process_stream(self, chunks, sectors_gdf, out_dir):
+        """
+        Streaming variant of process(): enrich an iterable of CDR chunks against a
+        prebuilt sector table and write each one to out_dir/part-NNNNN.parquet.
+        Peak memory is bounded by the chunk size; since placement depends only on
+        (unique_id, cell_id), the concatenated parts match the batch output.
+        Returns the list of written paths.
+        """
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            paths = []
+            total = 0
+            for i, chunk in enumerate(chunks):
+                enriched = self.enrich(chunk, sectors_gdf)
+                path = os.path.join(out_dir, f"part-{i:05d}.parquet")
+                enriched.to_parquet(path, index=False)
+                paths.append(path)
+                total += len(enriched)
+                self.logger.info("Wrote chunk %d (%d rows) → %s", i, len(enriched), path)
+                del enriched
+
+            self.logger.info("Streaming CDR processing completed: %d rows in %d chunks.", total, len(paths))
+            return paths
+
+        except Exception as e:
+            self.logger.error(f"Error during streaming CDR processing: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    def iter_parquet_chunks(path, columns=None, chunk_rows=1_000_000, prepare_fn=None):
+        """
+        Yield DataFrames of at most chunk_rows rows from a parquet file, reading
+        row-group by row-group. prepare_fn (e.g. a network merge) is applied per chunk.
+        """
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            chunk = batch.to_pandas()
+            yield prepare_fn(chunk) if prepare_fn is not None else chunk
+
+    def build_sector_table(self, df, rivers_gdf):
+        """
+        Sector polygon per cell_id from any frame carrying the tower columns
+        (the merged CDR frame or the network table itself). Uses the sector cache if set.
+        """
+        rivers_proj = rivers_gdf.to_crs(self.crs_proj)
+        towers = TowerIndex.from_frame(df, columns=SectorCache.TOWER_COLUMNS).towers
 
-            # Project tower coordinates to metric CRS (EPSG:3763)
-            towers_gdf = towers_gdf.to_crs(self.crs_proj)
-
-            towers_gdf["az_min"] = towers_gdf["cell_id"].map(df.groupby("cell_id")["azi_min1"].first())
-            towers_gdf["az_max"] = towers_gdf["cell_id"].map(df.groupby("cell_id")["azi_max1"].first())
-            towers_gdf["new_radius"] = towers_gdf["cell_id"].map(df.groupby("cell_id")["new_radius"].first())
-
-            towers_gdf["sector_poly"] = [
-                        GeometryUtils.make_sector_projected(
-                            pt.x, pt.y,
-                            *GeometryUtils.adjust_azimuth_for_omni(az_min, az_max),
-                            radius  # << this is unique per tower
-                        )
-                        for pt, az_min, az_max, radius in zip(
-                            towers_gdf.geometry,
-                            towers_gdf["az_min"],
-                            towers_gdf["az_max"],
-                            towers_gdf["new_radius"]
-                        )
-                    ]
-
-            sectors_gdf = gpd.GeoDataFrame(towers_gdf[["cell_id"]], geometry=towers_gdf["sector_poly"], crs=self.crs_proj)
-            sectors_gdf["geometry"] = sectors_gdf.geometry.apply(lambda g: g.difference(water_union))
-
-            sectors_gdf["geometry"] = sectors_gdf.geometry.apply(
-                lambda g: max(g.geoms, key=lambda gg: gg.area) if g.geom_type == "MultiPolygon" else g
+        if self.sector_cache is not None:
+            context = SectorCache.context_key(
+                rivers_proj.geometry.values, self.crs_proj,
+                arc_num_points=self.arc_num_points, arc_tolerance=self.arc_tolerance
             )
+            return self.sector_cache.get_or_build(
+                towers, context, lambda t: self.build_sectors(t, rivers_proj), self.crs_proj
+            )
+        return self.build_sectors(towers, rivers_proj)
+
+    def enrich(self, df, sectors_gdf):
+        """
+        Add the int32 tower code ('tower', position in the sector table) and a
+        deterministic estimated position to every row. Sector polygons stay in
+        the tower index and are only looked up for the unique (user, cell) pairs.
+        sectors_gdf may also be a TowerIndex with sectors attached.
+        """
+        with profiled(self.profiler, "sector_join", rows_in=len(df)):
+            towers = sectors_gdf if isinstance(sectors_gdf, TowerIndex) else TowerIndex.from_sectors(sectors_gdf)
+            # Shallow copy: new columns only, the caller's frame is left alone
+            df = df.copy(deep=False)
+            df["tower"] = towers.encode(df["cell_id"])
+        with profiled(self.profiler, "placement", rows_in=len(df)) as rec:
+            df = self.place_points(df, towers)
+            rec.rows_out = len(df)
+        return df
 
-            sectors_gdf.to_file("sectors.geojson", driver="GeoJSON")
+    def build_sectors(self, towers, rivers_proj):
+        """
+        Water-clipped sector polygon per tower, in tower order.
+        Expects one row per cell_id with SectorCache.TOWER_COLUMNS.
+        """
+        # Project tower coordinates to metric CRS (EPSG:3763)
+        towers_proj = gpd.GeoSeries(
+            gpd.points_from_xy(towers["longitude_cell"], towers["latitude_cell"]), crs="EPSG:4326"
+        ).to_crs(self.crs_proj)
 
-            df = df.merge(
-                sectors_gdf[["cell_id", "geometry"]],
-                on="cell_id",
-                how="left",
-                validate="many_to_one"
+        with profiled(self.profiler, "build", rows_in=len(towers)):
+            az_min, az_max = GeometryUtils.adjust_azimuth_for_omni_array(towers["azi_min1"], towers["azi_max1"])
+            sectors = GeometryUtils.make_sectors_projected(
+                towers_proj.x.to_numpy(),
+                towers_proj.y.to_numpy(),
+                az_min,
+                az_max,
+                towers["new_radius"].to_numpy(dtype=float),  # << this is unique per tower
+                num_points=self.arc_num_points,
+                tolerance=self.arc_tolerance
             )
 
-            df["point_proj"] = [
-                GeometryUtils.deterministic_point_in_polygon(uid, cid, poly) if poly and not poly.is_empty else None
-                for uid, cid, poly in zip(df["unique_id"], df["cell_id"], df["geometry"])
-            ]
+        with profiled(self.profiler, "water_mask", rows_in=len(sectors)) as rec:
+            masked, self.water_report = GeometryUtils.mask_water(sectors, rivers_proj.geometry.values)
+            rec.rows_out = self.water_report["clipped"]
+        self.logger.info(
+            "Water masking: %d of %d sectors clipped (%d near water, %d water parts)",
+            self.water_report["clipped"], self.water_report["sectors"],
+            self.water_report["candidates"], self.water_report["water_parts"]
+        )
+        return gpd.GeoDataFrame(
+            {"cell_id": towers["cell_id"].to_numpy()},
+            geometry=GeometryUtils.largest_polygon_part(masked),
+            crs=self.crs_proj
+        )
 
-            points_gdf = gpd.GeoDataFrame(df, geometry=df["point_proj"], crs=self.crs_proj).to_crs("EPSG:4326")
-            df["est_lon"] = points_gdf.geometry.x
-            df["est_lat"] = points_gdf.geometry.y
+    def place_points(self, df, towers=None):
+        """
+        Deterministic point per row inside its sector polygon: gathered from
+        `towers` (TowerIndex, by the 'tower' code column) or, without one, read
+        from a per-row 'geometry' column. Placement depends only on
+        (unique_id, cell_id), so it is computed once per unique pair, reprojected
+        to EPSG:4326 once, and broadcast back to the rows as plain float columns:
+        est_x / est_y (crs_proj) and est_lon / est_lat (EPSG:4326). No shapely
+        object is kept per row; see points() for when one is needed.
+        """
+        pair_codes, pairs = pd.MultiIndex.from_arrays([df["unique_id"], df["cell_id"]]).factorize()
+        _, first_row = np.unique(pair_codes, return_index=True)
+        if towers is not None:
+            polygons = towers.gather("geometry", df["tower"].to_numpy()[first_row])
+        else:
+            polygons = df["geometry"].to_numpy(dtype=object)[first_row]
 
-            self.logger.info("CDR processing completed successfully.")
-            return df
+        seeds = GeometryUtils.stable_seed(pairs.get_level_values(0), pairs.get_level_values(1))
+        px, py = GeometryUtils.points_in_polygons(seeds, polygons)
+        self.logger.info("Placed points for %d unique (user, cell) pairs out of %d rows", len(pairs), len(df))
 
-        except Exception as e:
-            self.logger.error(f"Error during CDR processing: {e}", exc_info=True)
-            raise
+        to_wgs84 = Transformer.from_crs(self.crs_proj, "EPSG:4326", always_xy=True)
+        lon, lat = to_wgs84.transform(px, py)
+
+        df["est_x"] = px[pair_codes]
+        df["est_y"] = py[pair_codes]
+        df["est_lon"] = np.asarray(lon)[pair_codes]
+        df["est_lat"] = np.asarray(lat)[pair_codes]
+        return df
+
+    def points(self, df, projected=True):
+        """
+        GeoSeries of the estimated positions of enriched rows, built on demand
+        (est_x / est_y in crs_proj, or est_lon / est_lat in EPSG:4326).
+        """
+        x, y, crs = ("est_x", "est_y", self.crs_proj) if projected else ("est_lon", "est_lat", "EPSG:4326")
+        x, y = df[x].to_numpy(dtype=float), df[y].to_numpy(dtype=float)
+        geoms = shapely.points(x, y)
+        geoms[np.isnan(x)] = None  # rows whose sector was missing or empty
+        return gpd.GeoSeries(geoms, index=df.index, crs=crs)
@@ -0,0 +1,61 @@
+# mobility_pipeline/checkpoint.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import shapely
+
+
+class CheckpointStore:
+    """
+    Content-addressed stage checkpoints: root/<stage>/<key>/<output>.pkl plus a
+    _SUCCESS marker written last, so a half-written checkpoint is never valid.
+    Keys chain the upstream key with the stage name and its parameters.
+    """
+    MARKER = "_SUCCESS"
+
+    def __init__(self, root: str = "output/checkpoints"):
+        self.root = root
+        self.logger = logging.getLogger("MobilityPipeline.CheckpointStore")
+
+    @staticmethod
+    def hash_frame(df: pd.DataFrame) -> str:
+        """Content hash of a (Geo)DataFrame: values, index, columns and dtypes."""
+        h = hashlib.sha256()
+        h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+        plain = [c for c in df.columns if str(df[c].dtype) != "geometry"]
+        h.update(pd.util.hash_pandas_object(df[plain], index=True).to_numpy().tobytes())
+        for c in df.columns.difference(plain):
+            for wkb in shapely.to_wkb(np.asarray(df[c].values, dtype=object)):
+                h.update(wkb if wkb is not None else b"")
+        return h.hexdigest()
+
+    @staticmethod
+    def stage_key(stage: str, upstream_key: str, params: dict) -> str:
+        payload = json.dumps({"stage": stage, "upstream": upstream_key, "params": params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+    def _dir(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key)
+
+    def is_valid(self, stage: str, key: str) -> bool:
+        return os.path.exists(os.path.join(self._dir(stage, key), self.MARKER))
+
+    def save(self, stage: str, key: str, outputs: dict):
+        path = self._dir(stage, key)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        for name, obj in outputs.items():
+            pd.to_pickle(obj, os.path.join(path, f"{name}.pkl"))
+        open(os.path.join(path, self.MARKER), "w").close()
+        self.logger.info("Checkpoint saved: %s/%s (%s)", stage, key, ", ".join(outputs))
+
+    def load(self, stage: str, key: str, names) -> dict:
+        path = self._dir(stage, key)
+        self.logger.info("Checkpoint loaded: %s/%s", stage, key)
+        return {name: pd.read_pickle(os.path.join(path, f"{name}.pkl")) for name in names}
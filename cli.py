@@ -0,0 +1,167 @@
+# mobility_pipeline/cli.py
+"""
+Command-line entry point. Heavy dependencies are imported by the stages that
+need them, so e.g. an enrichment-only run never loads trackintel or infostop.
+
+    python cli.py stages
+    python cli.py run --cdr data/cdr.parquet --network data/network.csv \\
+        --rivers datasets/hotosm_prt_waterways_polygons_geojson.geojson --until cdr_processing
+    python cli.py run --source azure --cdr lisboa_feb_march:1 --network network_file_v9:1 \\
+        --rivers datasets/hotosm_prt_waterways_polygons_geojson.geojson --checkpoint-dir output/checkpoints
+"""
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import json
+import os
+import sys
+
+from lazy_imports import IMPORT_TIMES, lazy_import
+from logger_config import setup_logger
+from data_sources import SOURCES, prepare_inputs, prepare_network
+from pipeline import MobilityPipeline
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="mobility4py", description="CDR → mobility trajectories pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("stages", help="list pipeline stages")
+
+    run = sub.add_parser("run", help="run the pipeline (or a prefix of its stages)")
+    run.add_argument("--source", choices=sorted(SOURCES), default="local", help="input backend")
+    run.add_argument("--cdr", required=True, help="CDR path (local) or data asset name:version (azure)")
+    run.add_argument("--network", required=True, help="network table path or data asset name:version")
+    run.add_argument("--rivers", required=True, help="water polygons file (GeoJSON/GPKG/shapefile)")
+    run.add_argument("--start-date", default=None, help="first event_date to load (YYYY-MM-DD)")
+    run.add_argument("--end-date", default=None, help="last event_date to load (YYYY-MM-DD, inclusive)")
+    run.add_argument("--users-file", default=None, help="only load the user IDs listed in this file (one per line)")
+    run.add_argument("--water-name", default="Tagus River", help="name:en of the water polygons to mask with")
+    run.add_argument("--water-bbox", type=float, nargs=4, default=None, metavar=("MINX", "MINY", "MAXX", "MAXY"),
+                     help="only read water polygons intersecting this box (file CRS)")
+    run.add_argument("--azure-config", default="config.json", help="Azure ML workspace config")
+    run.add_argument("--until", choices=[name for name, _ in MobilityPipeline.STAGES],
+                     help="stop after this stage")
+    run.add_argument("--resume-from", choices=[name for name, _ in MobilityPipeline.STAGES],
+                     help="recompute from this stage (needs --checkpoint-dir)")
+    run.add_argument("--workers", type=int, default=1, help=">1: user-partitioned multi-process run")
+    run.add_argument("--radius-km", type=float, default=1.0)
+    run.add_argument("--tz", default="Europe/Lisbon")
+    run.add_argument("--home-work-engine", choices=["osna", "vectorized"], default="osna")
+    run.add_argument("--sector-cache-dir", default=None)
+    run.add_argument("--checkpoint-dir", default=None)
+    run.add_argument("--out", default="output/results", help="results root (GeoParquet)")
+    run.add_argument("--join-network", action="store_true",
+                     help="copy the network columns onto every CDR row (default: towers looked up by index)")
+    run.add_argument("--compact", action="store_true",
+                     help="compact dtypes (categorical users, int32 codes, parsed times) and in-place stages")
+    run.add_argument("--stop-engine", choices=["infostop", "native"], default="infostop",
+                     help="stop detection: InfoStop, or the vectorized native engine (no infostop needed)")
+    run.add_argument("--trackintel-workers", type=int, default=1,
+                     help="processes for tripleg / trip generation (users split into batches)")
+    run.add_argument("--trackintel-memory-mb", type=float, default=None,
+                     help="per-worker memory budget for tripleg / trip generation; users are batched to fit")
+    run.add_argument("--compress-events", action="store_true",
+                     help="fold duplicate and repeated same-cell events before InfoStop (labels expanded back)")
+    run.add_argument("--od", default=None, metavar="ZONES",
+                     help="also write OD flows between 'tower' sites, 'grid' cells or a network column (e.g. concelho)")
+    run.add_argument("--od-hours-per-bin", type=int, default=1, help="hours of day per OD time bin")
+    run.add_argument("--od-cell-size", type=float, default=1000.0, help="grid cell size (m) for --od grid")
+    run.add_argument("--partition-by", choices=["user", "date", "none"], default="user")
+    run.add_argument("--profile", default=None, help="write startup + stage profile JSON here")
+    run.add_argument("--startup-budget", type=float, default=None,
+                     help="warn when startup (imports + input loading setup) exceeds this many seconds")
+    run.add_argument("--log-dir", default="logs")
+    return parser
+
+
+def run(args, logger):
+    if args.workers > 1 and (args.until or args.resume_from):
+        raise SystemExit("--workers cannot be combined with --until / --resume-from")
+    if args.od and args.until and args.until != "trips":
+        raise SystemExit("--od needs the trips stage; drop --until or use --until trips")
+
+    source_cls = SOURCES[args.source]
+    water = {"water_name": args.water_name, "water_bbox": tuple(args.water_bbox) if args.water_bbox else None}
+    if args.source == "azure":
+        source = source_cls(args.cdr, args.network, args.rivers, config_path=args.azure_config, **water)
+    else:
+        source = source_cls(args.cdr, args.network, args.rivers, **water)
+    users = None
+    if args.users_file:
+        with open(args.users_file, encoding="utf-8") as f:
+            users = [line.strip() for line in f if line.strip()]
+    pipeline = MobilityPipeline(radius_km=args.radius_km, tz=args.tz, sector_cache_dir=args.sector_cache_dir,
+                                checkpoint_dir=args.checkpoint_dir, home_work_engine=args.home_work_engine,
+                                inplace=args.compact, compress_events=args.compress_events,
+                                stop_engine=args.stop_engine, trackintel_workers=args.trackintel_workers,
+                                trackintel_memory_mb=args.trackintel_memory_mb)
+
+    startup_s = time.perf_counter() - _START
+    logger.info("Startup: %.2fs", startup_s)
+    if args.startup_budget is not None and startup_s > args.startup_budget:
+        logger.warning("Startup %.2fs exceeds the budget of %.2fs", startup_s, args.startup_budget)
+
+    logger.info("Loading input data...")
+    load_start = time.perf_counter()
+    # CDRs, network and water polygons are read concurrently, filtered while reading
+    cdr_raw, network_raw, rivers_gdf = source.load_all(start=args.start_date, end=args.end_date, users=users)
+    if args.join_network:
+        cdr_df, network = prepare_inputs(cdr_raw, network_raw), None
+    else:
+        cdr_df, network = prepare_inputs(cdr_raw, network_raw, join=False)
+    del cdr_raw
+    if args.compact:
+        cdr_df = lazy_import("schema").CDRSchema.compact(cdr_df, inplace=True)
+    load_s = time.perf_counter() - load_start
+
+    logger.info("Running mobility pipeline...")
+    if args.workers > 1:
+        results = pipeline.run_partitioned(cdr_df, rivers_gdf, n_workers=args.workers, network=network)
+    else:
+        results = pipeline.run(cdr_df, rivers_gdf, resume_from=args.resume_from, until=args.until,
+                               network=network)
+
+    partition_by = None if args.partition_by == "none" else args.partition_by
+    pipeline.write_results(results, root=args.out, partition_by=partition_by)
+    if args.od:
+        od = pipeline.od_matrix(results, network if network is not None else prepare_network(network_raw), zones=args.od,
+                                hours_per_bin=args.od_hours_per_bin, cell_size=args.od_cell_size)
+        od.save(os.path.join(args.out, f"od_{args.od}.npz"))
+
+    if IMPORT_TIMES:
+        logger.info("Lazy imports: %s", ", ".join(f"{m} {t:.2f}s" for m, t in IMPORT_TIMES.items()))
+    if args.profile:
+        os.makedirs(os.path.dirname(args.profile) or ".", exist_ok=True)
+        with open(args.profile, "w", encoding="utf-8") as f:
+            json.dump({
+                "startup_s": round(startup_s, 4),
+                "load_s": round(load_s, 4),
+                "inputs": source.load_report,
+                "imports_s": {m: round(t, 4) for m, t in IMPORT_TIMES.items()},
+                "stages": results["profile"],
+            }, f, indent=2)
+        logger.info("Profile → %s", args.profile)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "stages":
+        for name, outputs in MobilityPipeline.STAGES:
+            print(f"{name:<16} → {', '.join(outputs)}")
+        return 0
+
+    logger = setup_logger(log_dir=args.log_dir)
+    try:
+        run(args, logger)
+        logger.info("All results saved successfully.")
+        return 0
+    except Exception as e:
+        logger.error(f"Main execution failed: {e}", exc_info=True)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
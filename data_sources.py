@@ -0,0 +1,258 @@
+# mobility_pipeline/data_sources.py
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from lazy_imports import lazy_import
+
+# Columns main.py has always kept from the CDR and network tables
+CDR_COLUMNS = ["unique_id", "time_id", "event_date", "a_bts_cgi"]
+NETWORK_COLUMNS = ["longitude_cell", "latitude_cell", "cgi_key", "cell_id", "r", "azi_min1", "azi_max1",
+                   "concelho", "new_radius"]
+# Explicit network dtypes: no inference pass, and concelho as a categorical.
+# Columns feeding the sector geometry stay float64 (and so do the sector cache hashes).
+NETWORK_DTYPES = {
+    "cgi_key": "Int64", "cell_id": "Int64", "longitude_cell": "float64", "latitude_cell": "float64",
+    "r": "float32", "azi_min1": "float64", "azi_max1": "float64", "concelho": "category", "new_radius": "float64",
+}
+GEO_EXTENSIONS = (".geojson", ".json", ".gpkg", ".shp")
+
+
+def read_table(path: str, columns=None, filters=None, dtype=None):
+    """
+    Read a parquet / CSV / vector file, picking the reader from the extension.
+    filters (pyarrow syntax) are pushed into the parquet scan, so row groups
+    whose statistics rule them out are never read; dtype applies to CSVs.
+    """
+    ext = os.path.splitext(path.rstrip("/"))[1].lower()
+    if ext in GEO_EXTENSIONS:
+        gdf = lazy_import("geopandas").read_file(path)
+        return gdf if columns is None else gdf[list(columns) + [gdf.geometry.name]]
+    if ext == ".csv":
+        return pd.read_csv(path, usecols=columns, dtype=dtype)
+    # .parquet files and parquet dataset directories
+    return pd.read_parquet(path, columns=columns, filters=filters)
+
+
+def _filter_value(field_type, value):
+    """A date bound as the literal pyarrow compares with the column's type."""
+    pa = lazy_import("pyarrow")
+    ts = pd.Timestamp(value)
+    if field_type is None or pa.types.is_timestamp(field_type):
+        tz = getattr(field_type, "tz", None)
+        return (ts.tz_localize(tz) if tz and ts.tzinfo is None else ts).to_pydatetime()
+    if pa.types.is_date(field_type):
+        return ts.date()
+    if pa.types.is_integer(field_type):
+        return int(ts.strftime("%Y%m%d"))  # yyyymmdd partition-style integers
+    return ts.strftime("%Y-%m-%d")
+
+
+def cdr_filters(path: str, date_col: str = "event_date", start=None, end=None, users=None,
+                user_col: str = "unique_id"):
+    """
+    pyarrow filters for a CDR scan: date_col within [start, end] (inclusive
+    dates) and user_col in users. Literals follow the column types in the
+    file schema (timestamp, date, yyyymmdd int or string).
+    """
+    pa = lazy_import("pyarrow")
+    try:
+        schema = lazy_import("pyarrow.dataset").dataset(path, format="parquet").schema
+    except Exception:  # remote paths: let pyarrow cast the literals
+        schema = None
+
+    def type_of(col):
+        return schema.field(col).type if schema is not None and col in schema.names else None
+
+    filters = []
+    if start is not None or end is not None:
+        field_type = type_of(date_col)
+        if start is not None:
+            filters.append((date_col, ">=", _filter_value(field_type, start)))
+        if end is not None:
+            # Inclusive end date: timestamps up to the end of that day
+            if field_type is None or pa.types.is_timestamp(field_type):
+                bound = pd.Timestamp(end) + pd.Timedelta(days=1)
+                filters.append((date_col, "<", _filter_value(field_type, bound)))
+            else:
+                filters.append((date_col, "<=", _filter_value(field_type, end)))
+    if users is not None:
+        users = list(users)
+        if type_of(user_col) is not None and pa.types.is_integer(type_of(user_col)):
+            users = [int(u) for u in users]  # IDs read from a text file
+        filters.append((user_col, "in", users))
+    return filters or None
+
+
+def _sql_string(value) -> str:
+    """OGR SQL string literal (single quotes doubled, e.g. Ria d'Aveiro)."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def read_water(path: str, name: str = "Tagus River", osm_type: str = "ways_poly", bbox=None):
+    """
+    Water polygons of one HOT OSM waterway, filtered while reading: the
+    attribute test and bbox (minx, miny, maxx, maxy, in the file's CRS) go to
+    the OGR driver, so other features are never materialised.
+    """
+    gpd = lazy_import("geopandas")
+    where = f"\"name:en\" = {_sql_string(name)} AND osm_type = {_sql_string(osm_type)}"
+    try:
+        return gpd.read_file(path, where=where, bbox=bbox, columns=["name:en", "osm_type"])
+    except (TypeError, ValueError, NotImplementedError):
+        # Engines without attribute filters (fiona): filter after reading
+        return select_rivers(gpd.read_file(path, bbox=bbox), name=name, osm_type=osm_type)
+
+
+class LocalSource:
+    """
+    Pipeline inputs from paths: CDR events (parquet/CSV), network table
+    (CSV/parquet) and water polygons (GeoJSON/GPKG/shapefile). Filters are
+    applied while reading: CDR column projection plus date / user filters in
+    the parquet scan, explicit network dtypes, and the water attribute / bbox
+    filter in the vector driver. load_all reads the three concurrently.
+    """
+    def __init__(self, cdr: str, network: str, rivers: str, water_name: str = "Tagus River",
+                 water_type: str = "ways_poly", water_bbox=None):
+        self.cdr = cdr
+        self.network = network
+        self.rivers = rivers
+        self.water_name = water_name
+        self.water_type = water_type
+        self.water_bbox = water_bbox
+        # Per-input wall time (s) and rows of the last loads
+        self.load_report = {}
+        self.logger = logging.getLogger("MobilityPipeline.DataSource")
+
+    def resolve(self, ref: str) -> str:
+        """Location a reference points to; local paths are used as they are."""
+        return ref
+
+    def _timed(self, name, fn):
+        start = time.perf_counter()
+        out = fn()
+        self.load_report[name] = {"wall_s": round(time.perf_counter() - start, 4), "rows": len(out)}
+        self.logger.info("Loaded %s: %d rows in %.2fs", name, len(out), self.load_report[name]["wall_s"])
+        return out
+
+    def load_cdr(self, columns=CDR_COLUMNS, start=None, end=None, users=None,
+                 date_col: str = "event_date") -> pd.DataFrame:
+        """CDR columns, optionally only dates in [start, end] and the given users."""
+        path = self.resolve(self.cdr)
+        self.logger.info("Loading CDRs from %s", path)
+        if os.path.splitext(path.rstrip("/"))[1].lower() == ".csv":
+            return self._timed("cdr", lambda: self._filter_csv(read_table(path, columns=columns),
+                                                               start, end, users, date_col))
+        filters = cdr_filters(path, date_col=date_col, start=start, end=end, users=users)
+        return self._timed("cdr", lambda: read_table(path, columns=columns, filters=filters))
+
+    @staticmethod
+    def _filter_csv(cdr, start, end, users, date_col):
+        # No pushdown for CSVs: same filters, after reading
+        if start is not None or end is not None:
+            day = pd.to_datetime(cdr[date_col]).dt.normalize()
+            keep = day.between(pd.Timestamp(start) if start is not None else day.min(),
+                               pd.Timestamp(end) if end is not None else day.max())
+            cdr = cdr.loc[keep]
+        if users is not None:
+            cdr = cdr.loc[cdr["unique_id"].isin(list(users))]
+        return cdr.reset_index(drop=True)
+
+    def load_network(self) -> pd.DataFrame:
+        path = self.resolve(self.network)
+        self.logger.info("Loading network from %s", path)
+        if os.path.splitext(path.rstrip("/"))[1].lower() == ".csv":
+            # Only the known columns, parsed straight into their dtypes
+            return self._timed("network", lambda: pd.read_csv(path, usecols=lambda c: c in NETWORK_DTYPES,
+                                                              dtype=NETWORK_DTYPES))
+        return self._timed("network", lambda: read_table(path))
+
+    def load_rivers(self):
+        self.logger.info("Loading water polygons from %s", self.rivers)
+        return self._timed("rivers", lambda: read_water(self.rivers, name=self.water_name,
+                                                        osm_type=self.water_type, bbox=self.water_bbox))
+
+    def load_all(self, start=None, end=None, users=None, max_workers: int = 3):
+        """
+        (cdr, network, rivers), read concurrently in threads (parquet, CSV and
+        OGR readers release the GIL for most of their work).
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            cdr = pool.submit(self.load_cdr, start=start, end=end, users=users)
+            network = pool.submit(self.load_network)
+            rivers = pool.submit(self.load_rivers)
+            return cdr.result(), network.result(), rivers.result()
+
+
+class AzureMLSource(LocalSource):
+    """
+    CDR and network as Azure ML data assets ("name:version"); water polygons
+    stay a local file. azure-ai-ml / azure-identity are only imported here.
+    Reading azureml:// paths needs azureml-fsspec installed.
+    """
+    def __init__(self, cdr: str, network: str, rivers: str, config_path: str = "config.json", **kwargs):
+        super().__init__(cdr, network, rivers, **kwargs)
+        self.config_path = config_path
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:  # load_all resolves CDR and network from two threads
+            return self._get_client()
+
+    def _get_client(self):
+        if self._client is None:
+            ml = lazy_import("azure.ai.ml")
+            identity = lazy_import("azure.identity")
+            self._client = ml.MLClient.from_config(credential=identity.DefaultAzureCredential(),
+                                                   path=self.config_path)
+        return self._client
+
+    def resolve(self, ref: str) -> str:
+        name, _, version = ref.partition(":")
+        return self.client.data.get(name=name, version=version or "1").path
+
+
+# Source backends selectable by name (e.g. from the CLI); register_source adds more
+SOURCES = {"local": LocalSource, "azure": AzureMLSource}
+
+
+def register_source(name: str, cls):
+    SOURCES[name] = cls
+
+
+def prepare_network(network: pd.DataFrame) -> pd.DataFrame:
+    """Network table with the integer cell_id the pipeline keys towers on."""
+    network = network.dropna(how="all").copy()
+    network["cell_id"] = network["cgi_key"].astype("int")
+    network["cell_key"] = network["cgi_key"].astype("int")
+    return network
+
+
+def prepare_inputs(cdr: pd.DataFrame, network: pd.DataFrame, join: bool = True):
+    """
+    CDRs as the pipeline expects them. join=True: joined with the network
+    table (same steps as main.py), one wide frame. join=False: CDRs keep only
+    a cell_id (rows of unknown towers dropped, as the inner join does) and the
+    prepared network table is returned alongside, as (cdr, network) for
+    MobilityPipeline.run(..., network=network); no network column is copied
+    onto the rows.
+    """
+    network = prepare_network(network)
+    if join:
+        cdr = cdr.copy()
+        cdr["a_bts_cgi"] = cdr["a_bts_cgi"].astype("int")
+        return pd.merge(cdr, network[NETWORK_COLUMNS], left_on="a_bts_cgi", right_on="cgi_key", how="inner")
+
+    cell_id = cdr["a_bts_cgi"].astype("int")
+    known = cell_id.isin(network["cell_id"]).to_numpy()
+    cdr = cdr.drop(columns=["a_bts_cgi"]).assign(cell_id=cell_id)
+    return cdr.loc[known].reset_index(drop=True), network
+
+
+def select_rivers(rivers, name: str = "Tagus River", osm_type: str = "ways_poly"):
+    """The water polygons used for sector masking (HOT OSM waterways export)."""
+    return rivers.loc[(rivers["name:en"] == name) & (rivers["osm_type"] == osm_type)]
@@ -0,0 +1,130 @@
+# mobility_pipeline/event_compression.py
+import logging
+import numpy as np
+import pandas as pd
+
+
+class EventCompressor:
+    """
+    Shrinks user traces ([lat, lon, t] rows sorted by user and time) before
+    InfoStop, and maps the labels back to every original row:
+      - exact duplicates (same user, time and position, i.e. same cell) are
+        dropped where another event sits between them; back-to-back copies
+        are left to the dwell step, so they still count towards min_size;
+      - consecutive events of a user at the same position form a dwell record
+        (first / last timestamp, count). A dwell is cut where the time between
+        two events exceeds max_time_between, and into windows shorter than
+        max_time_between; each window keeps its first min_size - 1 events and
+        its last one. The rest of a window takes the label of its first event.
+
+    What InfoStop's stationary-event pass sees is unchanged: every kept gap
+    stays within max_time_between, the first and last timestamp of a stay
+    are kept, and a stay of at least min_size events keeps at least min_size.
+    The group medians only differ when a group mixes positions closer than r1
+    (e.g. two cells whose estimated positions for the user nearly coincide).
+    """
+    def __init__(self, max_time_between: float = 86400, min_size: int = 2):
+        self.max_time_between = max_time_between
+        self.min_size = max(int(min_size), 2)
+        self.report = None
+        self.logger = logging.getLogger("MobilityPipeline.EventCompressor")
+
+    @classmethod
+    def from_params(cls, params: dict):
+        """Compressor matching an InfoStop parameter dict."""
+        return cls(max_time_between=params.get("max_time_between", 86400), min_size=params.get("min_size", 2))
+
+    @staticmethod
+    def _duplicate_of(codes, points) -> np.ndarray:
+        """Per row, the first row with the same user, time and position (itself if none)."""
+        n = len(points)
+        rep = np.arange(n)
+        # Rows are sorted by user and time, so duplicates sit in blocks of equal (user, time);
+        # only rows of blocks with more than one event need the full comparison
+        t = points[:, 2]
+        same_time = (codes[1:] == codes[:-1]) & (t[1:] == t[:-1])
+        in_block = np.r_[same_time, False] | np.r_[False, same_time]
+        rows = np.flatnonzero(in_block)
+        if rows.size == 0:
+            return rep
+
+        c, lat, lon, t = codes[rows], points[rows, 0], points[rows, 1], t[rows]
+        order = np.lexsort((rows, lon, lat, t, c))
+        same = np.zeros(rows.size, dtype=bool)
+        same[1:] = ((c[order][1:] == c[order][:-1]) & (t[order][1:] == t[order][:-1])
+                    & (lat[order][1:] == lat[order][:-1]) & (lon[order][1:] == lon[order][:-1]))
+        first = rows[order][~same]
+        rep[rows[order]] = first[np.cumsum(~same) - 1]
+        return rep
+
+    def _windows(self, codes, points):
+        """Run (dwell) and window ids per row (new window at every user / position / gap / window change)."""
+        n = len(points)
+        lat, lon, t = points[:, 0], points[:, 1], points[:, 2]
+        new_run = np.ones(n, dtype=bool)
+        new_run[1:] = ((codes[1:] != codes[:-1]) | (lat[1:] != lat[:-1]) | (lon[1:] != lon[:-1])
+                       | (t[1:] - t[:-1] > self.max_time_between))
+        run = np.cumsum(new_run) - 1
+        run_start_t = t[new_run][run]
+        # Windows shorter than max_time_between, so first-to-last of a window never exceeds it
+        window = np.floor((t - run_start_t) / self.max_time_between)
+        new_window = new_run.copy()
+        new_window[1:] |= window[1:] != window[:-1]
+        return run, new_run, np.cumsum(new_window) - 1, new_window
+
+    def dwells(self, codes, points) -> pd.DataFrame:
+        """Dwell records of a trace: user code, position, first / last timestamp and event count."""
+        codes = np.asarray(codes)
+        points = np.asarray(points, dtype=float)
+        run, new_run, _, _ = self._windows(codes, points)
+        starts = np.flatnonzero(new_run)
+        ends = np.r_[starts[1:], len(points)] - 1
+        return pd.DataFrame({
+            "user_code": codes[starts], "lat": points[starts, 0], "lon": points[starts, 1],
+            "first_ts": points[starts, 2], "last_ts": points[ends, 2], "count": np.bincount(run),
+        })
+
+    def compress(self, codes, points):
+        """
+        (kept, source): row indices of the reduced trace (still sorted), and per
+        original row the position in `kept` whose label it takes.
+        """
+        codes = np.asarray(codes)
+        points = np.asarray(points, dtype=float)
+        n = len(points)
+        if n == 0:
+            self.report = {"rows": 0, "duplicates": 0, "deduplicated_rows": 0, "dwells": 0, "trace_rows": 0, "reduction": None}
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        rep = self._duplicate_of(codes, points)
+        back_to_back = np.zeros(n, dtype=bool)
+        back_to_back[1:] = rep[1:] == rep[:-1]
+        drop = (rep != np.arange(n)) & ~back_to_back
+        unique_rows = np.flatnonzero(~drop)
+        c, p = codes[unique_rows], points[unique_rows]
+
+        _, new_run, window, new_window = self._windows(c, p)
+        starts = np.flatnonzero(new_window)
+        length = np.diff(np.r_[starts, len(p)])
+        pos = np.arange(len(p)) - np.repeat(starts, length)
+        keep = (pos < self.min_size - 1) | (pos == np.repeat(length, length) - 1)
+
+        kept = unique_rows[keep]
+        # Each unique row maps to itself if kept, else to its window's first row
+        slot = np.cumsum(keep) - 1
+        unique_source = np.where(keep, slot, slot[starts][window])
+        # Dropped duplicates go through the row they repeat (never dropped itself)
+        row_to_unique = (np.cumsum(~drop) - 1)[np.where(drop, rep, np.arange(n))]
+        source = unique_source[row_to_unique]
+
+        self.report = {
+            "rows": n,
+            "duplicates": int((rep != np.arange(n)).sum()),
+            "deduplicated_rows": len(unique_rows),
+            "dwells": int(new_run.sum()),
+            "trace_rows": len(kept),
+            "reduction": round(n / len(kept), 2),
+        }
+        self.logger.info("Event compression: %d rows → %d deduplicated → %d trace rows (%d dwells), x%.2f",
+                         n, len(unique_rows), len(kept), self.report["dwells"], self.report["reduction"])
+        return kept, source
@@ -0,0 +1,149 @@
+# mobility_pipeline/home_work.py
+import numpy as np
+import pandas as pd
+
+NS_PER_HOUR = 3_600_000_000_000
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+
+class HomeWorkEngine:
+    """
+    OSNA home/work labelling (as trackintel's osna_method) on arrays.
+    Weekday time is split into frames rest [start_rest, start_work),
+    work [start_work, start_leisure) and leisure (the rest of the day);
+    weekends are ignored. Per (user, location) the rest and leisure time
+    (weighted) counts as "home" time and work-frame time as "work" time; the
+    location with the most home time is the user's home, the one with the most
+    work time (another location than home) the work place.
+
+    split="midpoint" puts a whole staypoint in the frame of its mean time,
+    which is what osna_method does and gives identical labels.
+    split="intervals" cuts staypoints at the frame boundaries (local wall
+    clock) and credits each piece to its own frame, so a stay from 18:00
+    to 09:00 counts towards work, leisure and rest.
+    """
+    def __init__(self, weekend=(5, 6), start_rest=2, start_work=8, start_leisure=19,
+                 rest_weight=0.739, leisure_weight=0.358):
+        self.weekend = tuple(weekend)
+        self.start_rest = start_rest
+        self.start_work = start_work
+        self.start_leisure = start_leisure
+        # Weights from the OSNA paper, as in trackintel
+        self.rest_weight = rest_weight
+        self.leisure_weight = leisure_weight
+
+    @staticmethod
+    def _wall_ns(values):
+        """int64 local wall-clock ns (tz-aware columns stay in their own tz) and NaT mask."""
+        idx = pd.DatetimeIndex(values)
+        if idx.tz is not None:
+            idx = idx.tz_localize(None)
+        return idx.as_unit("ns").asi8, idx.isna()
+
+    def _frame_weights(self, wall_ns):
+        """Home weight, work weight and in-home-frame / in-work-frame masks of wall-clock ns instants."""
+        hour = (wall_ns % NS_PER_DAY) // NS_PER_HOUR
+        weekday = (wall_ns // NS_PER_DAY + 3) % 7  # 1970-01-01 was a Thursday
+        weekday_ok = ~np.isin(weekday, self.weekend)
+        rest = weekday_ok & (hour >= self.start_rest) & (hour < self.start_work)
+        work = weekday_ok & (hour >= self.start_work) & (hour < self.start_leisure)
+        leisure = weekday_ok & ~rest & ~work
+        home_w = np.where(rest, self.rest_weight, np.where(leisure, self.leisure_weight, 0.0))
+        return home_w, work.astype(float), rest | leisure, work
+
+    def _durations_midpoint(self, start_ns, end_ns):
+        """Per staypoint: (row, home seconds, work seconds, has home frame, has work frame)."""
+        duration = end_ns - start_ns
+        mid = start_ns + duration // 2
+        home_w, work_w, is_home, is_work = self._frame_weights(mid)
+        seconds = duration / 1e9
+        rows = np.arange(len(start_ns))
+        return rows, seconds * home_w, seconds * work_w, is_home, is_work
+
+    def _durations_intervals(self, start_ns, end_ns):
+        """Staypoints cut into day frames; one output row per (staypoint, frame piece)."""
+        first_day = start_ns // NS_PER_DAY
+        n_days = np.maximum(end_ns // NS_PER_DAY - first_day + 1, 1)
+        rows = np.repeat(np.arange(len(start_ns)), n_days)
+        day = np.repeat(first_day, n_days) + (np.arange(rows.size) - np.repeat(np.cumsum(n_days) - n_days, n_days))
+
+        # Frame edges within a day: 0, rest, work, leisure, 24h
+        edges = np.array([0, self.start_rest, self.start_work, self.start_leisure, 24]) * NS_PER_HOUR
+        piece_rows = np.repeat(rows, 4)
+        day_start = np.repeat(day * NS_PER_DAY, 4)
+        lo = day_start + np.tile(edges[:-1], rows.size)
+        hi = day_start + np.tile(edges[1:], rows.size)
+        overlap = np.minimum(end_ns[piece_rows], hi) - np.maximum(start_ns[piece_rows], lo)
+        # Zero-length stays still mark their frame (osna keeps 0-duration entries)
+        zero = (start_ns == end_ns)[piece_rows] & (start_ns[piece_rows] >= lo) & (start_ns[piece_rows] < hi)
+        keep = (overlap > 0) | zero
+        piece_rows, lo, overlap = piece_rows[keep], lo[keep], np.maximum(overlap[keep], 0)
+
+        home_w, work_w, is_home, is_work = self._frame_weights(lo)
+        seconds = overlap / 1e9
+        return piece_rows, seconds * home_w, seconds * work_w, is_home, is_work
+
+    @staticmethod
+    def _pick(user_codes, score, present, candidates):
+        """
+        Per user, the candidate pair with the highest score (missing counts as 0,
+        ties go to the first pair, as idxmax does); returns the chosen pair
+        indices where the score is present.
+        """
+        idx = np.flatnonzero(candidates)
+        filled = np.where(present[idx], score[idx], 0.0)
+        users = user_codes[idx]
+        order = np.lexsort((idx, -filled, users))
+        first = np.r_[True, users[order][1:] != users[order][:-1]] if len(order) else np.zeros(0, dtype=bool)
+        chosen = idx[order[first]]
+        return chosen[present[chosen]]
+
+    def purpose(self, user_id, location_id, started_at, finished_at, split: str = "midpoint") -> np.ndarray:
+        """Array of "home" / "work" / None per staypoint."""
+        n = len(user_id)
+        out = np.full(n, None, dtype=object)
+        if n == 0:
+            return out
+
+        start_ns, start_nat = self._wall_ns(started_at)
+        end_ns, end_nat = self._wall_ns(finished_at)
+        nat = start_nat | end_nat
+        start_ns = np.where(nat, 0, start_ns)
+        end_ns = np.where(nat, 0, end_ns)
+        if split == "midpoint":
+            rows, home_s, work_s, is_home, is_work = self._durations_midpoint(start_ns, end_ns)
+        elif split == "intervals":
+            rows, home_s, work_s, is_home, is_work = self._durations_intervals(start_ns, end_ns)
+        else:
+            raise ValueError(f"split must be 'midpoint' or 'intervals', got {split!r}")
+        valid = ~nat[rows]
+
+        # (user, location) pairs in sorted order; pair codes per staypoint
+        pairs = pd.DataFrame({"user_id": np.asarray(user_id), "location_id": np.asarray(location_id)})
+        pair_code = pairs.groupby(["user_id", "location_id"], sort=True, dropna=False).ngroup().to_numpy()
+        n_pairs = pair_code.max() + 1
+        pair_user = np.zeros(n_pairs, dtype=np.int64)
+        pair_user[pair_code] = pd.factorize(pairs["user_id"], sort=True)[0]
+
+        p = pair_code[rows][valid]
+        home_sum = np.bincount(p, weights=home_s[valid], minlength=n_pairs)
+        work_sum = np.bincount(p, weights=work_s[valid], minlength=n_pairs)
+        has_home = np.bincount(p, weights=is_home[valid], minlength=n_pairs) > 0
+        has_work = np.bincount(p, weights=is_work[valid], minlength=n_pairs) > 0
+
+        # Only pairs with weekday time take part (weekend-only locations have no OSNA entry)
+        seen = has_home | has_work
+        pair_purpose = np.full(n_pairs, None, dtype=object)
+        home = self._pick(pair_user, home_sum, has_home, seen)
+        work = self._pick(pair_user, work_sum, has_work, seen)
+        pair_purpose[work] = "work"
+        pair_purpose[home] = "home"
+        overlap = np.intersect1d(home, work)
+        if overlap.size:
+            # Home wins; work goes to the next best location of those users
+            has_work[overlap] = False
+            work = self._pick(pair_user, work_sum, has_work, seen)
+            pair_purpose[work] = "work"
+
+        out[:] = pair_purpose[pair_code]
+        return out
@@ -0,0 +1,133 @@
+# mobility_pipeline/incremental.py
+import glob
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from kinematics import Kinematics
+
+
+class IncrementalState:
+    """
+    Carried-over state for day-by-day pipeline runs, kept under state_dir:
+      - state.json        ID counters and run log (staypoint IDs are 1-based, hence "last")
+      - tail.parquet      held-back CDR rows per user (movement after the last staypoint)
+      - locations.parquet stable stop_id per (user, location centroid)
+      - home_work.parquet current purpose per (user, location_id)
+      - staypoints/, triplegs/, trips/, pfs/  one parquet part per run
+    """
+    COUNTERS = ("last_staypoint_id", "next_tripleg_id", "next_trip_id", "next_stop_id")
+
+    def __init__(self, state_dir: str):
+        self.state_dir = state_dir
+        self.logger = logging.getLogger("MobilityPipeline.IncrementalState")
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self.runs = []
+        self.tail = None
+        self.locations = pd.DataFrame({"user_id": [], "stop_id": [], "lon": [], "lat": []})
+        self.home_work = None
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.state_dir, *parts)
+
+    def load(self):
+        if os.path.exists(self._path("state.json")):
+            with open(self._path("state.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            self.counters.update(meta.get("counters", {}))
+            self.runs = meta.get("runs", [])
+        if os.path.exists(self._path("tail.parquet")):
+            self.tail = pd.read_parquet(self._path("tail.parquet"))
+        if os.path.exists(self._path("locations.parquet")):
+            self.locations = pd.read_parquet(self._path("locations.parquet"))
+        if os.path.exists(self._path("home_work.parquet")):
+            self.home_work = pd.read_parquet(self._path("home_work.parquet"))
+        self.logger.info("Loaded incremental state: %d previous runs, %d tail rows",
+                         len(self.runs), 0 if self.tail is None else len(self.tail))
+        return self
+
+    def next_run_label(self) -> str:
+        return f"run-{len(self.runs) + 1:05d}"
+
+    # ---------- stable stop IDs ----------
+    def stabilize_stop_ids(self, df: pd.DataFrame, id_col: str, lon_col: str, lat_col: str,
+                           match_radius_m: float = 20.0) -> np.ndarray:
+        """
+        Map this run's InfoStop labels to stable per-user location IDs: a label whose
+        centroid lies within match_radius_m of a known location of the same user
+        reuses its ID, otherwise a new ID is issued. -1 (no stop) is kept.
+        """
+        labels = df["stop_id"].to_numpy()
+        stopped = labels >= 0
+        if not stopped.any():
+            return labels
+
+        new = (
+            pd.DataFrame({"user_id": df[id_col].to_numpy()[stopped], "label": labels[stopped],
+                          "lon": df[lon_col].to_numpy()[stopped], "lat": df[lat_col].to_numpy()[stopped]})
+            .groupby(["user_id", "label"], as_index=False)[["lon", "lat"]].mean()
+        )
+
+        cand = new.merge(self.locations, on="user_id", how="inner", suffixes=("", "_known"))
+        cand["dist"] = Kinematics.haversine_m(cand["lon"], cand["lat"], cand["lon_known"], cand["lat_known"])
+        cand = cand[cand["dist"] <= match_radius_m].sort_values("dist").drop_duplicates(["user_id", "label"])
+
+        new = new.merge(cand[["user_id", "label", "stop_id"]], on=["user_id", "label"], how="left")
+        unmatched = new["stop_id"].isna()
+        first_id = self.counters["next_stop_id"]
+        new.loc[unmatched, "stop_id"] = np.arange(first_id, first_id + unmatched.sum())
+        self.counters["next_stop_id"] = first_id + int(unmatched.sum())
+        new["stop_id"] = new["stop_id"].astype("int64")
+
+        self.locations = pd.concat(
+            [self.locations, new.loc[unmatched, ["user_id", "stop_id", "lon", "lat"]]], ignore_index=True
+        )
+        self.logger.info("Stop IDs: %d labels matched known locations, %d new",
+                         int((~unmatched).sum()), int(unmatched.sum()))
+
+        key = pd.MultiIndex.from_arrays([df[id_col].to_numpy(), labels])
+        lookup = pd.Series(new["stop_id"].to_numpy(), index=pd.MultiIndex.from_frame(new[["user_id", "label"]]))
+        out = lookup.reindex(key).to_numpy()
+        return np.where(stopped, out, -1).astype("int64")
+
+    # ---------- history ----------
+    def append(self, name: str, gdf, run_label: str):
+        """Write this run's part of a result table (staypoints, triplegs, trips, pfs)."""
+        if gdf is None or len(gdf) == 0:
+            return
+        os.makedirs(self._path(name), exist_ok=True)
+        path = self._path(name, f"{run_label}.parquet")
+        if gdf.index.name in gdf.columns:
+            # staypoints keep staypoint_id both as index and column
+            gdf = gdf.reset_index(drop=True)
+        if isinstance(gdf, gpd.GeoDataFrame):
+            gdf.to_parquet(path)
+        else:
+            gdf.to_parquet(path, index=True)
+
+    def read_history(self, name: str, users=None):
+        """Read all stored parts of a result table, optionally only for some users."""
+        paths = sorted(glob.glob(self._path(name, "*.parquet")))
+        if not paths:
+            return None
+        filters = [("user_id", "in", list(users))] if users is not None else None
+        parts = [gpd.read_parquet(p, filters=filters) for p in paths]
+        return pd.concat(parts)
+
+    def save(self, run_label: str, tail: pd.DataFrame):
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.tail = tail
+        tail.to_parquet(self._path("tail.parquet"), index=False)
+        self.locations.to_parquet(self._path("locations.parquet"), index=False)
+        if self.home_work is not None:
+            self.home_work.to_parquet(self._path("home_work.parquet"), index=False)
+
+        self.runs.append(run_label)
+        tmp = self._path("state.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"counters": {k: int(v) for k, v in self.counters.items()}, "runs": self.runs}, f, indent=2)
+        os.replace(tmp, self._path("state.json"))
+        self.logger.info("Saved incremental state after %s (%d tail rows)", run_label, len(tail))
+
@@ -1,9 +1,20 @@
 # mobility_pipeline/infostop_detector.py
 import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from infostop import Infostop
 from utils_geometry import GeometryUtils
+from schema import CDRSchema
+from event_compression import EventCompressor
+from profiler import profiled
+
+
+def _fit_predict_shard(engine, params: dict, traces: list):
+    """Process-pool worker: run one stop-detection model over a shard of user traces."""
+    start = time.perf_counter()
+    labels = InfoStopDetector.make_engine(engine, params).fit_predict(traces)
+    return labels, time.perf_counter() - start
 
 
 class InfoStopDetector:
@@ -13,57 +24,139 @@ class InfoStopDetector:
       - id_col (default 'unique_id')
       - time_col (default 'time_id')  -> will be converted to 'unix_timestamp'
       - est_lon, est_lat
+    With inplace=True the time columns are parsed into the input frame itself
+    and an input already sorted by user and time (e.g. CDRSchema.compact output)
+    is not copied at all; stop_id is then added to it directly.
+    With compress=True, duplicate events and repeated events at the same
+    position are folded before InfoStop (EventCompressor) and the labels are
+    expanded back to every row; compression_report holds the reduction.
+    engine picks the stop detection: "infostop" (infostop.Infostop),
+    "native" (NativeStopEngine, same parameters and stop_id contract) or any
+    object with Infostop's fit_predict(traces) -> list of label arrays.
     """
+    ENGINES = ("infostop", "native")
+
     def __init__(self,
                  id_col: str = "unique_id",
                  time_col: str = "time_id",
                  lon_col: str = "est_lon",
-                 lat_col: str = "est_lat"
+                 lat_col: str = "est_lat",
+                 n_workers: int = 1,
+                 shard_size: int = 5000,
+                 params: dict = None,
+                 inplace: bool = False,
+                 compress: bool = False,
+                 engine="infostop"
                  #,pickle_out: str = "datasets/processed_with_stops.pkl"
                  ):
         self.id_col = id_col
         self.time_col = time_col
         self.lon_col = lon_col
         self.lat_col = lat_col
+        # Parallel mode: users are split into shards of shard_size traces, run in n_workers processes
+        self.n_workers = n_workers
+        self.shard_size = shard_size
+        self.inplace = inplace
+        self.profiler = None  # optional StageProfiler, set by MobilityPipeline
         #self.pickle_out = pickle_out
         self.logger = logging.getLogger("MobilityPipeline.InfoStopDetector")
 
         # Your exact parameters:
-        self.model = Infostop(
+        self.params = dict(
             r1=20, r2=20,
             label_singleton=True,
             min_staying_time=600,
             max_time_between=86400,
             min_size=2
         )
+        if params:
+            self.params.update(params)
+        self.compress = compress
+        self.compression_report = None
+        if isinstance(engine, str) and engine not in self.ENGINES:
+            raise ValueError(f"Unknown stop engine {engine!r}; choose from {self.ENGINES}")
+        self.engine = engine
+        self._model = None
 
-    def run(self, df: pd.DataFrame) -> pd.DataFrame:
-        self.logger.info("Preparing data for InfoStop: %d rows", len(df))
-        # 1) Ensure time is clean and add unix_timestamp
-        if not np.issubdtype(df[self.time_col].dtype, np.datetime64):
-            # optional clean as in your snippet
-            if df[self.time_col].dtype == object:
+    @staticmethod
+    def make_engine(engine, params: dict):
+        """Stop-detection model for an engine name (an engine object is used as it is)."""
+        if not isinstance(engine, str):
+            return engine
+        if engine == "native":
+            from stop_engines import NativeStopEngine
+            return NativeStopEngine(**params)
+        from infostop import Infostop
+        return Infostop(**params)
+
+    @property
+    def engine_name(self) -> str:
+        return self.engine if isinstance(self.engine, str) else type(self.engine).__name__
+
+    @property
+    def model(self):
+        """The stop-detection model; infostop is only imported once a model is needed."""
+        if self._model is None:
+            self._model = self.make_engine(self.engine, self.params)
+        return self._model
+
+    def prepare(self, df: pd.DataFrame):
+        """
+        Frame sorted by user and time with 'unix_timestamp', the per-user
+        traces InfoStop takes ([est_lat, est_lon, unix_timestamp] arrays) and,
+        with compress, the row -> trace point index that expands labels back
+        (None without compression).
+        """
+        # 1) Ensure time is clean and add unix_timestamp (skipped when already parsed, e.g. CDRSchema.compact)
+        if not CDRSchema.is_compact_time(df, self.time_col):
+            if not self.inplace:
                 df = df.copy()
-                df[self.time_col] = df[self.time_col].astype(str).str.replace(".0", "", regex=False)
-            df = GeometryUtils.convert_to_unix_timestamp(df, self.time_col, output_col="unix_timestamp")
-        else:
-            df = GeometryUtils.convert_to_unix_timestamp(df, self.time_col, output_col="unix_timestamp")
+            df[self.time_col] = CDRSchema.parse_time(df[self.time_col])
+            df = GeometryUtils.convert_to_unix_timestamp(df, self.time_col, output_col="unix_timestamp",
+                                                         inplace=True)
 
-        # 2) Sort by user and time (critical)
-        df = df.sort_values(by=[self.id_col, "unix_timestamp"]).reset_index(drop=True)
+        # 2) Sort by user and time (critical); an already sorted frame is kept as is
+        codes, _ = pd.factorize(df[self.id_col], sort=True)
+        ts = df["unix_timestamp"].to_numpy()
+        in_order = bool(np.all((codes[1:] > codes[:-1]) | ((codes[1:] == codes[:-1]) & (ts[1:] >= ts[:-1]))))
+        if not (in_order and isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1):
+            df = df.sort_values(by=[self.id_col, "unix_timestamp"]).reset_index(drop=True)
+            codes, _ = pd.factorize(df[self.id_col], sort=True)
 
         # 3) Build traces per user in the order you requested: [est_lat, est_lon, unix_timestamp]
-        traces = [
-            grp[[self.lat_col, self.lon_col, "unix_timestamp"]].to_numpy()
-            for _, grp in df.groupby(self.id_col, sort=False)
-        ]
+        # (one array, split at user boundaries)
+        points = np.column_stack([df[self.lat_col].to_numpy(dtype=float), df[self.lon_col].to_numpy(dtype=float),
+                                  df["unix_timestamp"].to_numpy(dtype=float)])
+        source = None
+        if self.compress:
+            with profiled(self.profiler, "compress", rows_in=len(points)) as rec:
+                compressor = EventCompressor.from_params(self.params)
+                kept, source = compressor.compress(codes, points)
+                points, codes = points[kept], codes[kept]
+                self.compression_report = compressor.report
+                rec.rows_out = len(points)
+        traces = np.split(points, np.flatnonzero(codes[1:] != codes[:-1]) + 1) if len(points) else []
+        return df, traces, source
+
+    def run(self, df: pd.DataFrame) -> pd.DataFrame:
+        self.logger.info("Preparing data for InfoStop: %d rows", len(df))
+        with profiled(self.profiler, "prepare", rows_in=len(df)) as rec:
+            prepared, traces, source = self.prepare(df)
+            rec.rows_out = len(traces)
 
-        self.logger.info("Running InfoStop on %d user traces", len(traces))
-        labels_nested = self.model.fit_predict(traces)
+        with profiled(self.profiler, "fit_predict", rows_in=len(prepared)):
+            if self.n_workers > 1 and len(traces) > self.shard_size:
+                all_labels = self._fit_predict_parallel(traces)
+            else:
+                self.logger.info("Running %s on %d user traces", self.engine_name, len(traces))
+                labels_nested = self.model.fit_predict(traces)
 
-        # 4) Flatten and assign back
-        all_labels = np.concatenate(labels_nested)  # your exact line
-        out = df.copy()
+                # 4) Flatten and assign back
+                all_labels = np.concatenate(labels_nested)  # your exact line
+        if source is not None:
+            all_labels = all_labels[source]
+        # prepared is our own sorted copy unless the input was ready as it was
+        out = prepared.copy() if prepared is df and not self.inplace else prepared
         out["stop_id"] = all_labels
 
         # 5) Save to pickle
@@ -72,3 +165,31 @@ class InfoStopDetector:
 
         return out
 
+    def _fit_predict_parallel(self, traces: list) -> np.ndarray:
+        """
+        Run the stop engine on shards of user traces in a process pool. Labels come back
+        in trace order; each shard's non-negative labels are offset past the
+        previous shards' so stop_id stays globally unique (-1 is kept as is).
+        """
+        shards = [traces[i:i + self.shard_size] for i in range(0, len(traces), self.shard_size)]
+        self.logger.info("Running %s on %d user traces in %d shards with %d workers",
+                         self.engine_name, len(traces), len(shards), self.n_workers)
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+            results = list(pool.map(_fit_predict_shard, [self.engine] * len(shards), [self.params] * len(shards),
+                                    shards))
+
+        flat = []
+        offset = 0
+        for i, (labels_nested, elapsed) in enumerate(results):
+            labels = np.concatenate(labels_nested)
+            self.logger.info("Stop engine shard %d: %d traces, %d rows in %.1fs",
+                             i, len(shards[i]), len(labels), elapsed)
+            labels = np.where(labels >= 0, labels + offset, labels)
+            if (labels >= 0).any():
+                offset = labels.max() + 1
+            flat.append(labels)
+
+        self.logger.info("Parallel stop detection finished in %.1fs", time.perf_counter() - start)
+        return np.concatenate(flat)
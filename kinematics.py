@@ -0,0 +1,139 @@
+# mobility_pipeline/kinematics.py
+import numpy as np
+import pandas as pd
+import shapely
+
+EARTH_RADIUS_M = 6371000.0
+
+
+class Kinematics:
+    """
+    Lengths, durations, speeds and accelerations on triplegs and positionfixes.
+    Coordinates and timestamps are pulled out as arrays once; everything else
+    is NumPy over the whole table (run boundaries per user / tripleg instead of
+    groupby or per-geometry loops). Geometries are expected in WGS84; with a
+    projected CRS planar distances are used instead of haversine.
+    """
+
+    @staticmethod
+    def haversine_m(lon1, lat1, lon2, lat2):
+        lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype=float)) for v in (lon1, lat1, lon2, lat2))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+    @staticmethod
+    def _distance(x1, y1, x2, y2, planar):
+        if planar:
+            return np.hypot(x2 - x1, y2 - y1)
+        return Kinematics.haversine_m(x1, y1, x2, y2)
+
+    @staticmethod
+    def _is_planar(gdf) -> bool:
+        crs = getattr(gdf, "crs", None)
+        return crs is not None and crs.is_projected
+
+    @staticmethod
+    def _seconds(values) -> np.ndarray:
+        """Float seconds since epoch of a datetime-like Series (tz-aware or not), NaN for NaT."""
+        idx = pd.DatetimeIndex(values).as_unit("ns")
+        out = idx.asi8.astype(np.float64) / 1e9
+        out[idx.isna()] = np.nan
+        return out
+
+    @staticmethod
+    def line_lengths(geoms, planar=False) -> np.ndarray:
+        """Length in metres of each (Multi)LineString; 0 for empty / point-like geometries."""
+        geoms = np.asarray(geoms, dtype=object)
+        coords, index = shapely.get_coordinates(geoms, return_index=True)
+        if len(coords) < 2:
+            return np.zeros(len(geoms))
+        # Only consecutive vertices of the same geometry form a segment
+        same = index[1:] == index[:-1]
+        seg = Kinematics._distance(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1], planar)
+        return np.bincount(index[:-1][same], weights=seg[same], minlength=len(geoms))
+
+    @staticmethod
+    def tripleg_metrics(tpls, inplace: bool = False):
+        """
+        Adds 'length' (m), 'duration_minutes', 'speed_kmh' and 'speed_mps_geogr'
+        (length / duration, m/s) to triplegs. Speeds are NaN for non-positive
+        durations. inplace=True writes the columns into tpls instead of a copy.
+        """
+        out = tpls if inplace else tpls.copy()
+        length = Kinematics.line_lengths(out.geometry.array, planar=Kinematics._is_planar(out))
+
+        started = pd.to_datetime(out["started_at"])
+        finished = pd.to_datetime(out["finished_at"])
+        duration_s = Kinematics._seconds(finished) - Kinematics._seconds(started)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed_mps = np.where(duration_s > 0, length / duration_s, np.nan)
+
+        out["length"] = length
+        out["started_at"] = started
+        out["finished_at"] = finished
+        out["duration_minutes"] = duration_s / 60.0
+        out["speed_kmh"] = speed_mps * 3.6
+        out["speed_mps_geogr"] = speed_mps
+        return out
+
+    @staticmethod
+    def pfs_kinematics(pfs, by=("user_id",), inplace: bool = False):
+        """
+        Per-fix speed ('speed_mps', 'speed_kmh') from the distance and time since
+        the previous fix of the same group (by: columns, e.g. ("user_id", "tripleg_id")),
+        and acceleration ('accel_mps2') from consecutive speeds. As in trackintel,
+        the first fix of a group takes the second fix's speed; single-fix groups
+        and zero time steps give NaN. Rows keep their order in the output.
+        """
+        out = pfs if inplace else pfs.copy()
+        n = len(out)
+        if n == 0:
+            for col in ("speed_mps", "speed_kmh", "accel_mps2"):
+                out[col] = np.array([], dtype=float)
+            return out
+
+        by = [by] if isinstance(by, str) else list(by)
+        # NaN keys (e.g. fixes outside any tripleg) get code -1 and form their own group
+        codes = [pd.factorize(out[col], sort=True)[0] for col in by]
+        t = Kinematics._seconds(out["tracked_at"])
+        order = np.lexsort([t] + codes[::-1])
+
+        xy = shapely.get_coordinates(np.asarray(out.geometry.array, dtype=object))
+        if len(xy) != n:
+            raise ValueError("pfs_kinematics expects one non-empty Point per positionfix")
+        x, y, ts = xy[order, 0], xy[order, 1], t[order]
+
+        new_group = np.zeros(n, dtype=bool)
+        new_group[0] = True
+        for c in codes:
+            c = c[order]
+            new_group[1:] |= c[1:] != c[:-1]
+
+        dist = np.full(n, np.nan)
+        dt = np.full(n, np.nan)
+        dist[1:] = Kinematics._distance(x[:-1], y[:-1], x[1:], y[1:], Kinematics._is_planar(out))
+        dt[1:] = ts[1:] - ts[:-1]
+        dist[new_group] = np.nan
+        dt[new_group] = np.nan
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = np.where(dt > 0, dist / dt, np.nan)
+            # First fix of a group: second fix's speed, if the group has one
+            first = np.flatnonzero(new_group)
+            has_next = (first + 1 < n) & ~np.r_[new_group[1:], True][first]
+            speed[first[has_next]] = speed[first[has_next] + 1]
+
+            accel = np.full(n, np.nan)
+            accel[1:] = (speed[1:] - speed[:-1]) / dt[1:]
+            accel[new_group] = np.nan
+            accel[~(dt > 0)] = np.nan
+
+        speed_out = np.empty(n)
+        accel_out = np.empty(n)
+        speed_out[order] = speed
+        accel_out[order] = accel
+        out["speed_mps"] = speed_out
+        out["speed_kmh"] = speed_out * 3.6
+        out["accel_mps2"] = accel_out
+        return out
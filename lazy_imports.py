@@ -0,0 +1,26 @@
+# mobility_pipeline/lazy_imports.py
+import importlib
+import logging
+import sys
+import time
+
+# First-import wall time (s) of every module loaded through lazy_import
+IMPORT_TIMES = {}
+
+logger = logging.getLogger("MobilityPipeline.Imports")
+
+
+def lazy_import(name: str):
+    """
+    importlib.import_module that records how long the first import took, so
+    heavy dependencies (trackintel, infostop, geopandas, azure) are only paid
+    for by the stages that use them and show up in the startup report.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - start
+    logger.info("Imported %s in %.2fs", name, IMPORT_TIMES[name])
+    return module
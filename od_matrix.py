@@ -0,0 +1,324 @@
+# mobility_pipeline/od_matrix.py
+import json
+import logging
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+
+class ZoneIndex:
+    """
+    Maps points (lon / lat, EPSG:4326) to zone codes 0..n-1, -1 outside every
+    zone. Zones are tower sites (nearest tower), a tower attribute such as
+    concelho (region of the nearest tower), polygons (STRtree) or a regular
+    grid in the projected CRS. Two OD matrices can only be merged when built
+    on equal zones, so build the index once and share it between partitions.
+    """
+    def __init__(self, kind: str, labels, locator, meta=None):
+        self.kind = kind
+        self.labels = np.asarray(labels)
+        self._locate = locator
+        # Whatever else identifies the zoning (grid origin / size, CRS)
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __eq__(self, other):
+        return (isinstance(other, ZoneIndex) and self.kind == other.kind and self.meta == other.meta
+                and np.array_equal(self.labels, other.labels))
+
+    def locate(self, lon, lat) -> np.ndarray:
+        """int32 zone code per point; -1 for points outside (or NaN)."""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        codes = np.full(len(lon), -1, dtype=np.int32)
+        ok = np.isfinite(lon) & np.isfinite(lat)
+        if ok.any():
+            codes[ok] = self._locate(lon[ok], lat[ok])
+        return codes
+
+    @staticmethod
+    def _tower_tree(network, crs_proj):
+        """KD-tree over tower sites (co-located sectors share one site, labelled with their smallest cell_id)."""
+        towers = (network.dropna(subset=["longitude_cell", "latitude_cell"])
+                  .sort_values("cell_id").drop_duplicates(["longitude_cell", "latitude_cell"]))
+        to_proj = Transformer.from_crs("EPSG:4326", crs_proj, always_xy=True)
+        x, y = to_proj.transform(towers["longitude_cell"].to_numpy(float), towers["latitude_cell"].to_numpy(float))
+        return towers.reset_index(drop=True), cKDTree(np.column_stack([x, y])), to_proj
+
+    @classmethod
+    def from_towers(cls, network: pd.DataFrame, crs_proj="EPSG:3763", max_distance=None):
+        """Tower-site zones: each point goes to its nearest site (within max_distance metres, if set)."""
+        towers, tree, to_proj = cls._tower_tree(network, crs_proj)
+        bound = np.inf if max_distance is None else max_distance
+
+        def locate(lon, lat):
+            dist, idx = tree.query(np.column_stack(to_proj.transform(lon, lat)), distance_upper_bound=bound)
+            return np.where(np.isfinite(dist), idx, -1)
+
+        return cls("tower", towers["cell_id"].to_numpy(), locate, {"crs": str(crs_proj), "max_distance": max_distance})
+
+    @classmethod
+    def from_attribute(cls, network: pd.DataFrame, column: str = "concelho", crs_proj="EPSG:3763",
+                       max_distance=None):
+        """Region zones from a tower attribute: a point takes the attribute of its nearest tower site."""
+        towers, tree, to_proj = cls._tower_tree(network.dropna(subset=[column]), crs_proj)
+        labels, site_zone = np.unique(towers[column].astype(str).to_numpy(), return_inverse=True)
+        site_zone = np.append(site_zone, -1)  # tree.query returns len(sites) for "no neighbour"
+        bound = np.inf if max_distance is None else max_distance
+
+        def locate(lon, lat):
+            _, idx = tree.query(np.column_stack(to_proj.transform(lon, lat)), distance_upper_bound=bound)
+            return site_zone[idx]
+
+        return cls(column, labels, locate, {"crs": str(crs_proj), "max_distance": max_distance})
+
+    @classmethod
+    def from_polygons(cls, zones_gdf, label_col: str):
+        """Polygon zones (e.g. administrative areas); a point on a shared border goes to the first polygon."""
+        geoms = zones_gdf.geometry.values
+        tree = shapely.STRtree(np.asarray(geoms, dtype=object))
+        to_crs = Transformer.from_crs("EPSG:4326", zones_gdf.crs, always_xy=True)
+
+        def locate(lon, lat):
+            pts = shapely.points(*to_crs.transform(lon, lat))
+            pt_idx, zone_idx = tree.query(pts, predicate="intersects")
+            codes = np.full(len(pts), -1, dtype=np.int64)
+            # Reverse assignment so the lowest zone index wins for a point in several zones
+            codes[pt_idx[::-1]] = zone_idx[::-1]
+            return codes
+
+        return cls("polygon", zones_gdf[label_col].astype(str).to_numpy(), locate, {"crs": str(zones_gdf.crs)})
+
+    @classmethod
+    def grid(cls, bounds, cell_size: float = 1000.0, crs_proj="EPSG:3763"):
+        """
+        Regular grid over bounds (minx, miny, maxx, maxy in crs_proj), cell_size
+        metres. Labels are "col_row"; cells are numbered row by row.
+        """
+        minx, miny, maxx, maxy = map(float, bounds)
+        n_cols = max(int(np.ceil((maxx - minx) / cell_size)), 1)
+        n_rows = max(int(np.ceil((maxy - miny) / cell_size)), 1)
+        to_proj = Transformer.from_crs("EPSG:4326", crs_proj, always_xy=True)
+        cols, rows = np.meshgrid(np.arange(n_cols), np.arange(n_rows))
+        labels = np.char.add(np.char.add(cols.ravel().astype(str), "_"), rows.ravel().astype(str))
+
+        def locate(lon, lat):
+            x, y = to_proj.transform(lon, lat)
+            col = np.floor((x - minx) / cell_size).astype(np.int64)
+            row = np.floor((y - miny) / cell_size).astype(np.int64)
+            inside = (col >= 0) & (col < n_cols) & (row >= 0) & (row < n_rows)
+            return np.where(inside, row * n_cols + col, -1)
+
+        return cls("grid", labels, locate, {"crs": str(crs_proj), "bounds": [minx, miny, maxx, maxy],
+                                            "cell_size": float(cell_size)})
+
+    @staticmethod
+    def network_bounds(network: pd.DataFrame, crs_proj="EPSG:3763", margin: float = None):
+        """
+        Projected extent of the towers, padded by the largest sector radius
+        (or margin metres): a grid over it is the same for every partition.
+        """
+        to_proj = Transformer.from_crs("EPSG:4326", crs_proj, always_xy=True)
+        towers = network.dropna(subset=["longitude_cell", "latitude_cell"])
+        x, y = to_proj.transform(towers["longitude_cell"].to_numpy(float), towers["latitude_cell"].to_numpy(float))
+        if margin is None:
+            margin = float(towers["new_radius"].max()) if "new_radius" in towers.columns else 0.0
+        return (float(x.min()) - margin, float(y.min()) - margin, float(x.max()) + margin, float(y.max()) + margin)
+
+
+class ODMatrix:
+    """
+    Origin-destination flows between zones, one sparse (zones x zones) matrix
+    per time bin (hour of day of the trip start, local time, hours_per_bin
+    hours per bin). The bins are stacked into a single CSR matrix of
+    (n_bins * n_zones) x n_zones, row bin * n_zones + origin.
+
+    Matrices from different partitions / runs add up (merge, +) when built on
+    the same ZoneIndex and bins; save / load use a compressed .npz of the
+    non-zero (bin, origin, destination, flow) entries plus the zone labels.
+    """
+    def __init__(self, flows, labels, hours_per_bin: int = 1, kind: str = "zone", meta=None):
+        self.flows = sparse.csr_matrix(flows)
+        self.labels = np.asarray(labels)
+        self.hours_per_bin = int(hours_per_bin)
+        self.kind = kind
+        self.meta = meta or {}
+        self.logger = logging.getLogger("MobilityPipeline.ODMatrix")
+
+    @property
+    def n_zones(self):
+        return len(self.labels)
+
+    @property
+    def n_bins(self):
+        return 24 // self.hours_per_bin
+
+    # ---------- building ----------
+    @staticmethod
+    def trip_endpoints(trips, staypoints=None):
+        """
+        (origin lon, origin lat, destination lon, destination lat) per trip:
+        the origin / destination staypoint where the trip has one, else the
+        first / last point of the trip geometry.
+        """
+        geom = np.asarray(trips.geometry.values)  # plain object array: shapely ufuncs skip the pandas dispatch
+        first, last = shapely.get_geometry(geom, 0), shapely.get_geometry(geom, -1)
+        ends = [shapely.get_x(first), shapely.get_y(first), shapely.get_x(last), shapely.get_y(last)]
+        if staypoints is not None and len(staypoints):
+            sp_ids = staypoints["staypoint_id"] if "staypoint_id" in staypoints.columns else staypoints.index
+            sp = pd.Index(sp_ids.to_numpy())
+            sp_geom = np.asarray(staypoints.geometry.values)
+            sp_x, sp_y = shapely.get_x(sp_geom), shapely.get_y(sp_geom)
+            for i, col in ((0, "origin_staypoint_id"), (2, "destination_staypoint_id")):
+                if col not in trips.columns:
+                    continue
+                idx = sp.get_indexer(pd.to_numeric(trips[col]).to_numpy(dtype=float, na_value=np.nan))
+                found = idx >= 0
+                ends[i] = np.where(found, sp_x[idx], ends[i])
+                ends[i + 1] = np.where(found, sp_y[idx], ends[i + 1])
+        return ends
+
+    @classmethod
+    def from_trips(cls, trips, zones: ZoneIndex, staypoints=None, tz="Europe/Lisbon", hours_per_bin: int = 1,
+                   weights=None):
+        """
+        Flows of a trips table (trackintel trips, as TrackintelBridge.pfs_trips
+        returns them). weights: optional per-trip flow (e.g. expansion
+        factors), default 1 per trip. Trips with an end outside every zone are
+        left out (and counted in the log).
+        """
+        if 24 % int(hours_per_bin):
+            raise ValueError("hours_per_bin must divide 24")
+        n, n_bins = len(zones), 24 // int(hours_per_bin)
+        logger = logging.getLogger("MobilityPipeline.ODMatrix")
+        if len(trips) == 0:
+            return cls(sparse.csr_matrix((n_bins * n, n)), zones.labels, hours_per_bin, zones.kind, zones.meta)
+
+        o_lon, o_lat, d_lon, d_lat = cls.trip_endpoints(trips, staypoints)
+        origin, dest = zones.locate(o_lon, o_lat), zones.locate(d_lon, d_lat)
+        started = pd.DatetimeIndex(trips["started_at"])
+        hour = (started.tz_convert(tz) if started.tz is not None else started).hour.to_numpy()
+        time_bin = hour // int(hours_per_bin)
+        w = np.ones(len(trips)) if weights is None else np.asarray(weights, dtype=float)
+
+        ok = (origin >= 0) & (dest >= 0) & (hour >= 0)
+        if not ok.all():
+            logger.info("OD matrix: %d of %d trips have an end outside the zones", int((~ok).sum()), len(trips))
+        rows = time_bin[ok].astype(np.int64) * n + origin[ok]
+        # COO -> CSR sums the repeated (row, destination) entries
+        flows = sparse.coo_matrix((w[ok], (rows, dest[ok])), shape=(n_bins * n, n)).tocsr()
+        logger.info("OD matrix: %d trips → %d non-zero flows over %d %s zones, %d time bins",
+                    int(ok.sum()), flows.nnz, n, zones.kind, n_bins)
+        return cls(flows, zones.labels, hours_per_bin, zones.kind, zones.meta)
+
+    # ---------- combining ----------
+    def _check_compatible(self, other):
+        if (self.hours_per_bin != other.hours_per_bin or self.kind != other.kind
+                or self.meta != other.meta or not np.array_equal(self.labels, other.labels)):
+            raise ValueError("OD matrices differ in zones or time bins and cannot be merged")
+
+    def merge(self, *others):
+        """Sum of this matrix and others (e.g. one per partition or per day)."""
+        flows = self.flows
+        for other in others:
+            self._check_compatible(other)
+            flows = flows + other.flows
+        return ODMatrix(flows, self.labels, self.hours_per_bin, self.kind, self.meta)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    # ---------- queries ----------
+    def matrix(self, time_bin=None):
+        """zones x zones CSR flows of one time bin, or of the whole day (time_bin=None)."""
+        n = self.n_zones
+        if time_bin is not None:
+            return self.flows[time_bin * n:(time_bin + 1) * n]
+        # Fold the bins onto origin rows (row % n) without densifying
+        coo = self.flows.tocoo()
+        return sparse.coo_matrix((coo.data, (coo.row % n, coo.col)), shape=(n, n)).tocsr()
+
+    def total(self) -> float:
+        return float(self.flows.sum())
+
+    def to_frame(self) -> pd.DataFrame:
+        """Long table of the non-zero flows: time_bin, origin, destination, flow."""
+        coo = self.flows.tocoo()
+        return pd.DataFrame({
+            "time_bin": coo.row // self.n_zones,
+            "origin": self.labels[coo.row % self.n_zones],
+            "destination": self.labels[coo.col],
+            "flow": coo.data,
+        })
+
+    def top_k(self, k: int = 10, time_bin=None, by_bin: bool = False) -> pd.DataFrame:
+        """
+        The k largest flows (origin, destination, flow), from the non-zero
+        entries only. time_bin=None sums the day; by_bin=True ranks
+        (time_bin, origin, destination) cells instead.
+        """
+        m = self.flows if by_bin else self.matrix(time_bin)
+        m.sum_duplicates()
+        data = m.data
+        k = min(int(k), data.size)
+        if k == 0:
+            return pd.DataFrame(columns=["time_bin", "origin", "destination", "flow"] if by_bin
+                                else ["origin", "destination", "flow"])
+        top = np.argpartition(-data, k - 1)[:k]
+        top = top[np.lexsort((top, -data[top]))]
+        # Row of each stored entry, from the CSR row pointers
+        rows = np.repeat(np.arange(m.shape[0]), np.diff(m.indptr))[top]
+        out = {"origin": self.labels[rows % self.n_zones], "destination": self.labels[m.indices[top]],
+               "flow": data[top]}
+        if by_bin:
+            out = {"time_bin": rows // self.n_zones, **out}
+        return pd.DataFrame(out)
+
+    # ---------- storage ----------
+    def save(self, path: str):
+        """
+        Compressed .npz of the non-zero entries, the zone labels and meta (as
+        JSON). Integral flows are stored in the smallest integer type that
+        holds their range; other weights stay float64.
+        """
+        coo = self.flows.tocoo()
+        n = self.n_zones
+        index_dtype = np.uint16 if n < 2 ** 16 else np.uint32
+        data = coo.data
+        if data.size == 0:
+            data = data.astype(np.uint32)
+        elif np.all(np.isfinite(data)) and np.all(data == np.round(data)):
+            # trip counts; signed types only when there are negative weights
+            lo, hi = data.min(), data.max()
+            types = (np.uint8, np.uint16, np.uint32, np.uint64) if lo >= 0 else (np.int8, np.int16, np.int32, np.int64)
+            fits = [t for t in types if np.iinfo(t).min <= lo and hi <= np.iinfo(t).max]
+            if fits:
+                data = data.astype(fits[0])
+        np.savez_compressed(
+            path,
+            time_bin=(coo.row // n).astype(np.uint8),
+            origin=(coo.row % n).astype(index_dtype),
+            destination=coo.col.astype(index_dtype),
+            flow=data,
+            labels=self.labels.astype(str),
+            hours_per_bin=np.int64(self.hours_per_bin),
+            kind=np.str_(self.kind),
+            meta=np.str_(json.dumps(self.meta, default=float)),
+        )
+        self.logger.info("OD matrix (%d flows) → %s", coo.nnz, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as f:
+            labels, hours_per_bin, kind = f["labels"], int(f["hours_per_bin"]), str(f["kind"])
+            meta = json.loads(str(f["meta"])) if "meta" in f.files else {}
+            n, n_bins = len(labels), 24 // hours_per_bin
+            rows = f["time_bin"].astype(np.int64) * n + f["origin"]
+            flows = sparse.coo_matrix((f["flow"].astype(float), (rows, f["destination"].astype(np.int64))),
+                                      shape=(n_bins * n, n)).tocsr()
+        return cls(flows, labels, hours_per_bin, kind, meta)
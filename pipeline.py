@@ -1,60 +1,550 @@
 import logging
-from  cdr_processor import CDRProcessor
-from mobility4py.trackintel_render import TrackintelBridge
-from infostop_detector import InfoStopDetector
-from analytics import MobilityAnalytics
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from profiler import StageProfiler
+from lazy_imports import lazy_import
 #from .staypoint_detector import StaypointDetector
 #from .trip_segmenter import TripSegmenter
 
+# Per-worker state of run_partitioned, set once by the pool initializer
+_worker_pipeline = None
+_worker_sectors = None
+
+
+def _init_partition_worker(config: dict, sectors_path: str):
+    """Pool initializer: one pipeline per process, sector table read once from disk."""
+    global _worker_pipeline, _worker_sectors
+    _worker_pipeline = MobilityPipeline(**config["pipeline"])
+    _worker_pipeline.stops = lazy_import("infostop_detector").InfoStopDetector(**config["infostop"])
+    _worker_pipeline.stops.profiler = _worker_pipeline.profiler
+    _worker_sectors = lazy_import("geopandas").read_parquet(sectors_path)
+
+
+def _run_partition(bucket: int, df: pd.DataFrame):
+    """Process-pool worker: enrichment and all later stages for one user bucket."""
+    start = time.perf_counter()
+    data = _worker_pipeline.run_users(df, _worker_sectors)
+    return bucket, data, time.perf_counter() - start
+
 class MobilityPipeline:
-    def __init__(self, radius_km=1.0, crs_proj="EPSG:3763", tz="Europe/Lisbon"):
-        self.cdr_processor = CDRProcessor(radius_km, crs_proj)
-        self.stops = InfoStopDetector()
-        self.ti = TrackintelBridge(tz=tz)
-        self.analytics = MobilityAnalytics(tz=tz)
+    def __init__(self, radius_km=1.0, crs_proj="EPSG:3763", tz="Europe/Lisbon", sector_cache_dir=None,
+                 infostop_workers=1, infostop_shard_size=5000, checkpoint_dir=None,
+                 profile_path=None, cprofile_stages=(), home_work_engine="osna",
+                 home_work_split="midpoint", inplace=False, compress_events=False, stop_engine="infostop",
+                 trackintel_workers=1, trackintel_memory_mb=None):
+        self.radius_km = radius_km
+        self.crs_proj = crs_proj
+        self.tz = tz
+        self.sector_cache_dir = sector_cache_dir
+        self.infostop_workers = infostop_workers
+        self.infostop_shard_size = infostop_shard_size
+        self.home_work_engine = home_work_engine
+        self.home_work_split = home_work_split
+        # inplace=True: stages may modify their input frames instead of copying them
+        # (pair with CDRSchema.compact; the input df is then not reusable after a run, and an
+        # already sorted processed_cdr also carries InfoStop's unix_timestamp / stop_id)
+        self.inplace = inplace
+        # Fold duplicate / repeated same-position events before InfoStop (EventCompressor)
+        self.compress_events = compress_events
+        # "infostop" or "native" (NativeStopEngine); see InfoStopDetector
+        self.stop_engine = stop_engine
+        # Triplegs / trips in per-user batches (TrackintelBridge): worker processes, and a per-worker memory budget
+        self.trackintel_workers = trackintel_workers
+        self.trackintel_memory_mb = trackintel_memory_mb
+        # Components are built on first use, so e.g. an enrichment-only run never imports trackintel/infostop
+        self._cdr_processor = None
+        self._stops = None
+        self._ti = None
+        self._analytics = None
+        self.checkpoints = lazy_import("checkpoint").CheckpointStore(checkpoint_dir) if checkpoint_dir else None
+        # Per-stage timings/rows/memory; cprofile_stages e.g. {"infostop", "cdr_processing.placement"}
+        self.profiler = StageProfiler(cprofile_stages=cprofile_stages)
+        self.profile_path = profile_path
         #elf.staypoint_detector = StaypointDetector()
         #self.trip_segmenter = TripSegmenter()
         self.logger = logging.getLogger("MobilityPipeline")
 
-    def run(self, df, rivers_gdf):
+    # ---------- components (lazy) ----------
+    @property
+    def cdr_processor(self):
+        if self._cdr_processor is None:
+            sector_cache = None
+            if self.sector_cache_dir:
+                sector_cache = lazy_import("sector_cache").SectorCache(self.sector_cache_dir)
+            self._cdr_processor = lazy_import("cdr_processor").CDRProcessor(
+                self.radius_km, self.crs_proj, sector_cache=sector_cache
+            )
+            self._cdr_processor.profiler = self.profiler
+        return self._cdr_processor
+
+    @cdr_processor.setter
+    def cdr_processor(self, value):
+        self._cdr_processor = value
+
+    @property
+    def stops(self):
+        if self._stops is None:
+            self._stops = lazy_import("infostop_detector").InfoStopDetector(
+                n_workers=self.infostop_workers, shard_size=self.infostop_shard_size, inplace=self.inplace,
+                compress=self.compress_events, engine=self.stop_engine
+            )
+            self._stops.profiler = self.profiler
+        return self._stops
+
+    @stops.setter
+    def stops(self, value):
+        self._stops = value
+
+    @property
+    def ti(self):
+        if self._ti is None:
+            self._ti = lazy_import("trackintel_render").TrackintelBridge(
+                tz=self.tz, n_workers=self.trackintel_workers, memory_budget_mb=self.trackintel_memory_mb)
+        return self._ti
+
+    @ti.setter
+    def ti(self, value):
+        self._ti = value
+
+    @property
+    def analytics(self):
+        if self._analytics is None:
+            self._analytics = lazy_import("analytics").MobilityAnalytics(
+                tz=self.tz, home_work_engine=self.home_work_engine, home_work_split=self.home_work_split
+            )
+        return self._analytics
+
+    @analytics.setter
+    def analytics(self, value):
+        self._analytics = value
+
+    # Stage graph: (name, outputs). Each stage reads earlier outputs from `data`.
+    STAGES = [
+        ("cdr_processing", ["processed_cdr"]),
+        ("infostop", ["stops"]),
+        ("positionfixes", ["pfs"]),
+        ("staypoints", ["sps", "pfs_sp"]),
+        ("home_work", ["staypoints_hw"]),
+        ("triplegs", ["pfs_tpl", "triplegs_raw"]),
+        ("metrics", ["triplegs_metrics", "pfs"]),
+        ("trips", ["trips", "staypoints", "triplegs"]),
+    ]
+
+    # Primary input of each stage, for row counts in the profile report
+    STAGE_INPUTS = {
+        "infostop": "processed_cdr", "positionfixes": "stops", "staypoints": "pfs", "home_work": "sps",
+        "triplegs": "pfs_sp", "metrics": "triplegs_raw", "trips": "triplegs_metrics",
+    }
+
+    def _stage_params(self, stage):
+        """Parameters that change a stage's output; part of its checkpoint key."""
+        if stage == "cdr_processing":
+            c = self.cdr_processor
+            return {"crs_proj": c.crs_proj, "arc_num_points": c.arc_num_points, "arc_tolerance": c.arc_tolerance}
+        if stage == "infostop":
+            s = self.stops
+            # Sharded runs cluster locations per shard, so labels differ (sharding only kicks in above shard_size traces)
+            sharded = s.shard_size if s.n_workers > 1 else None
+            return {"params": s.params, "id_col": s.id_col, "time_col": s.time_col,
+                    "compress": s.compress, "engine": s.engine_name, "shard_size": sharded}
+        if stage == "home_work":
+            a = self.analytics
+            return {"tz": self.tz, "engine": a.home_work_engine, "split": a.home_work_split}
+        if stage in ("positionfixes", "metrics"):
+            return {"tz": self.tz}
+        return {}
+
+    def _tracked_at(self, stops):
+        """Positionfix time column: 'timestamp' if the input has one, else InfoStop's parsed time column."""
+        return "timestamp" if "timestamp" in stops.columns else self.stops.time_col
+
+    def _run_stage(self, stage, data, df, rivers_gdf, network=None):
+        if stage == "cdr_processing":
+            return {"processed_cdr": self.cdr_processor.process(df, rivers_gdf, network=network)}
+        if stage == "infostop":
+            return {"stops": self.stops.run(data["processed_cdr"])}
+        if stage == "positionfixes":
+            return {"pfs": self.ti.to_positionfixes(data["stops"], tracked_at=self._tracked_at(data["stops"]))}
+        if stage == "staypoints":
+            _, sps = self.ti.build_staypoints_from_pfs(data["pfs"])
+            return {"sps": sps, "pfs_sp": self.ti.assign_staypoint_ids_to_pfs(data["pfs"], sps)}
+        if stage == "home_work":
+            return {"staypoints_hw": self.analytics.annotate_home_work(data["sps"])}
+        if stage == "triplegs":
+            pfs, tpls = self.ti.pfs_triplegs(data["pfs_sp"], data["staypoints_hw"])
+            return {"pfs_tpl": pfs, "triplegs_raw": tpls}
+        if stage == "metrics":
+            tpls = self.analytics.predict_transport_modes(data["triplegs_raw"])
+            # Both frames are this run's own intermediates, so the metrics go in without a copy
+            return {"pfs": self.analytics.add_pfs_speed(data["pfs_tpl"], inplace=True),
+                    "triplegs_metrics": self.analytics.add_tripleg_metrics(tpls, inplace=True)}
+        if stage == "trips":
+            staypoints, tpls, trips = self.ti.pfs_trips(data["triplegs_metrics"], data["staypoints_hw"])
+            return {"staypoints": staypoints, "triplegs": tpls, "trips": trips}
+        raise ValueError(f"Unknown stage: {stage}")
+
+    def run(self, df, rivers_gdf, resume_from=None, until=None, network=None):
+        """
+        Run the stage graph. With a checkpoint store, every stage output is saved
+        under a key chained from the input hash and stage parameters; stages with
+        a valid checkpoint are loaded instead of recomputed. resume_from forces
+        recomputation from that stage on (earlier stages must be checkpointed).
+        until stops after the given stage; the result then holds the tables
+        produced so far, and later stages' dependencies are never imported.
+        With `network`, df holds only CDRs with a cell_id (no joined network
+        columns) and towers are taken from the network table.
+        """
         try:
             self.logger.info("Pipeline started.")
-            df_processed = self.cdr_processor.process(df, rivers_gdf)
-            staypoints = self.stops.run(df_processed)
-            self.logger.info("Saving Staypoints.")
-            staypoints.to_pickle("output/staypoints.pkl")
+            names = [name for name, _ in self.STAGES]
+            for arg, value in (("resume_from", resume_from), ("until", until)):
+                if value is not None and value not in names:
+                    raise ValueError(f"Unknown stage {value!r} for {arg}; expected one of {names}")
+            names = names[:names.index(until) + 1] if until is not None else names
+            if resume_from is not None and resume_from not in names:
+                raise ValueError(f"Cannot resume from {resume_from!r}: it comes after until={until!r}")
+
+            keys = {}
+            if self.checkpoints is not None:
+                CheckpointStore = lazy_import("checkpoint").CheckpointStore
+                inputs = {"rivers": CheckpointStore.hash_frame(rivers_gdf)}
+                if network is not None:
+                    inputs["network"] = CheckpointStore.hash_frame(network)
+                upstream = CheckpointStore.stage_key("input", CheckpointStore.hash_frame(df), inputs)
+                for name in names:
+                    upstream = keys[name] = CheckpointStore.stage_key(name, upstream, self._stage_params(name))
+
+            # First stage that has to run: the first one without a valid checkpoint,
+            # or resume_from if that comes earlier
+            start = len(names)
+            for i, name in enumerate(names):
+                if not keys or not self.checkpoints.is_valid(name, keys[name]):
+                    start = i
+                    break
+            if resume_from is not None:
+                if names.index(resume_from) > start:
+                    raise ValueError(f"Cannot resume from {resume_from!r}: no valid checkpoint for {names[start]!r}")
+                start = names.index(resume_from)
+
+            self.profiler.reset()
+            data = {}
+            for i, (name, outputs) in enumerate(self.STAGES[:len(names)]):
+                input_name = self.STAGE_INPUTS.get(name)
+                rows_in = len(df) if input_name is None else len(data[input_name])
+                with self.profiler.stage(name, rows_in=rows_in) as rec:
+                    if i < start:
+                        rec.status = "checkpoint"
+                        data.update(self.checkpoints.load(name, keys[name], outputs))
+                    else:
+                        self.logger.info("Stage %s started.", name)
+                        result = self._run_stage(name, data, df, rivers_gdf, network=network)
+                        if keys:
+                            self.checkpoints.save(name, keys[name], result)
+                        data.update(result)
+                    rec.rows_out = len(data[outputs[0]])
+
+            if self.profile_path:
+                self.profiler.write_json(self.profile_path)
+
+            self.logger.info("Pipeline completed successfully.")
+            results = {"profile": self.profiler.report()}
+            if until is None:
+                results.update({name: data[name] for name in self.RESULT_TABLES})
+            else:
+                # Prefix run: every output of the stages that ran, under its result name
+                # (a later stage's version of a table replaces an earlier one)
+                for _, outputs in self.STAGES[:len(names)]:
+                    results.update({self.PARTIAL_RESULT_NAMES.get(out, out): data[out] for out in outputs})
+            return results
+        except Exception as e:
+            self.logger.error(f"Pipeline failed: {e}", exc_info=True)
+            raise
+
+    # Result tables returned by run / run_users / run_partitioned
+    RESULT_TABLES = ("processed_cdr", "staypoints", "staypoints_hw", "pfs", "triplegs", "trips")
+    # Result names of intermediate stage outputs, for run(until=...)
+    PARTIAL_RESULT_NAMES = {"sps": "staypoints", "pfs_sp": "pfs", "pfs_tpl": "pfs", "triplegs_raw": "triplegs",
+                            "triplegs_metrics": "triplegs"}
+
+    def run_users(self, df, sectors_gdf):
+        """
+        Enrichment against a prebuilt sector table plus every later stage, for a
+        self-contained set of users (all of their rows). No checkpoints; this is
+        the unit of work of run_partitioned.
+        """
+        self.profiler.reset()
+        with self.profiler.stage("cdr_processing", rows_in=len(df)) as rec:
+            data = {"processed_cdr": self.cdr_processor.enrich(df, sectors_gdf)}
+            rec.rows_out = len(data["processed_cdr"])
+        for name, outputs in self.STAGES[1:]:
+            with self.profiler.stage(name, rows_in=len(data[self.STAGE_INPUTS[name]])) as rec:
+                data.update(self._run_stage(name, data, df, None))
+                rec.rows_out = len(data[outputs[0]])
+        result = {name: data[name] for name in self.RESULT_TABLES}
+        result["profile"] = self.profiler.report()
+        return result
+
+    def _worker_config(self):
+        """Constructor arguments for the per-process pipelines of run_partitioned."""
+        s = self.stops
+        return {
+            "pipeline": {"radius_km": self.cdr_processor.radius_km, "crs_proj": self.cdr_processor.crs_proj,
+                         "tz": self.tz, "home_work_engine": self.analytics.home_work_engine,
+                         "home_work_split": self.analytics.home_work_split, "inplace": self.inplace,
+                         "trackintel_memory_mb": self.ti.memory_budget_mb},
+            "infostop": {"id_col": s.id_col, "time_col": s.time_col, "lon_col": s.lon_col, "lat_col": s.lat_col,
+                         "params": s.params, "inplace": s.inplace, "compress": s.compress, "engine": s.engine},
+        }
+
+    def run_partitioned(self, df, rivers_gdf, n_workers=None, n_partitions=None, network=None):
+        """
+        Same stages as run, with users hash-partitioned into n_partitions buckets
+        (default 4 per worker, for load balance) processed in n_workers processes.
+        The sector table is built once here and written to a temporary GeoParquet
+        file that every worker reads once at start-up. Bucket outputs are merged
+        in bucket order with stop, staypoint, tripleg and trip IDs offset so they
+        stay globally unique. network: as in run.
+        """
+        try:
+            n_workers = n_workers or os.cpu_count() or 1
+            n_partitions = n_partitions or 4 * n_workers
+            self.logger.info("Partitioned pipeline started: %d rows, %d partitions, %d workers.",
+                             len(df), n_partitions, n_workers)
+            self.profiler.reset()
+            with self.profiler.stage("sector_table", rows_in=len(df)) as rec:
+                sectors = self.cdr_processor.build_sector_table(df if network is None else network, rivers_gdf)
+                rec.rows_out = len(sectors)
+
+            tmp_dir = tempfile.mkdtemp(prefix="mobility_sectors_")
+            try:
+                sectors_path = os.path.join(tmp_dir, "sectors.parquet")
+                sectors[["cell_id", "geometry"]].to_parquet(sectors_path)
+                buckets = lazy_import("results_io").ResultsWriter.user_bucket(df[self.stops.id_col], n_partitions)
+
+                with self.profiler.stage("partitions", rows_in=len(df)) as rec:
+                    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_partition_worker,
+                                             initargs=(self._worker_config(), sectors_path)) as pool:
+                        futures = [pool.submit(_run_partition, bucket, part)
+                                   for bucket, part in df.groupby(buckets, sort=True)]
+                        parts = []
+                        for future in futures:
+                            bucket, data, elapsed = future.result()
+                            self.logger.info("Partition %d: %d rows in %.1fs", bucket,
+                                             len(data["processed_cdr"]), elapsed)
+                            parts.append((bucket, data))
+                    rec.rows_out = len(parts)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+            with self.profiler.stage("merge", rows_in=len(parts)):
+                results = self._merge_partitions([data for _, data in parts])
+
+            results["profile"] = self.profiler.report()
+            results["partition_profiles"] = {bucket: data["profile"] for bucket, data in parts}
+            if self.profile_path:
+                self.profiler.write_json(self.profile_path)
+            self.logger.info("Partitioned pipeline completed successfully.")
+            return results
+        except Exception as e:
+            self.logger.error(f"Partitioned pipeline failed: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _merge_partitions(parts):
+        """Concatenate per-bucket results, offsetting IDs past the previous buckets' (in place)."""
+        TrackintelBridge = lazy_import("trackintel_render").TrackintelBridge
+        staypoint_offset = tripleg_offset = trip_offset = stop_offset = 0
+        for data in parts:
+            pfs, sps, sps_hw = data["pfs"], data["staypoints"], data["staypoints_hw"]
+            tpls, trips = data["triplegs"], data["trips"]
+            TrackintelBridge.shift_ids(pfs, sps, tpls, trips, tripleg_offset=tripleg_offset,
+                                       trip_offset=trip_offset, staypoint_offset=staypoint_offset)
+            TrackintelBridge.shift_ids(sps=sps_hw, staypoint_offset=staypoint_offset)
+            # InfoStop labels restart in every bucket; -1 (no stop) is kept
+            for frame in (pfs, sps, sps_hw):
+                for col in ("stop_id", "location_id"):
+                    if col in frame.columns:
+                        frame[col] = frame[col].where(frame[col] < 0, frame[col] + stop_offset)
 
-            # 3) to TI positionfixes
-            pfs = self.ti.to_positionfixes(staypoints)
+            if len(sps):
+                staypoint_offset = int(sps.index.max())
+            if len(tpls):
+                tripleg_offset = int(tpls.index.max()) + 1
+            if len(trips):
+                trip_offset = int(trips.index.max()) + 1
+            if (pfs["stop_id"] >= 0).any():
+                stop_offset = int(pfs["stop_id"].max()) + 1
 
-            # 4) staypoints (from stop_id) and assign to pfs
-            sps = self.ti.build_staypoints_from_pfs(pfs)
+        merged = {}
+        for name in MobilityPipeline.RESULT_TABLES:
+            frames = [data[name] for data in parts]
+            if name in ("processed_cdr", "pfs"):
+                # Per-row tables get a fresh RangeIndex, as in run (bucket indexes overlap)
+                merged[name] = pd.concat(frames, ignore_index=True)
+            else:
+                # ID-indexed tables keep their (offset) IDs; the index name of an empty bucket may differ
+                merged[name] = pd.concat(frames)
+                merged[name].index.name = next((f.index.name for f in frames if len(f)), frames[0].index.name)
+        return merged
+
+    def write_results(self, results, root="output/results", partition_by="user", n_buckets=64,
+                      compression="zstd"):
+        """
+        Persist a results dict as GeoParquet tables under root. The large per-row
+        tables (processed_cdr, stops, pfs) are partitioned by partition_by ("user"
+        or "date"); staypoints, triplegs and trips are written as single tables.
+        """
+        writer = lazy_import("results_io").ResultsWriter(root, compression=compression)
+        time_cols = {"processed_cdr": self.stops.time_col, "stops": self.stops.time_col, "pfs": "tracked_at"}
+        paths = {}
+        for name, table in results.items():
+            if not isinstance(table, pd.DataFrame):
+                continue
+            partition = partition_by if name in time_cols else None
+            paths[name] = writer.write(
+                name, table, partition_by=partition, n_buckets=n_buckets,
+                user_col="unique_id" if name in ("processed_cdr", "stops") else "user_id",
+                time_col=time_cols.get(name), crs=self.cdr_processor.crs_proj
+            )
+        return paths
+
+    def od_matrix(self, results, network, zones="tower", hours_per_bin=1, cell_size=1000.0):
+        """
+        OD flows of a results dict (trips, with their origin / destination
+        staypoints) between zones: "tower" sites, "concelho" (or any other
+        network column) or a "grid" of cell_size metres over the network
+        extent; a ZoneIndex is used as is. Returns an ODMatrix.
+        """
+        od = lazy_import("od_matrix")
+        crs_proj = self.cdr_processor.crs_proj
+        if isinstance(zones, od.ZoneIndex):
+            index = zones
+        elif zones == "tower":
+            index = od.ZoneIndex.from_towers(network, crs_proj=crs_proj)
+        elif zones == "grid":
+            index = od.ZoneIndex.grid(od.ZoneIndex.network_bounds(network, crs_proj), cell_size, crs_proj=crs_proj)
+        else:
+            index = od.ZoneIndex.from_attribute(network, column=zones, crs_proj=crs_proj)
+        with self.profiler.stage("od_matrix"):
+            return od.ODMatrix.from_trips(results["trips"], index, staypoints=results.get("staypoints"),
+                                          tz=self.tz, hours_per_bin=hours_per_bin)
+
+    def run_incremental(self, df, rivers_gdf, state_dir="output/incremental", run_label=None,
+                        tail_window_s=86400, network=None):
+        """
+        Process one new batch (e.g. one day) of CDRs on top of state carried over
+        from previous runs in state_dir:
+          - held-back rows (movement after each user's last staypoint, and that
+            staypoint too while it is still open, i.e. ends within max_time_between
+            of the user's newest fix) are prepended as InfoStop / tripleg context and
+            are only emitted once a later staypoint closes them, or once they are
+            older than tail_window_s;
+          - stop_id, staypoint, tripleg and trip IDs continue from stored counters;
+          - home/work labels are recomputed only for users present in this batch.
+        """
+        try:
+            state = lazy_import("incremental").IncrementalState(state_dir).load()
+            run_label = run_label or state.next_run_label()
+            self.logger.info("Incremental pipeline %s started (%d new rows).", run_label, len(df))
+
+            df_processed = self.cdr_processor.process(df, rivers_gdf, network=network)
+            if state.tail is not None and len(state.tail):
+                df_processed = pd.concat([state.tail, df_processed], ignore_index=True)
+            cdr_cols = list(df_processed.columns)
+
+            stops = self.stops.run(df_processed)
+            stops["stop_id"] = state.stabilize_stop_ids(
+                stops, self.stops.id_col, self.stops.lon_col, self.stops.lat_col,
+                match_radius_m=self.stops.params["r2"]
+            )
+            stops["_row"] = np.arange(len(stops))
+
+            pfs = self.ti.to_positionfixes(stops, tracked_at=self._tracked_at(stops))
+            offset = state.counters["last_staypoint_id"]
+            _, sps = self.ti.build_staypoints_from_pfs(pfs, id_offset=offset)
             pfs_sp = self.ti.assign_staypoint_ids_to_pfs(pfs, sps)
 
-            sps_hw = self.analytics.annotate_home_work(sps)
-            self.logger.info("Saving Staypoints with HM.")
-            sps_hw.to_pickle("output/staypoints_with_hm.pkl")
+            # Hold back each user's still-open movement: rows after their last staypoint, plus that
+            # staypoint itself while it may continue into the next batch (it ends within
+            # max_time_between of the user's newest fix), e.g. home overnight across a daily cut
+            newest_by_user = pfs_sp.groupby("user_id")["tracked_at"].max()
+            last_sp = sps.loc[sps.groupby("user_id")["finished_at"].idxmax()] if len(sps) else sps
+            last_newest = last_sp["user_id"].map(newest_by_user)
+            still_open = (
+                (last_newest - last_sp["finished_at"] <= pd.Timedelta(seconds=self.stops.params["max_time_between"]))
+                & (last_sp["started_at"] > last_newest - pd.Timedelta(seconds=tail_window_s))
+            )
+            open_sps = last_sp[still_open]
+            last_end = pd.Series(last_sp["finished_at"].to_numpy(), index=last_sp["user_id"].to_numpy())
+            open_start = pd.Series(open_sps["started_at"].to_numpy(), index=open_sps["user_id"].to_numpy())
+            user_end = pfs_sp["user_id"].map(last_end)
+            user_open = pfs_sp["user_id"].map(open_start)
+            newest = pfs_sp.groupby("user_id")["tracked_at"].transform("max")
+            hold = (
+                ((user_end.isna() | (pfs_sp["tracked_at"] > user_end))
+                 & (pfs_sp["tracked_at"] > newest - pd.Timedelta(seconds=tail_window_s)))
+                | (pfs_sp["tracked_at"] >= user_open)
+            )
+            tail = stops.iloc[pfs_sp.loc[hold, "_row"].to_numpy()][cdr_cols]
+            pfs_sp = pfs_sp.loc[~hold].drop(columns=["_row"])
+            self.logger.info("Holding back %d rows (%d open staypoints) for the next run.", len(tail), len(open_sps))
 
+            if len(open_sps):
+                # The next run closes the open staypoints; renumber the rest so IDs stay dense
+                sps = sps.drop(index=open_sps.index)
+                ids = pd.Series(offset + 1 + np.arange(len(sps)), index=np.sort(sps["staypoint_id"].to_numpy()))
+                sps["staypoint_id"] = ids.reindex(sps["staypoint_id"].to_numpy()).to_numpy()
+                sps.index = pd.Index(sps["staypoint_id"].to_numpy(), name=sps.index.name)
+                pfs_sp["staypoint_id"] = pd.array(
+                    ids.reindex(pfs_sp["staypoint_id"].to_numpy(dtype="float64", na_value=np.nan)).to_numpy(),
+                    dtype="Int64")
+            if len(sps):
+                state.counters["last_staypoint_id"] = int(sps["staypoint_id"].max())
 
-            # 5) triplegs/trips (fill in your working TI calls)
-            pfs, tpls = self.ti.pfs_triplegs(pfs_sp)
-            pfs_spd = self.analytics.add_pfs_speed(pfs)
+            # Home/work: full staypoint history, but only for users with new data
+            users = pd.unique(sps["user_id"])
+            history = state.read_history("staypoints", users=users)
+            sps_all = sps if history is None else pd.concat([history[sps.columns.intersection(history.columns)], sps])
+            sps_all = sps_all.drop_duplicates("staypoint_id", keep="last")
+            labels = self.analytics.annotate_home_work(sps_all)[["user_id", "location_id", "purpose"]]
+            labels = labels.dropna(subset=["purpose"]).drop_duplicates(["user_id", "location_id"])
+            if state.home_work is not None:
+                labels = pd.concat([state.home_work[~state.home_work["user_id"].isin(users)], labels],
+                                   ignore_index=True)
+            state.home_work = pd.DataFrame(labels)
 
-            self.logger.info("Saving PFX with speed.")
-            pfs_spd.to_pickle("output/pfs.pkl")
+            sps_hw = sps.copy()
+            sps_hw["location_id"] = sps_hw["stop_id"]
+            sps_hw = sps_hw.merge(state.home_work, on=["user_id", "location_id"], how="left")
+            sps_hw = sps_hw.set_index(sps.index)
 
+            pfs, tpls = self.ti.pfs_triplegs(pfs_sp, sps_hw)
+            pfs_spd = self.analytics.add_pfs_speed(pfs, inplace=True)
             tpls = self.analytics.predict_transport_modes(tpls)
-            tpls = self.analytics.add_tripleg_metrics(tpls)
+            tpls = self.analytics.add_tripleg_metrics(tpls, inplace=True)
+            staypoints, tpls, trips = self.ti.pfs_trips(tpls, sps_hw)
 
-            self.logger.info("Saving Triplegs.")
-            tpls.to_pickle("output/triplegs.pkl")
+            pfs_spd, staypoints, tpls, trips = self.ti.shift_ids(
+                pfs_spd, staypoints, tpls, trips,
+                tripleg_offset=state.counters["next_tripleg_id"], trip_offset=state.counters["next_trip_id"]
+            )
+            if len(tpls):
+                state.counters["next_tripleg_id"] = int(tpls.index.max()) + 1
+            if len(trips):
+                state.counters["next_trip_id"] = int(trips.index.max()) + 1
 
-            staypoints, tpls, trips = self.ti.generate_trips(tpls, sps_hw)
+            for name, table in (("staypoints", staypoints), ("triplegs", tpls), ("trips", trips), ("pfs", pfs_spd)):
+                state.append(name, table, run_label)
+            state.save(run_label, tail)
 
-            #trips = self.trip_segmenter.segment(staypoints)
-            self.logger.info("Pipeline completed successfully.")
+            self.logger.info("Incremental pipeline %s completed successfully.", run_label)
             return {
-                "processed_cdr": df_processed,
+                "processed_cdr": stops.drop(columns=["_row"]),
                 "staypoints": staypoints,
                 "staypoints_hw": sps_hw,
                 "pfs": pfs_spd,
@@ -62,5 +552,27 @@ class MobilityPipeline:
                 "trips": trips
             }
         except Exception as e:
-            self.logger.error(f"Pipeline failed: {e}", exc_info=True)
+            self.logger.error(f"Incremental pipeline failed: {e}", exc_info=True)
+            raise
+
+    def run_cdr_stream(self, cdr_path, network, rivers_gdf, out_dir="output/processed_cdr",
+                       chunk_rows=1_000_000, columns=None, prepare_fn=None):
+        """
+        Bounded-memory CDR enrichment: sectors are built once from the network
+        table, then the CDR parquet is read in chunks of chunk_rows, enriched and
+        written to out_dir as parquet parts. prepare_fn maps a raw chunk to the
+        merged CDR+network frame, or just adds cell_id (data_sources.prepare_inputs
+        with join=False), since the network columns are not needed per row.
+        """
+        try:
+            self.logger.info("Streaming pipeline started (chunk_rows=%d).", chunk_rows)
+            sectors_gdf = self.cdr_processor.build_sector_table(network, rivers_gdf)
+            chunks = self.cdr_processor.iter_parquet_chunks(
+                cdr_path, columns=columns, chunk_rows=chunk_rows, prepare_fn=prepare_fn
+            )
+            paths = self.cdr_processor.process_stream(chunks, sectors_gdf, out_dir)
+            self.logger.info("Streaming pipeline completed successfully.")
+            return {"sectors": sectors_gdf, "processed_cdr_parts": paths}
+        except Exception as e:
+            self.logger.error(f"Streaming pipeline failed: {e}", exc_info=True)
             raise
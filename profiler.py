@@ -0,0 +1,123 @@
+# mobility_pipeline/profiler.py
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_mb():
+    """Process high-water RSS in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+class StageRecord:
+    """Measurements of one (sub-)stage; rows_in / rows_out can be set inside the block."""
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.status = "run"
+        self.wall_s = None
+        self.cpu_s = None
+        self.peak_rss_delta_mb = None
+        self.top_functions = None
+
+    def to_dict(self):
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        return {
+            "stage": self.name,
+            "status": self.status,
+            "wall_s": round(self.wall_s, 4),
+            "cpu_s": round(self.cpu_s, 4),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_s": round(rows / self.wall_s, 1) if rows and self.wall_s else None,
+            "peak_rss_delta_mb": None if self.peak_rss_delta_mb is None else round(self.peak_rss_delta_mb, 1),
+            "top_functions": self.top_functions,
+        }
+
+
+class StageProfiler:
+    """
+    Collects wall/CPU time, row counts, throughput and peak-RSS growth per stage.
+    Nested stages are named "<parent>.<child>". Stages listed in cprofile_stages
+    also run under cProfile; their stats go to profile_dir/<stage>.prof.
+    """
+    def __init__(self, cprofile_stages=(), profile_dir="output/profile", top_n=15):
+        self.cprofile_stages = set(cprofile_stages)
+        self.profile_dir = profile_dir
+        self.top_n = top_n
+        self.records = []
+        self._stack = []
+        self.logger = logging.getLogger("MobilityPipeline.Profiler")
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        full_name = ".".join(self._stack + [name])
+        record = StageRecord(full_name, rows_in)
+        self._stack.append(name)
+
+        prof = None
+        if full_name in self.cprofile_stages or name in self.cprofile_stages:
+            prof = cProfile.Profile()
+
+        rss_before = _peak_rss_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if prof is not None:
+            prof.enable()
+        try:
+            yield record
+        finally:
+            if prof is not None:
+                prof.disable()
+            record.wall_s = time.perf_counter() - wall
+            record.cpu_s = time.process_time() - cpu
+            rss_after = _peak_rss_mb()
+            if rss_before is not None:
+                record.peak_rss_delta_mb = rss_after - rss_before
+            if prof is not None:
+                record.top_functions = self._dump_cprofile(full_name, prof)
+            self._stack.pop()
+            self.records.append(record)
+            self.logger.info("Stage %s: %.2fs wall, %.2fs cpu, rows %s → %s",
+                             full_name, record.wall_s, record.cpu_s, record.rows_in, record.rows_out)
+
+    def _dump_cprofile(self, name, prof):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        prof.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(self.top_n)
+        return out.getvalue().splitlines()
+
+    def report(self):
+        """Records in completion order (children before their parent)."""
+        return [r.to_dict() for r in self.records]
+
+    def write_json(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        self.logger.info("Profile report → %s", path)
+
+    def reset(self):
+        self.records = []
+        self._stack = []
+
+
+def profiled(profiler, name, rows_in=None):
+    """profiler.stage(...) if a profiler is attached, else a no-op context."""
+    if profiler is None:
+        return contextlib.nullcontext(StageRecord(name, rows_in))
+    return profiler.stage(name, rows_in)
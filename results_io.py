@@ -0,0 +1,141 @@
+# mobility_pipeline/results_io.py
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from geopandas.array import GeometryDtype
+
+
+class ResultsWriter:
+    """
+    Writes pipeline result tables as GeoParquet (WKB geometry) under root/<name>/.
+    Tables can be partitioned hive-style by a user hash bucket or by date, so
+    readers can prune partitions and load single columns.
+    """
+    def __init__(self, root: str = "output/results", compression: str = "zstd"):
+        self.root = root
+        self.compression = compression
+        self.logger = logging.getLogger("MobilityPipeline.ResultsWriter")
+
+    @staticmethod
+    def user_bucket(user_ids, n_buckets: int) -> np.ndarray:
+        """Stable bucket per user (pandas hashing, not Python's salted hash())."""
+        hashes = pd.util.hash_pandas_object(pd.Series(user_ids).reset_index(drop=True), index=False)
+        return (hashes.to_numpy(dtype=np.uint64) % np.uint64(n_buckets)).astype(np.int64)
+
+    def write(self, name: str, df, partition_by: str = None, n_buckets: int = 64,
+              user_col: str = "user_id", time_col: str = None, crs=None) -> str:
+        """
+        Write one result table. partition_by is None, "user" (hash of user_col into
+        n_buckets) or "date" (local date of time_col). Replaces an existing table.
+        Shapely object columns other than the active geometry are stored as WKB.
+        """
+        if df is None:
+            return None
+        path = os.path.join(self.root, name)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        gdf, meta = self._prepare(df, crs)
+
+        if partition_by is None:
+            groups = [(None, gdf)]
+        elif partition_by == "user":
+            key = "user_bucket"
+            gdf[key] = self.user_bucket(gdf[user_col], n_buckets)
+            groups = gdf.groupby(key, sort=True)
+        elif partition_by == "date":
+            key = "date"
+            gdf[key] = pd.to_datetime(gdf[time_col]).dt.strftime("%Y-%m-%d")
+            groups = gdf.groupby(key, sort=True)
+        else:
+            raise ValueError(f"partition_by must be None, 'user' or 'date', got {partition_by!r}")
+
+        for value, part in groups:
+            part_dir = path if value is None else os.path.join(path, f"{key}={value}")
+            os.makedirs(part_dir, exist_ok=True)
+            if value is not None:
+                part = part.drop(columns=[key])
+            part_path = os.path.join(part_dir, "part-00000.parquet")
+            if isinstance(part, gpd.GeoDataFrame):
+                part.to_parquet(part_path, compression=self.compression)
+            else:
+                pd.DataFrame(part).to_parquet(part_path, compression=self.compression)
+
+        meta["partition_by"] = partition_by
+        with open(os.path.join(path, "_meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        self.logger.info("Wrote %s (%d rows, partition_by=%s) → %s", name, len(gdf), partition_by, path)
+        return path
+
+    @staticmethod
+    def _prepare(df, crs):
+        meta = {"wkb_columns": []}
+        out = df.copy()
+        if out.index.name is not None and out.index.name in out.columns:
+            # e.g. staypoints keep staypoint_id both as index and column
+            out = out.reset_index(drop=True)
+
+        geom_col = out.geometry.name if isinstance(out, gpd.GeoDataFrame) else None
+        for col in out.columns:
+            if col == geom_col or not ResultsWriter._is_geometry(out[col]):
+                continue
+            if geom_col is None and col == "geometry":
+                out = gpd.GeoDataFrame(out, geometry=col, crs=crs)
+                geom_col = col
+            else:
+                out[col] = shapely.to_wkb(np.asarray(out[col], dtype=object))
+                meta["wkb_columns"].append(col)
+
+        meta["geometry"] = geom_col
+        return out, meta
+
+    @staticmethod
+    def _is_geometry(col: pd.Series) -> bool:
+        if isinstance(col.dtype, GeometryDtype):
+            return True
+        if col.dtype != object:
+            return False
+        sample = col.dropna()
+        return len(sample) > 0 and isinstance(sample.iloc[0], shapely.Geometry)
+
+
+class ResultsReader:
+    """Reads tables written by ResultsWriter with column projection and row filters."""
+    def __init__(self, root: str = "output/results"):
+        self.root = root
+
+    def tables(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.exists(os.path.join(self.root, d, "_meta.json")))
+
+    def meta(self, name: str) -> dict:
+        with open(os.path.join(self.root, name, "_meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def read(self, name: str, columns=None, filters=None):
+        """
+        Load a table. columns projects columns (partition columns included);
+        filters uses pyarrow syntax, e.g. [("user_id", "in", [1, 2])] or
+        [("date", ">=", "2024-02-01")], and prunes partitions where possible.
+        """
+        path = os.path.join(self.root, name)
+        meta = self.meta(name)
+        geom_col = meta["geometry"]
+
+        if geom_col is not None and (columns is None or geom_col in columns):
+            df = gpd.read_parquet(path, columns=columns, filters=filters)
+        else:
+            df = pd.read_parquet(path, columns=columns, filters=filters)
+
+        for col in meta["wkb_columns"]:
+            if col in df.columns:
+                df[col] = shapely.from_wkb(df[col].to_numpy())
+        return df
@@ -0,0 +1,82 @@
+# mobility_pipeline/schema.py
+import logging
+import numpy as np
+import pandas as pd
+
+INT32 = np.iinfo(np.int32)
+
+
+class CDRSchema:
+    """
+    Compact column types for CDR (and, downstream, positionfix) frames:
+      - user IDs as a categorical with sorted categories, so sorting and
+        groupby order stay the same as on the raw values
+      - cell / tower codes as int32 where the values fit (raw cgi keys often don't)
+      - event time parsed once to datetime64, plus int64 epoch seconds in
+        'unix_timestamp', which InfoStopDetector then uses as is
+      - region and date strings (concelho, event_date) as categoricals
+    Coordinates stay float64.
+    """
+    INT_COLUMNS = ("tower", "cell_id", "a_bts_cgi", "cgi_key", "cell_key")
+    CATEGORY_COLUMNS = ("concelho", "event_date")
+
+    logger = logging.getLogger("MobilityPipeline.Schema")
+
+    @staticmethod
+    def parse_time(values: pd.Series) -> pd.Series:
+        """Event times as datetime64; object (string) times get the '.0' clean-up InfoStop always applied."""
+        if values.dtype == object:
+            values = values.astype(str).str.replace(".0", "", regex=False)
+        return pd.to_datetime(values)
+
+    @staticmethod
+    def epoch_seconds(times: pd.Series) -> pd.Series:
+        """int64 UNIX seconds of a (naive) datetime64 Series."""
+        return (times - pd.Timestamp("1970-01-01")) // pd.Timedelta("1s")
+
+    @staticmethod
+    def to_category(values: pd.Series) -> pd.Series:
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values
+        return values.astype(pd.CategoricalDtype(np.sort(values.dropna().unique())))
+
+    @staticmethod
+    def narrow_int(values: pd.Series) -> pd.Series:
+        """int32 copy of an integer column if every value fits, else the column unchanged."""
+        if not pd.api.types.is_integer_dtype(values.dtype) or values.dtype == np.int32 or values.empty:
+            return values
+        if values.min() >= INT32.min and values.max() <= INT32.max:
+            return values.astype(np.int32)
+        return values
+
+    @staticmethod
+    def compact(df: pd.DataFrame, id_col: str = "unique_id", time_col: str = "time_id",
+                inplace: bool = False) -> pd.DataFrame:
+        """
+        Apply the compact schema. Columns that are missing are skipped;
+        inplace=True converts the columns of df itself instead of a shallow copy.
+        """
+        out = df if inplace else df.copy(deep=False)
+
+        if id_col in out.columns:
+            out[id_col] = CDRSchema.to_category(out[id_col])
+        if time_col in out.columns:
+            if not np.issubdtype(out[time_col].dtype, np.datetime64):
+                out[time_col] = CDRSchema.parse_time(out[time_col])
+            out["unix_timestamp"] = CDRSchema.epoch_seconds(out[time_col])
+        for col in CDRSchema.INT_COLUMNS:
+            if col in out.columns:
+                out[col] = CDRSchema.narrow_int(out[col])
+        for col in CDRSchema.CATEGORY_COLUMNS:
+            if col in out.columns and (out[col].dtype == object or isinstance(out[col].dtype, pd.StringDtype)):
+                out[col] = CDRSchema.to_category(out[col])
+
+        CDRSchema.logger.info("Compact schema applied to %d rows", len(out))
+        return out
+
+    @staticmethod
+    def is_compact_time(df: pd.DataFrame, time_col: str = "time_id") -> bool:
+        """True if time_col is already parsed and 'unix_timestamp' is present (nothing left to convert)."""
+        return (time_col in df.columns and "unix_timestamp" in df.columns
+                and np.issubdtype(df[time_col].dtype, np.datetime64)
+                and pd.api.types.is_integer_dtype(df["unix_timestamp"].dtype))
@@ -0,0 +1,83 @@
+# mobility_pipeline/sector_cache.py
+import hashlib
+import logging
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+class SectorCache:
+    """
+    On-disk cache of clipped tower sectors (GeoParquet, WKB geometry).
+
+    Entries live under a context directory keyed on the water geometry, the
+    projected CRS and the arc resolution. Inside it every tower row carries a
+    content hash of its network columns, so a partially updated network file
+    only recomputes the towers whose hash is not cached yet.
+    """
+    TOWER_COLUMNS = ["cell_id", "longitude_cell", "latitude_cell", "azi_min1", "azi_max1", "new_radius"]
+
+    def __init__(self, cache_dir: str = "cache/sectors"):
+        self.cache_dir = cache_dir
+        self.logger = logging.getLogger("MobilityPipeline.SectorCache")
+
+    @staticmethod
+    def tower_hashes(towers: pd.DataFrame) -> np.ndarray:
+        """Stable uint64 content hash per tower row over TOWER_COLUMNS."""
+        cols = towers[SectorCache.TOWER_COLUMNS].reset_index(drop=True)
+        return pd.util.hash_pandas_object(cols, index=False).to_numpy(dtype=np.uint64)
+
+    @staticmethod
+    def context_key(water_geoms, crs_proj, **params) -> str:
+        """Hash of everything besides the towers that shapes a sector."""
+        h = hashlib.sha256()
+        for wkb in shapely.to_wkb(np.asarray(water_geoms, dtype=object)):
+            h.update(wkb if wkb is not None else b"")
+        h.update(str(crs_proj).encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()[:16]
+
+    def _path(self, context: str) -> str:
+        return os.path.join(self.cache_dir, context, "sectors.parquet")
+
+    def load(self, context: str):
+        path = self._path(context)
+        if not os.path.exists(path):
+            return None
+        return gpd.read_parquet(path)
+
+    def get_or_build(self, towers: pd.DataFrame, context: str, build_fn, crs) -> gpd.GeoDataFrame:
+        """
+        Return sectors (cell_id, geometry) for `towers`, building only the towers
+        missing from the cache with `build_fn(towers_subset) -> GeoDataFrame`.
+        """
+        hashes = self.tower_hashes(towers)
+        cached = self.load(context)
+
+        if cached is not None:
+            hit = np.isin(hashes, cached["tower_hash"].to_numpy(dtype=np.uint64))
+        else:
+            hit = np.zeros(len(towers), dtype=bool)
+
+        self.logger.info("Sector cache %s: %d of %d towers cached", context, int(hit.sum()), len(towers))
+
+        if not hit.all():
+            missing = towers.loc[~hit]
+            built = build_fn(missing)
+            built = gpd.GeoDataFrame(
+                {"cell_id": built["cell_id"].to_numpy(), "tower_hash": hashes[~hit]},
+                geometry=built.geometry.values, crs=crs
+            )
+            cached = built if cached is None else pd.concat([cached, built], ignore_index=True)
+            cached = cached.drop_duplicates("tower_hash", keep="last")
+
+            os.makedirs(os.path.dirname(self._path(context)), exist_ok=True)
+            tmp = self._path(context) + ".tmp"
+            cached.to_parquet(tmp, index=False)
+            os.replace(tmp, self._path(context))
+
+        lookup = cached.set_index("tower_hash")
+        geoms = lookup.geometry.reindex(pd.Index(hashes)).values
+        return gpd.GeoDataFrame({"cell_id": towers["cell_id"].to_numpy()}, geometry=geoms, crs=crs)
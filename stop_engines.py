@@ -0,0 +1,186 @@
+# mobility_pipeline/stop_engines.py
+import logging
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371000.0
+
+
+class NativeStopEngine:
+    """
+    Stop detection with the same interface as infostop.Infostop
+    (fit_predict(list of [lat, lon, t] traces) -> list of label arrays, -1
+    for non-stationary points, location labels shared across users), done
+    with array operations instead of per-point loops and Infomap:
+
+      1. Stationary events, per user: consecutive points stay in one event
+         while they are within r1 metres of the event's first point (the
+         roaming radius) and no time gap exceeds max_time_between. Events of
+         at least min_size points lasting at least min_staying_time are stops,
+         represented by their median position.
+      2. Locations: unique stop positions of all users are linked when closer
+         than r2 (KD-tree, "tree") and connected groups become one location; or
+         they are snapped to r2-sized grid cells ("grid"). A position without
+         neighbours gets its own label if label_singleton, else -1. Labels are
+         numbered by number of stop events, busiest location first.
+
+    On CDR traces, where a user's positions are already quantised to one point
+    per cell, this gives the same stops as InfoStop in most cases; locations
+    can differ where Infomap would split a chain of nearby positions.
+    Other Infostop parameters (weighted, weight_exponent, verbose) are
+    accepted and ignored, so one parameter dict serves both engines.
+    """
+    def __init__(self, r1=10, r2=10, label_singleton=True, min_staying_time=300, max_time_between=86400,
+                 min_size=2, min_spacial_resolution=0, distance_metric="haversine", cluster="tree", **_):
+        if cluster not in ("tree", "grid"):
+            raise ValueError(f"Unknown cluster method {cluster!r}; use 'tree' or 'grid'")
+        self.r1 = r1
+        self.r2 = r2
+        self.label_singleton = label_singleton
+        self.min_staying_time = min_staying_time
+        self.max_time_between = max_time_between
+        self.min_size = min_size
+        self.min_spacial_resolution = min_spacial_resolution
+        self.distance_metric = distance_metric
+        self.cluster = cluster
+        self.logger = logging.getLogger("MobilityPipeline.NativeStopEngine")
+
+    def _distance(self, lat1, lon1, lat2, lon2):
+        """Haversine metres (or plain euclidean for distance_metric='euclidean')."""
+        if self.distance_metric != "haversine":
+            return np.hypot(lat2 - lat1, lon2 - lon1)
+        lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def stationary_events(self, user, points):
+        """
+        Event id per point (points sorted by user and time) and, per event,
+        whether it is a stop.
+        """
+        lat, lon, t = points[:, 0], points[:, 1], points[:, 2]
+        n = len(points)
+        new = np.ones(n, dtype=bool)
+        new[1:] = ((user[1:] != user[:-1]) | (t[1:] - t[:-1] > self.max_time_between)
+                   | (self._distance(lat[:-1], lon[:-1], lat[1:], lon[1:]) > self.r1))
+        self._split_roaming(new, lat, lon)
+
+        event = np.cumsum(new) - 1
+        starts = np.flatnonzero(new)
+        ends = np.r_[starts[1:], n] - 1
+        size = ends - starts + 1
+        is_stop = (size >= self.min_size) & (t[ends] - t[starts] >= self.min_staying_time)
+        return event, is_stop
+
+    def _split_roaming(self, new, lat, lon, window: int = 32):
+        """
+        Roaming radius: a point further than r1 from its event's first point
+        starts a new event (new is updated in place). Every open event scans
+        forward from its anchor in windows that double while no stray point
+        turns up; at the first stray point it is cut and the rest continues
+        as a new event with a fresh window. Only open events are touched in a
+        pass, so work stays about linear in the points even for a slowly
+        drifting trace, and one such user does not rescan everyone else.
+        """
+        starts = np.flatnonzero(new)
+        ends = np.r_[starts[1:], len(new)]  # exclusive
+        anchor, cursor, end = starts, starts + 1, ends
+        width = np.full(len(starts), window, dtype=np.int64)
+        open_ = cursor < end
+        anchor, cursor, end, width = anchor[open_], cursor[open_], end[open_], width[open_]
+        while anchor.size:
+            stop = np.minimum(cursor + width, end)
+            lengths = stop - cursor
+            seg = np.repeat(np.arange(anchor.size), lengths)
+            idx = cursor[seg] + np.arange(seg.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            far = np.flatnonzero(self._distance(lat[anchor[seg]], lon[anchor[seg]], lat[idx], lon[idx]) > self.r1)
+            hit_seg, first = np.unique(seg[far], return_index=True)
+            cut = idx[far[first]]
+            new[cut] = True
+
+            # Cut events restart at the stray point; the others move on with a doubled window
+            anchor, cursor, width = anchor.copy(), stop.copy(), width * 2
+            anchor[hit_seg], cursor[hit_seg], width[hit_seg] = cut, cut + 1, window
+            open_ = cursor < end
+            anchor, cursor, end, width = anchor[open_], cursor[open_], end[open_], width[open_]
+
+    @staticmethod
+    def _group_median(values, group, n_groups):
+        """Median of values per group id 0..n_groups-1 (every group non-empty)."""
+        order = np.lexsort((values, group))
+        v = values[order]
+        counts = np.bincount(group, minlength=n_groups)
+        first = np.r_[0, np.cumsum(counts)[:-1]]
+        return (v[first + (counts - 1) // 2] + v[first + counts // 2]) / 2
+
+    def _project(self, coords):
+        """Local metric coordinates (equirectangular around the mean latitude) for the clustering step."""
+        if self.distance_metric != "haversine":
+            return coords
+        lat0 = np.radians(coords[:, 0].mean())
+        return np.column_stack([EARTH_RADIUS_M * np.radians(coords[:, 1]) * np.cos(lat0),
+                                EARTH_RADIUS_M * np.radians(coords[:, 0])])
+
+    def cluster_locations(self, coords):
+        """Location label per stop position (n x 2, lat / lon); -1 for unlabelled singletons."""
+        if self.min_spacial_resolution > 0:
+            coords = np.around(coords / self.min_spacial_resolution) * self.min_spacial_resolution
+        unique, inverse, counts = np.unique(coords, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        xy = self._project(unique)
+        n = len(unique)
+
+        if self.cluster == "grid":
+            cells = np.floor(xy / self.r2).astype(np.int64)
+            _, component = np.unique(cells, axis=0, return_inverse=True)
+            component = component.ravel()
+            singleton = np.bincount(component)[component] == 1
+        else:
+            pairs = cKDTree(xy).query_pairs(self.r2, output_type="ndarray")
+            graph = sparse.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+            _, component = connected_components(graph, directed=False)
+            singleton = np.bincount(pairs.ravel(), minlength=n) == 0
+
+        # Number locations by stop events, busiest first (ties by first position)
+        weight = np.bincount(component, weights=counts)
+        rank = np.empty(len(weight), dtype=np.int64)
+        rank[np.lexsort((np.arange(len(weight)), -weight))] = np.arange(len(weight))
+        labels = rank[component]
+        if not self.label_singleton:
+            labels = np.where(singleton, -1, labels)
+            # Close the gaps the dropped singletons leave
+            kept = np.unique(labels[labels >= 0])
+            labels = np.where(labels >= 0, np.searchsorted(kept, labels), -1)
+        return labels[inverse]
+
+    def fit_predict(self, data):
+        """Labels per trace (a single [lat, lon, t] array gives a single label array, as in Infostop)."""
+        single = not isinstance(data, list)
+        traces = [data] if single else data
+        lengths = np.array([len(tr) for tr in traces], dtype=np.int64)
+        if lengths.sum() == 0:
+            labels = [np.zeros(0, dtype=np.int64) for _ in traces]
+            return labels[0] if single else labels
+        points = np.concatenate([np.asarray(tr, dtype=float).reshape(-1, 3) for tr in traces])
+        user = np.repeat(np.arange(len(traces)), lengths)
+
+        event, is_stop = self.stationary_events(user, points)
+        row_labels = np.full(len(points), -1, dtype=np.int64)
+        stop_events = np.flatnonzero(is_stop)
+        if stop_events.size:
+            # Medians of the stop events only; event ids renumbered 0..k-1 among stops
+            stop_rows = np.flatnonzero(is_stop[event])
+            stop_index = np.full(len(is_stop), -1)
+            stop_index[stop_events] = np.arange(stop_events.size)
+            group = stop_index[event[stop_rows]]
+            medians = np.column_stack([self._group_median(points[stop_rows, 0], group, stop_events.size),
+                                       self._group_median(points[stop_rows, 1], group, stop_events.size)])
+            event_labels = self.cluster_locations(medians)
+            row_labels[stop_rows] = event_labels[group]
+        self.logger.info("Native stop engine: %d points, %d stop events, %d locations",
+                         len(points), stop_events.size, len(np.unique(row_labels[row_labels >= 0])))
+
+        labels = np.split(row_labels, np.cumsum(lengths)[:-1])
+        return labels[0] if single else labels
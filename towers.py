@@ -0,0 +1,71 @@
+# mobility_pipeline/towers.py
+import logging
+import numpy as np
+import pandas as pd
+
+
+class TowerIndex:
+    """
+    Tower dictionary: one row per cell_id. CDR rows refer to it through an
+    int32 code (the tower's position here) instead of carrying the network
+    columns and sector polygon themselves; attributes and geometries live in
+    arrays indexed by that code and are gathered only when a stage needs them.
+    Code -1 marks a cell_id that is not in the dictionary.
+    """
+    def __init__(self, towers: pd.DataFrame, geometry=None):
+        self.towers = towers.reset_index(drop=True)
+        self.index = pd.Index(self.towers["cell_id"].to_numpy())
+        if not self.index.is_unique:
+            raise ValueError("TowerIndex needs one row per cell_id")
+        # Sector polygon per tower (object array aligned with towers), set by with_sectors
+        self.geometry = None if geometry is None else np.asarray(geometry, dtype=object)
+        self.logger = logging.getLogger("MobilityPipeline.TowerIndex")
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns=None):
+        """
+        Dictionary from any frame with a cell_id column (the network table, or a
+        CDR frame already joined with it): first non-null value per tower of
+        `columns` (default: every column).
+        """
+        columns = [c for c in (columns if columns is not None else df.columns) if c != "cell_id"]
+        towers = df.groupby("cell_id", sort=False)[columns].first().reset_index()
+        return cls(towers)
+
+    @classmethod
+    def from_sectors(cls, sectors_gdf):
+        """Dictionary of a sector table (cell_id, geometry), geometries attached."""
+        return cls(pd.DataFrame({"cell_id": sectors_gdf["cell_id"].to_numpy()}), sectors_gdf.geometry.values)
+
+    def __len__(self):
+        return len(self.index)
+
+    def encode(self, cell_ids) -> np.ndarray:
+        """int32 tower code per value; -1 where the cell_id is unknown."""
+        codes = self.index.get_indexer(np.asarray(cell_ids))
+        missing = int((codes < 0).sum())
+        if missing:
+            self.logger.warning("%d rows refer to cell_ids missing from the tower index", missing)
+        return codes.astype(np.int32)
+
+    def with_sectors(self, sectors_gdf):
+        """Attach sector polygons (cell_id, geometry) in tower order; missing towers get None."""
+        lookup = pd.Series(sectors_gdf.geometry.values, index=sectors_gdf["cell_id"].to_numpy())
+        self.geometry = lookup.reindex(self.index).to_numpy(dtype=object)
+        return self
+
+    def gather(self, column: str, codes) -> np.ndarray:
+        """Per-row values of a tower attribute (or "geometry"); NaN / None for code -1."""
+        values = self.geometry if column == "geometry" else self.towers[column].to_numpy()
+        if values is None:
+            raise ValueError("No sector geometries attached; call with_sectors first")
+        # The appended missing value is what code -1 picks up
+        missing = None if values.dtype == object else np.nan
+        return np.append(values, missing)[np.asarray(codes)]
+
+    def attach(self, df: pd.DataFrame, columns, codes_col: str = "tower") -> pd.DataFrame:
+        """Copy of df with tower attributes gathered onto its rows (for outputs that want them wide)."""
+        out = df.copy(deep=False)
+        for col in columns:
+            out[col] = self.gather(col, out[codes_col].to_numpy())
+        return out
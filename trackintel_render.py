@@ -1,78 +1,127 @@
 # mobility_pipeline/trackintel_bridge.py
+import logging
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import trackintel as ti
 
+
+def _triplegs_batch(tz: str, pfs: gpd.GeoDataFrame, sps: gpd.GeoDataFrame):
+    """Process-pool worker: triplegs of one user batch (local dense IDs from 0)."""
+    return TrackintelBridge(tz=tz)._pfs_triplegs_single(pfs, sps)
+
+
+def _trips_batch(tz: str, tpls: gpd.GeoDataFrame, sps: gpd.GeoDataFrame):
+    """Process-pool worker: trips of one user batch (local trip IDs from 0)."""
+    return TrackintelBridge(tz=tz)._pfs_trips_single(tpls, sps)
+
+
 class TrackintelBridge:
-    def __init__(self, tz="Europe/Lisbon"):
+    # Peak memory of a trackintel call as a multiple of its input frames, used to size batches.
+    # tracemalloc measured ~1.2x for generate_triplegs and ~7x for generate_trips (per-trip lists);
+    # rounded up (+0.8x / +1x) since the per-row byte estimate in user_batches is itself approximate
+    TRIPLEG_MEMORY_FACTOR = 2
+    TRIP_MEMORY_FACTOR = 8
+
+    def __init__(self, tz="Europe/Lisbon", n_workers: int = 1, memory_budget_mb: float = None):
         self.tz = tz
+        # Chunked mode: users are split into batches that fit memory_budget_mb (per worker) and
+        # run through trackintel in n_workers processes; off when neither is set
+        self.n_workers = n_workers
+        self.memory_budget_mb = memory_budget_mb
+        self.logger = logging.getLogger("MobilityPipeline.TrackintelBridge")
 
-    def to_positionfixes(self, df: pd.DataFrame) -> gpd.GeoDataFrame:
+    def to_positionfixes(self, df: pd.DataFrame, tracked_at: str = "timestamp") -> gpd.GeoDataFrame:
         """
         Build a GeoDataFrame and then TI positionfixes from your processed CDR.
-        Expects: ['user_id','timestamp','est_lon','est_lat','stop_id', ...]
+        Expects: ['user_id', tracked_at,'est_lon','est_lat','stop_id', ...]
+        A categorical user column (CDRSchema.compact) is decoded to plain values here.
         """
+        if isinstance(df["unique_id"].dtype, pd.CategoricalDtype):
+            df = df.assign(unique_id=df["unique_id"].to_numpy())
         gdf = gpd.GeoDataFrame(
             df,
             geometry=gpd.points_from_xy(df["est_lon"], df["est_lat"]),
             crs="EPSG:4326"
         )
         pfs = ti.io.read_positionfixes_gpd(
-            gdf, user_id='unique_id', tracked_at='timestamp', geom_col='geometry', tz=self.tz
+            gdf, user_id='unique_id', tracked_at=tracked_at, geom_col='geometry', tz=self.tz
         )
         return pfs
 
 
-    def build_staypoints_from_pfs(self, pfs: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    @staticmethod
+    def _ns(values) -> np.ndarray:
+        """int64 nanoseconds (UTC) of a datetime-like Series/array, tz-aware or not."""
+        return pd.DatetimeIndex(values).as_unit("ns").asi8
+
+    def build_staypoints_from_pfs(self, pfs: gpd.GeoDataFrame, id_offset: int = 0,
+                                  geometry: str = "first") -> gpd.GeoDataFrame:
         """
         Build staypoints from (user_id, stop_id, tracked_at) with day resets.
         - Consecutive rows with same (user_id, day, stop_id) belong to one staypoint.
         - Rows with stop_id == -1 are ignored (staypoint_id = NA).
-        - Returns a GeoDataFrame with user_id, staypoint_id, started_at, finished_at, stop_id, geometry.
+        - IDs start at id_offset + 1, so successive runs can keep them unique.
+        - geometry="first" takes the first fix of the stay, "centroid" the mean of its fixes.
+        - Returns (pfs sorted by user/day/time with day + staypoint_id, staypoints GeoDataFrame
+          with user_id, staypoint_id, started_at, finished_at, stop_id, geometry).
         - Index is set to staypoint_id (kept also as a column).
+        Runs on sorted arrays: run-length boundaries + reduceat, no groupby.
         """
-        df = pfs.copy()
         # Day boundary (if you need Lisbon-local days, replace with:
         # df["day"] = df["tracked_at"].dt.tz_convert("Europe/Lisbon").dt.normalize()
-        df["day"] = df["tracked_at"].dt.normalize()
+        day = pfs["tracked_at"].dt.normalize()
 
-        # Work on a sorted copy; keep original index for alignment
-        g = df.sort_values(["user_id", "day", "tracked_at"]).copy()
+        user_codes, _ = pd.factorize(pfs["user_id"], sort=True)
+        t_ns = self._ns(pfs["tracked_at"])
+        day_ns = self._ns(day)
+        order = np.lexsort((t_ns, day_ns, user_codes))
 
-        valid = g["stop_id"].ne(-1)
-        starts = (
-            g["user_id"].ne(g["user_id"].shift()) |   # new user
-            g["day"].ne(g["day"].shift()) |           # new day
-            g["stop_id"].ne(g["stop_id"].shift())     # stop changed
-        )
+        u = user_codes[order]
+        d = day_ns[order]
+        stop = pfs["stop_id"].to_numpy()[order]
+
+        valid = stop != -1
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = (u[1:] != u[:-1]) | (d[1:] != d[:-1]) | (stop[1:] != stop[:-1])
 
         # Global ID that increments only on valid starts; -1 rows -> NA
-        g["staypoint_id"] = (starts & valid).cumsum()
-        g.loc[~valid, "staypoint_id"] = np.nan
-        g["staypoint_id"] = g["staypoint_id"].astype("Int64")
-
-        # Map IDs back to original row order without shifting anything
-        df["staypoint_id"] = g.sort_index()["staypoint_id"]
-
-        # Aggregate stays (ignore NA)
-        staypoints = (
-            df.dropna(subset=["staypoint_id"])
-            .groupby(["user_id", "staypoint_id"], as_index=False)
-            .agg(
-                started_at=("tracked_at", "min"),
-                finished_at=("tracked_at", "max"),
-                stop_id=("stop_id", "first"),
-                geometry=("geometry", "first")  # or compute centroid if preferred
-            )
-            .sort_values(["user_id", "started_at"])
-        )
+        sp_ids = np.cumsum(starts & valid) + id_offset
+        g = pfs.iloc[order]  # iloc with an array already returns a new frame
+        g["day"] = day.iloc[order].array
+        g["staypoint_id"] = pd.array(np.where(valid, sp_ids, 0), dtype="Int64")
+        g.loc[~valid, "staypoint_id"] = pd.NA
+
+        # Each staypoint is a contiguous run among the valid sorted rows
+        rows = order[valid]
+        seg = np.flatnonzero(starts[valid])
+        last = np.r_[seg[1:], len(rows)][:len(seg)] - 1  # [:len(seg)]: no stays at all -> empty
+
+        tracked = pfs["tracked_at"].iloc[rows]
+        if geometry == "centroid":
+            xs = pfs.geometry.x.to_numpy()[rows]
+            ys = pfs.geometry.y.to_numpy()[rows]
+            counts = np.diff(np.r_[seg, len(rows)])
+            geoms = gpd.points_from_xy(np.add.reduceat(xs, seg) / counts, np.add.reduceat(ys, seg) / counts)
+        elif geometry == "first":
+            geoms = pfs.geometry.to_numpy()[rows[seg]]
+        else:
+            raise ValueError(f"geometry must be 'first' or 'centroid', got {geometry!r}")
+
+        staypoints = gpd.GeoDataFrame({
+            "user_id": pfs["user_id"].to_numpy()[rows[seg]],
+            "staypoint_id": pd.array(sp_ids[valid][seg], dtype="Int64"),
+            "started_at": tracked.iloc[seg].array,
+            "finished_at": tracked.iloc[last].array,
+            "stop_id": stop[valid][seg],
+            "geometry": geoms,
+        })
 
         # Optional: duration
         #staypoints["duration"] = staypoints["finished_at"] - staypoints["started_at"]
 
-        # GeoDataFrame with same CRS as input
-        #staypoints = gpd.GeoDataFrame(staypoints, geometry="geometry", crs=pfs.crs)
         staypoints = ti.io.read_staypoints_gpd(staypoints, started_at = 'started_at', finished_at ='finished_at', geom_col = 'geometry', crs="EPSG:4326", tz='Europe/Lisbon')
 
         # Set index to staypoint_id but keep the column
@@ -83,50 +132,225 @@ class TrackintelBridge:
 
     def assign_staypoint_ids_to_pfs(self, pfs: gpd.GeoDataFrame, sps: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         """
-        Forward-fill candidate staypoint IDs, then keep only within [started_at, finished_at].
-        Requires that you already added a 'sp_cand' to pfs (candidate mapping).
-        If you don't have it, derive a candidate by joining on proximity in time & same stop_id.
-        """
-        # Minimal robust mapping: use (user_id, stop_id, event_date)
-        tmp = sps[['user_id','stop_id','started_at','staypoint_id','finished_at']].copy()
-        #tmp['event_date'] = pd.to_datetime(tmp['event_date'])
-
-        p = pfs.copy()
-        #p['event_date'] = p['tracked_at'].dt.normalize()
-        p = p.sort_values(["user_id","tracked_at"], kind="mergesort").reset_index(drop=True)
-        p = p.merge(tmp[["user_id","started_at","staypoint_id", "geometry"]],
-                    left_on = ["user_id","tracked_at"],
-                    right_on= ["user_id","started_at"],
-                    how="left"
-                    ).rename(columns={"staypoint_id":"sp_start"}).drop(columns=["started_at"])
-        
-        # 2) Forward-fill the last seen start within each user → candidate stay id
-        p["sp_cand"] = p.groupby("user_id")["sp_start"].ffill()
-
-        # 3) LEFT JOIN bring finished_at for that candidate id
-        p = p.merge(
-            tmp[["staypoint_id","finished_at"]].rename(columns={"staypoint_id":"sp_cand"}),
-            on="sp_cand",
-            how="left"
-        )
+        Give each fix the staypoint whose [started_at, finished_at] contains it.
+        Fixes and staypoint starts are walked in one sorted (user, time) sequence:
+        a fix's candidate is the latest staypoint of its user starting at or
+        before it, kept only if the fix is not past that staypoint's finished_at.
+        Returns pfs sorted by (user_id, tracked_at) with a staypoint_id column.
+        """
+        p = pfs.sort_values(["user_id","tracked_at"], kind="mergesort").reset_index(drop=True)
+
+        codes, _ = pd.factorize(np.concatenate([p["user_id"].to_numpy(), sps["user_id"].to_numpy()]), sort=True)
+        fix_user, sp_user = codes[:len(p)], codes[len(p):]
+        fix_t = self._ns(p["tracked_at"])
+        sp_start = self._ns(sps["started_at"])
+        sp_end = self._ns(sps["finished_at"])
+        sp_id = sps["staypoint_id"].to_numpy()
 
-        # 4) Keep ID only inside the interval [started_at, finished_at]
-        # (started_at already implied by ffill from step 1)
-        p["staypoint_id"] = p["sp_cand"].where(p["tracked_at"] <= p["finished_at"]).astype("Int64")
+        sp_order = np.lexsort((sp_start, sp_user))
+        sp_user, sp_start, sp_end, sp_id = sp_user[sp_order], sp_start[sp_order], sp_end[sp_order], sp_id[sp_order]
 
-        # 5) cleanup
-        p = p.drop(columns=["sp_start","sp_cand","finished_at"])
+        # Merged event sequence ordered by (user, time, starts-before-fixes)
+        n_sp = len(sp_start)
+        kind = np.r_[np.zeros(n_sp, dtype=np.int8), np.ones(len(p), dtype=np.int8)]
+        seq = np.lexsort((kind, np.r_[sp_start, fix_t], np.r_[sp_user, fix_user]))
+        starts_seen = np.cumsum(kind[seq] == 0)
+        is_fix = kind[seq] == 1
+        fix_pos = seq[is_fix] - n_sp  # fixes come out in (user, time) order = row order of p
+        cand = np.empty(len(p), dtype=np.int64)
+        cand[fix_pos] = starts_seen[is_fix] - 1
+
+        ok = cand >= 0
+        safe = np.where(ok, cand, 0)
+        if n_sp:
+            ok &= (sp_user[safe] == fix_user) & (fix_t <= sp_end[safe])
+        else:
+            ok[:] = False
+
+        p["staypoint_id"] = pd.array(np.where(ok, sp_id[safe] if n_sp else 0, 0), dtype="Int64")
+        p.loc[~ok, "staypoint_id"] = pd.NA
 
         return p
 
+    # ---------- chunked driver ----------
+    @property
+    def chunked(self) -> bool:
+        return self.n_workers > 1 or self.memory_budget_mb is not None
+
+    def user_batches(self, frames, memory_budget_mb: float = None, factor: float = TRIPLEG_MEMORY_FACTOR):
+        """
+        Consecutive (sorted) user groups whose rows in frames (a list of
+        tables with a user_id column) fit the per-worker memory budget, at
+        factor times their in-memory size. One user never spans two
+        batches; a single user above the budget gets a batch of their own.
+        Without a budget, users are split evenly over the workers.
+        """
+        codes = [pd.Index(f["user_id"].to_numpy()) for f in frames]
+        users = np.unique(np.concatenate([c.to_numpy() for c in codes])) if codes else np.array([])
+        if len(users) == 0:
+            return []
+        # Approximate bytes per user: rows per user x average bytes per row of each frame
+        # (shapely geometries counted at ~100 bytes each)
+        user_bytes = np.zeros(len(users))
+        for f, c in zip(frames, codes):
+            if len(f) == 0:
+                continue
+            row_bytes = f.memory_usage(index=True, deep=False).sum() / len(f) + 100
+            user_bytes += np.bincount(np.searchsorted(users, c.to_numpy()), minlength=len(users)) * row_bytes
+
+        budget_mb = memory_budget_mb if memory_budget_mb is not None else self.memory_budget_mb
+        if budget_mb is None:
+            per_batch = user_bytes.sum() / max(self.n_workers, 1)
+        else:
+            per_batch = budget_mb * 1e6 / factor
+        # Batch boundaries where the running total crosses multiples of per_batch
+        batch = np.floor((np.cumsum(user_bytes) - user_bytes) / max(per_batch, 1.0)).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, batch[1:] != batch[:-1]])
+        return np.split(users, starts[1:])
+
+    @staticmethod
+    def _by_users(frame, users):
+        return frame[frame["user_id"].isin(users)]
+
+    def _map_batches(self, fn, batches):
+        """Run fn(tz, *args) over the batch argument tuples, in worker processes if n_workers > 1."""
+        if self.n_workers > 1 and len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+                return list(pool.map(fn, [self.tz] * len(batches), *zip(*batches)))
+        return [fn(self.tz, *args) for args in batches]
+
+    def pfs_triplegs_chunked(self, pfs_with_sp: gpd.GeoDataFrame, sps: gpd.GeoDataFrame, memory_budget_mb=None):
+        """
+        pfs_triplegs over user batches (user_batches), stitched back together:
+        tripleg IDs are offset per batch, so they stay dense and in user order,
+        the same IDs a single pfs_triplegs call gives.
+        """
+        batches = self.user_batches([pfs_with_sp, sps], memory_budget_mb)
+        self.logger.info("Triplegs: %d users in %d batches, %d workers", sum(map(len, batches)), len(batches),
+                         self.n_workers)
+        results = self._map_batches(_triplegs_batch, [(self._by_users(pfs_with_sp, users), self._by_users(sps, users))
+                                                      for users in batches])
+        pfs_parts, tpls_parts, offset = [], [], 0
+        for pfs, tpls in results:
+            self.shift_ids(pfs=pfs, tpls=tpls, tripleg_offset=offset)
+            offset += len(tpls)
+            pfs_parts.append(pfs)
+            tpls_parts.append(tpls)
+        if not results:
+            return self._pfs_triplegs_single(pfs_with_sp, sps)
+        pfs = pd.concat(pfs_parts)
+        tpls = pd.concat(tpls_parts)
+        return pfs, (ti.Triplegs(tpls) if len(tpls) else tpls)
+
+    def pfs_trips_chunked(self, tpls: gpd.GeoDataFrame, sps: gpd.GeoDataFrame, memory_budget_mb=None):
+        """pfs_trips over user batches; trip IDs (and the trip keys of triplegs / staypoints) offset per batch."""
+        batches = self.user_batches([tpls, sps], memory_budget_mb, factor=self.TRIP_MEMORY_FACTOR)
+        self.logger.info("Trips: %d users in %d batches, %d workers", sum(map(len, batches)), len(batches),
+                         self.n_workers)
+        results = self._map_batches(_trips_batch, [(self._by_users(tpls, users), self._by_users(sps, users))
+                                                   for users in batches])
+        if not results:
+            return self._pfs_trips_single(tpls, sps)
+        parts, offset = [], 0
+        for staypoints, triplegs, trips in results:
+            self.shift_ids(sps=staypoints, tpls=triplegs, trips=trips, trip_offset=offset)
+            offset += len(trips)
+            parts.append((staypoints, triplegs, trips))
+        staypoints, triplegs, trips = (pd.concat([p[i] for p in parts if len(p[i])] or [parts[0][i]])
+                                       for i in range(3))
+        return staypoints, triplegs, trips
+
+    # ---------- triplegs / trips ----------
+    @staticmethod
+    def _empty_triplegs(pfs: gpd.GeoDataFrame):
+        """generate_triplegs output for fixes that all belong to staypoints (trackintel fails on those)."""
+        pfs = pfs.sort_values(["user_id", "tracked_at"])
+        pfs["tripleg_id"] = pd.array([pd.NA] * len(pfs), dtype="Int64")
+        tpls = gpd.GeoDataFrame({"user_id": pfs["user_id"].iloc[:0].to_numpy(),
+                                 "started_at": pfs["tracked_at"].iloc[:0].array,
+                                 "finished_at": pfs["tracked_at"].iloc[:0].array},
+                                geometry=gpd.GeoSeries([], crs=pfs.crs), crs=pfs.crs).rename_geometry("geom")
+        tpls.index = pd.Index([], dtype="int64", name="id")
+        return pfs, tpls
+
+    @staticmethod
+    def _clear_user_overlaps(pfs: gpd.GeoDataFrame, tpls: gpd.GeoDataFrame, sps: gpd.GeoDataFrame):
+        """
+        overlap_staypoints gives a user's last staypoint fix the first tripleg of
+        the next user in the table (its "next tripleg" is looked up without
+        checking the user). Undo that: clear those tripleg_ids, rebuild the
+        affected geometries from their own fixes and drop the ones that are no
+        longer valid, as trackintel does. Results then no longer depend on
+        which users share a call.
+        """
+        has = pfs["tripleg_id"].notna().to_numpy()
+        if not has.any() or tpls.empty:
+            return pfs, tpls
+        tid = pfs["tripleg_id"].to_numpy(dtype="float64", na_value=np.nan)
+        tpl_user = pd.Series(tpls["user_id"].to_numpy(), index=tpls.index)
+        owner = tpl_user.reindex(tid[has].astype(np.int64)).to_numpy()
+        leaked = np.flatnonzero(has)[owner != pfs["user_id"].to_numpy()[has]]
+        if leaked.size == 0:
+            return pfs, tpls
+
+        affected = np.unique(tid[leaked].astype(np.int64))
+        pfs.iloc[leaked, pfs.columns.get_loc("tripleg_id")] = pd.NA
+        sub = pfs[pfs["tripleg_id"].isin(affected)].sort_values("tracked_at", kind="stable")
+        # Staypoint fixes take the staypoint geometry, as in trackintel
+        geoms = sub.geometry.to_numpy().copy()
+        on_sp = sub["staypoint_id"].notna().to_numpy()
+        if on_sp.any():
+            geoms[on_sp] = sps.geometry.reindex(sub["staypoint_id"].to_numpy()[on_sp].astype(np.int64)).to_numpy()
+        tpl_of_row = sub["tripleg_id"].to_numpy(dtype=np.int64)
+        order = np.argsort(tpl_of_row, kind="stable")
+        tpl_sorted, coords = tpl_of_row[order], shapely.get_coordinates(geoms[order])
+        ids, counts = np.unique(tpl_sorted, return_counts=True)
+        lines = np.full(len(affected), None, dtype=object)
+        enough = counts >= 2
+        if enough.any():
+            keep = np.isin(tpl_sorted, ids[enough])
+            lines[np.searchsorted(affected, ids[enough])] = shapely.linestrings(
+                coords[keep], indices=np.searchsorted(ids[enough], tpl_sorted[keep]))
+        valid = np.array([g is not None and g.is_valid for g in lines], dtype=bool)
+        tpls.loc[affected[valid], tpls.geometry.name] = lines[valid]
+        invalid = affected[~valid]
+        if invalid.size:
+            pfs.loc[pfs["tripleg_id"].isin(invalid), "tripleg_id"] = pd.NA
+            tpls = tpls.drop(index=invalid)
+        return pfs, tpls
+
+    @staticmethod
+    def _dense_tripleg_ids(pfs: gpd.GeoDataFrame, tpls: gpd.GeoDataFrame):
+        """Renumber triplegs 0..n-1 (trackintel leaves gaps where it dropped invalid ones)."""
+        if len(tpls) and not np.array_equal(tpls.index.to_numpy(), np.arange(len(tpls))):
+            mapping = pd.Series(np.arange(len(tpls)), index=tpls.index.to_numpy())
+            tid = pfs["tripleg_id"]
+            pfs["tripleg_id"] = pd.array(mapping.reindex(tid.to_numpy(dtype="float64", na_value=np.nan)).to_numpy(),
+                                         dtype="Int64")
+            tpls.index = pd.Index(np.arange(len(tpls), dtype=np.int64), name=tpls.index.name)
+        return pfs, tpls
+
     def pfs_triplegs(self, pfs_with_sp: gpd.GeoDataFrame, sps: gpd.GeoDataFrame):
         """
         Use trackintel to derive triplegs and trips from positionfixes+staypoints.
         Exact function names depend on TI version; the idea is:
          - segment into triplegs between staypoints
          - aggregate triplegs into trips
+        Tripleg IDs are dense (0..n-1, in user / time order) and no tripleg
+        reaches into another user's fixes. In chunked mode (n_workers > 1 or a
+        memory budget) the users are processed in batches, see pfs_triplegs_chunked.
         """
+        if self.chunked:
+            return self.pfs_triplegs_chunked(pfs_with_sp, sps)
+        return self._pfs_triplegs_single(pfs_with_sp, sps)
+
+    def _pfs_triplegs_single(self, pfs_with_sp: gpd.GeoDataFrame, sps: gpd.GeoDataFrame):
+        """pfs_triplegs in one trackintel call, whatever the chunked settings."""
+        if pfs_with_sp["staypoint_id"].notna().all():
+            return self._empty_triplegs(pfs_with_sp)
         pfs, tpls = ti.preprocessing.generate_triplegs(pfs_with_sp, sps, 'overlap_staypoints',gap_threshold=30)
+        pfs, tpls = self._clear_user_overlaps(pfs, tpls, sps)
+        pfs, tpls = self._dense_tripleg_ids(pfs, tpls)
 
         return pfs, tpls 
     
@@ -137,6 +361,60 @@ class TrackintelBridge:
          - segment into triplegs between staypoints
          - aggregate triplegs into trips
         """
-        staypoints, triplegs, trips = ti.preprocessing.generate_trips(tpls, sps)
+        if self.chunked:
+            return self.pfs_trips_chunked(tpls, sps)
+        return self._pfs_trips_single(tpls, sps)
+
+    def _pfs_trips_single(self, tpls: gpd.GeoDataFrame, sps: gpd.GeoDataFrame):
+        """pfs_trips in one trackintel call, whatever the chunked settings."""
+        if "is_activity" not in sps.columns:
+            # InfoStop stops already satisfy min_staying_time, so every staypoint is an activity
+            sps = sps.copy()
+            sps["is_activity"] = True
+        if tpls.empty:
+            # generate_trips refuses empty triplegs (e.g. a partition of users that never moved)
+            staypoints = sps.copy()
+            for col in ("trip_id", "prev_trip_id", "next_trip_id"):
+                staypoints[col] = pd.array([pd.NA] * len(staypoints), dtype="Int64")
+            triplegs = tpls.copy()
+            triplegs["trip_id"] = pd.array([pd.NA] * len(triplegs), dtype="Int64")
+            trips = gpd.GeoDataFrame(columns=["user_id", "started_at", "finished_at", "origin_staypoint_id",
+                                              "destination_staypoint_id", "geom"], geometry="geom", crs=sps.crs)
+            trips.index.name = "trip_id"
+            return staypoints, triplegs, trips
+        staypoints, triplegs, trips = ti.preprocessing.generate_trips(sps, tpls)
 
         return staypoints, triplegs, trips
+
+    @staticmethod
+    def shift_ids(pfs=None, sps=None, tpls=None, trips=None, tripleg_offset: int = 0, trip_offset: int = 0,
+                  staypoint_offset: int = 0):
+        """
+        Offset tripleg, trip and (optionally) staypoint IDs (index and foreign keys)
+        in place, so outputs of separate trackintel calls can be concatenated
+        without collisions.
+        """
+        if staypoint_offset:
+            if pfs is not None and "staypoint_id" in pfs.columns:
+                pfs["staypoint_id"] = pfs["staypoint_id"] + staypoint_offset
+            if sps is not None:
+                sps.index = sps.index + staypoint_offset
+                if "staypoint_id" in sps.columns:
+                    sps["staypoint_id"] = sps["staypoint_id"] + staypoint_offset
+            if trips is not None:
+                for col in ("origin_staypoint_id", "destination_staypoint_id"):
+                    if col in trips.columns:
+                        trips[col] = trips[col] + staypoint_offset
+        if tpls is not None:
+            tpls.index = tpls.index + tripleg_offset
+            if "trip_id" in tpls.columns:
+                tpls["trip_id"] = tpls["trip_id"] + trip_offset
+        if pfs is not None and "tripleg_id" in pfs.columns:
+            pfs["tripleg_id"] = pfs["tripleg_id"] + tripleg_offset
+        if trips is not None:
+            trips.index = trips.index + trip_offset
+        if sps is not None:
+            for col in ("trip_id", "prev_trip_id", "next_trip_id"):
+                if col in sps.columns:
+                    sps[col] = sps[col] + trip_offset
+        return pfs, sps, tpls, trips
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import geopandas as gpd
+import shapely
 from shapely.geometry import Point
 
 class GeometryUtils:
@@ -30,6 +31,78 @@ class GeometryUtils:
             az_max += 360
         return az_min, az_max
 
+    @staticmethod
+    def adjust_azimuth_for_omni_array(azimuth_min_telco, azimuth_max_telco):
+        """Array version of adjust_azimuth_for_omni; returns (az_min, az_max) float arrays."""
+        az_min_telco = pd.to_numeric(pd.Series(azimuth_min_telco), errors="coerce").fillna(0).to_numpy(dtype=float)
+        az_max_telco = pd.to_numeric(pd.Series(azimuth_max_telco), errors="coerce").fillna(0).to_numpy(dtype=float)
+
+        omni = (az_min_telco == 0) & (az_max_telco == 0)
+        az_min = GeometryUtils.telco_to_math_angle(az_min_telco)
+        az_max = GeometryUtils.telco_to_math_angle(az_max_telco)
+        az_max = np.where(az_max < az_min, az_max + 360, az_max)
+
+        az_min = np.where(omni, 0.0, az_min)
+        az_max = np.where(omni, 360.0, az_max)
+        return az_min, az_max
+
+    @staticmethod
+    def arc_num_points(az_min, az_max, radius_m, num_points=60, tolerance=None):
+        """
+        Number of arc vertices per sector. With a tolerance (metres), the arc is
+        sampled so that no chord deviates from the true arc by more than it.
+        """
+        span = np.deg2rad(np.asarray(az_max, dtype=float) - np.asarray(az_min, dtype=float))
+        if tolerance is None:
+            return np.full(span.shape, int(num_points), dtype=np.int64)
+
+        radius_m = np.asarray(radius_m, dtype=float)
+        # Max angular step whose sagitta r * (1 - cos(step / 2)) stays within tolerance
+        ratio = np.clip(1 - tolerance / np.where(radius_m > 0, radius_m, np.inf), -1, 1)
+        step = 2 * np.arccos(ratio)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            n = np.ceil(np.abs(span) / step) + 1
+        n = np.where(np.isfinite(n), n, 2)
+        return np.maximum(n, 2).astype(np.int64)
+
+    @staticmethod
+    def make_sectors_projected(x, y, az_min, az_max, radius_m, num_points=60, tolerance=None):
+        """
+        Vectorized make_sector_projected: builds all sector polygons in one call.
+        Inputs are equal-length arrays in a metric CRS; returns an object array of
+        geometries (convex hull of tower point + arc), identical to the scalar version.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        az_min = np.asarray(az_min, dtype=float)
+        az_max = np.asarray(az_max, dtype=float)
+        radius_m = np.asarray(radius_m, dtype=float)
+        if x.size == 0:
+            return np.empty(0, dtype=object)
+
+        counts = GeometryUtils.arc_num_points(az_min, az_max, radius_m, num_points, tolerance)
+
+        # Flat ragged layout: per sector, the tower point followed by its arc points
+        sizes = counts + 1
+        owner = np.repeat(np.arange(x.size), sizes)
+        offsets = np.cumsum(sizes) - sizes
+        pos = np.arange(owner.size) - offsets[owner]  # 0 = tower point, 1..n = arc
+
+        # Same arithmetic as np.linspace so vertices match the scalar builder bit for bit
+        arc_idx = pos - 1
+        n = counts[owner]
+        start = np.deg2rad(az_min)[owner]
+        stop = np.deg2rad(az_max)[owner]
+        step = (stop - start) / np.maximum(n - 1, 1)
+        angles = arc_idx * step + start
+        angles = np.where((arc_idx == n - 1) & (n > 1), stop, angles)
+
+        px = np.where(pos == 0, x[owner], x[owner] + radius_m[owner] * np.cos(angles))
+        py = np.where(pos == 0, y[owner], y[owner] + radius_m[owner] * np.sin(angles))
+
+        points = shapely.multipoints(np.column_stack([px, py]), indices=owner)
+        return shapely.convex_hull(points)
+
     @staticmethod
     def make_sector_projected(x, y, az_min, az_max, radius_m, num_points=60):
         angles = np.linspace(np.deg2rad(az_min), np.deg2rad(az_max), num_points)
@@ -37,24 +110,144 @@ class GeometryUtils:
         points = gpd.GeoSeries([Point(x, y)] + [Point(px, py) for px, py in arc_points])
         return points.union_all().convex_hull
 
+    @staticmethod
+    def stable_seed(user_ids, cell_ids):
+        """
+        Per-(user, cell) uint64 seeds that are identical across processes and runs
+        (unlike Python's salted hash()). Note that 5 and "5" hash differently.
+        """
+        keys = pd.DataFrame({"user": pd.Series(user_ids).reset_index(drop=True),
+                             "cell": pd.Series(cell_ids).reset_index(drop=True)})
+        return pd.util.hash_pandas_object(keys, index=False).to_numpy(dtype=np.uint64)
+
+    @staticmethod
+    def _uniform_from_counter(seed, counter):
+        """Counter-based uniform [0, 1) draws (splitmix64), vectorized over uint64 arrays."""
+        z = seed + (counter.astype(np.uint64) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+        return (z >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+    @staticmethod
+    def points_in_polygons(seeds, polygons, max_tries=50, tries_per_round=8):
+        """
+        Batched deterministic rejection sampling: one point per (seed, polygon) pair.
+        Candidates are drawn a few rounds at a time, tested with shapely.contains_xy
+        against prepared polygons, and unresolved pairs fall back to the centroid.
+        Returns (x, y) float arrays; NaN where the polygon is missing or empty.
+        """
+        seeds = np.asarray(seeds, dtype=np.uint64)
+        polygons = np.asarray(polygons, dtype=object)
+        n = len(polygons)
+        px = np.full(n, np.nan)
+        py = np.full(n, np.nan)
+
+        valid = ~(shapely.is_missing(polygons) | shapely.is_empty(polygons))
+        if not valid.any():
+            return px, py
+        shapely.prepare(polygons[valid])
+        bounds = shapely.bounds(polygons)
+
+        pending = np.flatnonzero(valid)
+        tried = 0
+        while pending.size and tried < max_tries:
+            k = min(tries_per_round, max_tries - tried)
+            owner = np.repeat(pending, k)
+            attempt = np.tile(np.arange(tried, tried + k, dtype=np.uint64), pending.size)
+
+            # Two independent streams per attempt: even counters for x, odd for y
+            ux = GeometryUtils._uniform_from_counter(seeds[owner], 2 * attempt)
+            uy = GeometryUtils._uniform_from_counter(seeds[owner], 2 * attempt + np.uint64(1))
+            minx, miny, maxx, maxy = bounds[owner].T
+            cx = minx + ux * (maxx - minx)
+            cy = miny + uy * (maxy - miny)
+
+            hit = shapely.contains_xy(polygons[owner], cx, cy).reshape(pending.size, k)
+            found = hit.any(axis=1)
+            first = hit.argmax(axis=1)
+            pick = np.arange(pending.size) * k + first
+
+            done = pending[found]
+            px[done] = cx[pick[found]]
+            py[done] = cy[pick[found]]
+
+            pending = pending[~found]
+            tried += k
+
+        if pending.size:
+            centroids = shapely.centroid(polygons[pending])
+            px[pending] = shapely.get_x(centroids)
+            py[pending] = shapely.get_y(centroids)
+        return px, py
+
     @staticmethod
     def deterministic_point_in_polygon(user_id, cell_id, polygon):
-        if polygon.is_empty:
+        if polygon is None or polygon.is_empty:
             return None
-        minx, miny, maxx, maxy = polygon.bounds
-        rng = np.random.default_rng(abs(hash((user_id, cell_id))) % (2**32))
-        for _ in range(50):
-            px = rng.uniform(minx, maxx)
-            py = rng.uniform(miny, maxy)
-            point = Point(px, py)
-            if polygon.contains(point):
-                return point
-        return polygon.centroid
-    
-    @staticmethod
-    def convert_to_unix_timestamp(df: pd.DataFrame, timestamp_col: str, output_col: str = "unix_timestamp") -> pd.DataFrame:
-        """Convert a datetime-like column to UNIX seconds."""
-        out = df.copy()
+        seed = GeometryUtils.stable_seed([user_id], [cell_id])
+        px, py = GeometryUtils.points_in_polygons(seed, [polygon])
+        return Point(px[0], py[0])
+
+    @staticmethod
+    def mask_water(geoms, water_geoms):
+        """
+        Subtract water from sector geometries using an STRtree over the water parts.
+        Only sectors whose envelope hits water are touched, and each one is clipped
+        against its local pieces only. Returns (geometries, report dict).
+        """
+        geoms = np.asarray(geoms, dtype=object).copy()
+        water_parts = shapely.get_parts(np.asarray(water_geoms, dtype=object))
+        water_parts = water_parts[~shapely.is_empty(water_parts)]
+        report = {"sectors": len(geoms), "water_parts": len(water_parts), "candidates": 0, "clipped": 0}
+        if len(geoms) == 0 or len(water_parts) == 0:
+            return geoms, report
+
+        tree = shapely.STRtree(water_parts)
+        sector_idx, water_idx = tree.query(geoms, predicate="intersects")
+        report["candidates"] = int(np.unique(sector_idx).size)
+        if sector_idx.size == 0:
+            return geoms, report
+
+        # Peel local water pieces off one rank at a time: rank k holds the k-th
+        # piece of every affected sector, so each pass is one vectorized difference
+        order = np.argsort(sector_idx, kind="stable")
+        sector_idx, water_idx = sector_idx[order], water_idx[order]
+        starts = np.flatnonzero(np.r_[True, sector_idx[1:] != sector_idx[:-1]])
+        rank = np.arange(sector_idx.size) - np.repeat(starts, np.diff(np.r_[starts, sector_idx.size]))
+
+        clipped = geoms.copy()
+        for k in range(rank.max() + 1):
+            at_k = rank == k
+            s_k = sector_idx[at_k]
+            clipped[s_k] = shapely.difference(clipped[s_k], water_parts[water_idx[at_k]])
+
+        touched = np.unique(sector_idx)
+        report["clipped"] = int((~shapely.equals(clipped[touched], geoms[touched])).sum())
+        geoms[touched] = clipped[touched]
+        return geoms, report
+
+    @staticmethod
+    def largest_polygon_part(geoms):
+        """Replace each MultiPolygon by its largest-area part (vectorized)."""
+        geoms = np.asarray(geoms, dtype=object).copy()
+        multi = np.flatnonzero(shapely.get_type_id(geoms) == shapely.GeometryType.MULTIPOLYGON)
+        if multi.size == 0:
+            return geoms
+
+        parts, owner = shapely.get_parts(geoms[multi], return_index=True)
+        # Sort by owner, then by descending area; first row per owner is the largest
+        order = np.lexsort((-shapely.area(parts), owner))
+        owner, parts = owner[order], parts[order]
+        first = np.r_[True, owner[1:] != owner[:-1]]
+        geoms[multi[owner[first]]] = parts[first]
+        return geoms
+
+    @staticmethod
+    def convert_to_unix_timestamp(df: pd.DataFrame, timestamp_col: str, output_col: str = "unix_timestamp",
+                                  inplace: bool = False) -> pd.DataFrame:
+        """Convert a datetime-like column to UNIX seconds (inplace=True writes into df instead of a copy)."""
+        out = df if inplace else df.copy()
         out[timestamp_col] = pd.to_datetime(out[timestamp_col])
         out[output_col] = (out[timestamp_col] - pd.Timestamp("1970-01-01")) // pd.Timedelta("1s")
 
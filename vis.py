@@ -1,47 +1,146 @@
+import logging
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import folium
+from folium.plugins import HeatMap
+from pyproj import Transformer
 
-def plot_user_locations(sp_filtered_freq, location_col='center', purpose_col='purpose', user_col='user_id'):
+logger = logging.getLogger("MobilityPipeline.Vis")
+
+PURPOSE_COLORS = {"home": "red", "work": "blue"}
+SQRT3 = np.sqrt(3.0)
+
+
+def _lon_lat(locations):
+    """lon / lat arrays of a column of shapely Points (GeoSeries or object column)."""
+    geoms = np.asarray(getattr(locations, "values", locations), dtype=object)
+    return shapely.get_x(geoms), shapely.get_y(geoms)
+
+
+def _bin_square(x, y, size):
+    """Integer (column, row) of the square cell of each point."""
+    return np.floor(x / size).astype(np.int64), np.floor(y / size).astype(np.int64)
+
+
+def _bin_hex(x, y, size):
+    """
+    Axial (q, r) of the pointy-top hexagon of each point; size is the width
+    across flats. Cube rounding, as in the usual hex-grid formulas.
     """
-    Plots user location points on a Folium map based on purpose and unique user count.
+    radius = size / SQRT3
+    qf = (SQRT3 / 3 * x - y / 3) / radius
+    rf = (2 / 3 * y) / radius
+    sf = -qf - rf
+    q, r, s = np.round(qf), np.round(rf), np.round(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q)
+    r = np.where(fix_r, -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+
+def _cell_polygons(i, j, size, grid):
+    """Cell polygons (projected) of the binned (i, j) cells, built in one shapely call."""
+    if grid == "hex":
+        radius = size / SQRT3
+        cx = radius * SQRT3 * (i + j / 2)
+        cy = radius * 1.5 * j
+        angles = np.radians(30 + 60 * np.arange(6))
+        dx, dy = radius * np.cos(angles), radius * np.sin(angles)
+    else:
+        cx, cy = (i + 0.5) * size, (j + 0.5) * size
+        dx, dy = np.array([-1, 1, 1, -1]) * size / 2, np.array([-1, -1, 1, 1]) * size / 2
+    rings = np.stack([cx[:, None] + dx, cy[:, None] + dy], axis=-1)
+    return shapely.polygons(rings), cx, cy
+
+
+def aggregate_user_locations(sp_filtered_freq, location_col='center', purpose_col='purpose', user_col='user_id',
+                             cell_size=500.0, grid="square", crs_proj="EPSG:3763", max_cells=5000):
+    """
+    Unique users per grid cell and purpose, as a GeoDataFrame (EPSG:4326) of
+    cell polygons with purpose, user_count and the cell centre (lon / lat).
+
+    Locations are binned onto square or hexagonal cells of cell_size metres
+    in crs_proj, all vectorized. Only the max_cells cells with the most users
+    are kept, so the output size does not grow with the number of users.
+    """
+    lon, lat = _lon_lat(sp_filtered_freq[location_col])
+    ok = np.isfinite(lon) & np.isfinite(lat)
+    to_proj = Transformer.from_crs("EPSG:4326", crs_proj, always_xy=True)
+    x, y = to_proj.transform(lon[ok], lat[ok])
+    i, j = (_bin_hex if grid == "hex" else _bin_square)(np.asarray(x), np.asarray(y), cell_size)
+
+    cells = pd.DataFrame({
+        "i": i, "j": j,
+        purpose_col: sp_filtered_freq[purpose_col].to_numpy()[ok],
+        "user": sp_filtered_freq[user_col].to_numpy()[ok],
+    })
+    counts = (cells.drop_duplicates().groupby(["i", "j", purpose_col], observed=True).size()
+              .rename("user_count").reset_index())
+    if len(counts) > max_cells:
+        logger.info("Map: keeping the %d busiest of %d cells", max_cells, len(counts))
+        counts = counts.nlargest(max_cells, "user_count", keep="first")
+
+    polygons, cx, cy = _cell_polygons(counts["i"].to_numpy(), counts["j"].to_numpy(), cell_size, grid)
+    to_wgs84 = Transformer.from_crs(crs_proj, "EPSG:4326", always_xy=True)
+    counts["lon"], counts["lat"] = to_wgs84.transform(cx, cy)
+    gdf = gpd.GeoDataFrame(counts.drop(columns=["i", "j"]), geometry=polygons, crs=crs_proj).to_crs("EPSG:4326")
+    # ~10 cm precision is plenty for a map and keeps the embedded GeoJSON small
+    gdf["geometry"] = shapely.set_precision(gdf.geometry.values, 1e-6)
+    return gdf
+
+
+def plot_user_locations(sp_filtered_freq, location_col='center', purpose_col='purpose', user_col='user_id',
+                        cell_size=500.0, grid="square", layer="geojson", max_cells=5000, crs_proj="EPSG:3763"):
+    """
+    Plots unique-user counts of user locations on a Folium map, aggregated
+    onto grid cells per purpose.
 
     Parameters:
     - sp_filtered_freq: DataFrame with at least [location_col, purpose_col, user_col] columns
-    - location_col: Name of the column containing Shapely Point geometries
+    - location_col: Name of the column containing Shapely Point geometries (EPSG:4326)
     - purpose_col: Name of the column specifying the user's purpose (e.g. 'home', 'work')
     - user_col: Name of the column with user IDs
+    - cell_size: Cell size in metres (width across flats for hexagons)
+    - grid: 'square' or 'hex' cells
+    - layer: 'geojson' (one styled polygon layer per purpose) or 'heatmap' (one heatmap per purpose)
+    - max_cells: Cap on the number of cells drawn, so the HTML size stays bounded
 
     Returns:
     - Folium Map object
     """
-    # Step 1: Group and count unique users
-    location_counts = sp_filtered_freq.groupby([location_col, purpose_col])[user_col].nunique().reset_index(name='user_count')
-
-    # Step 2: Compute min and max user counts
-    max_users = location_counts['user_count'].max()
-    min_users = location_counts['user_count'].min()
-
-    # Step 3: Convert to GeoDataFrame
-    gdf = gpd.GeoDataFrame(location_counts, geometry=location_col, crs='EPSG:4326')
-    gdf = gdf.rename(columns={location_col: 'geometry'})
-
-    # Step 4: Create folium map centered on Lisbon (customize as needed)
-    m = folium.Map(location=[38.72, -9.14], zoom_start=12)
-
-    # Step 5: Add circle markers
-    for _, row in gdf.iterrows():
-        color = 'red' if row[purpose_col] == 'home' else 'blue'
-        radius = 1 + (row['user_count'] - min_users) * (20 - 1) / (max_users - min_users) if max_users > min_users else 10
-
-        folium.CircleMarker(
-            location=[row.geometry.y, row.geometry.x],
-            radius=radius,
-            color=color,
-            fill=True,
-            fill_color=color,
-            fill_opacity=0.6,
-            popup=f"{row[purpose_col].capitalize()}<br>{row['user_count']} user(s)"
+    cells = aggregate_user_locations(sp_filtered_freq, location_col, purpose_col, user_col,
+                                     cell_size=cell_size, grid=grid, crs_proj=crs_proj, max_cells=max_cells)
+
+    center = [38.72, -9.14] if cells.empty else [float(cells["lat"].mean()), float(cells["lon"].mean())]
+    m = folium.Map(location=center, zoom_start=12)
+    if cells.empty:
+        return m
+
+    max_users = cells["user_count"].max()
+    for purpose, group in cells.groupby(purpose_col, observed=True, sort=True):
+        color = PURPOSE_COLORS.get(purpose, "gray")
+        name = str(purpose).capitalize()
+        if layer == "heatmap":
+            HeatMap(group[["lat", "lon", "user_count"]].to_numpy().tolist(), name=name, radius=15).add_to(m)
+            continue
+
+        # Styles precomputed as properties: the style function only reads them
+        opacity = (0.2 + 0.6 * np.sqrt(group["user_count"] / max_users)).round(2)
+        features = group[[purpose_col, "user_count", "geometry"]].assign(
+            label=name, fill_opacity=opacity.to_numpy())
+        folium.GeoJson(
+            features.drop(columns=[purpose_col]).to_json(drop_id=True),
+            name=name,
+            style_function=lambda f, color=color: {
+                "color": color, "weight": 0, "fillColor": color,
+                "fillOpacity": f["properties"]["fill_opacity"],
+            },
+            tooltip=folium.GeoJsonTooltip(fields=["label", "user_count"], aliases=["", "Users"]),
         ).add_to(m)
 
+    folium.LayerControl().add_to(m)
     return m